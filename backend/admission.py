@@ -0,0 +1,300 @@
+import asyncio
+import contextvars
+import heapq
+import ipaddress
+import itertools
+import math
+import time
+
+# Admitted tickets that never start waiting (a stream the client dropped
+# before it began) stop counting towards the backlog after this long
+ADMITTED_TTL = 30.0
+
+_user = contextvars.ContextVar("admission_user", default="anonymous")
+_ticket = contextvars.ContextVar("admission_ticket", default=None)
+
+
+class Overloaded(Exception):
+    """The estimated wait for a request is longer than it may queue for."""
+
+    def __init__(self, resource, wait, retry_after):
+        super().__init__(f"{resource} is busy, estimated wait {wait:.0f}s")
+        self.resource = resource
+        self.wait = wait
+        self.retry_after = retry_after
+
+
+class CostModel:
+    """Estimates how many seconds of a model (or worker) a request will take.
+
+    Every endpoint has a resource it queues for, a ``units(params)`` function
+    (steps x megapixels, frames x steps, seconds of audio, ...) and a prior
+    rate in seconds per unit. Rates follow the measured service times as a
+    moving average in log space, each measurement clipped to ``max_ratio``
+    of the current rate so that a cold model load doesn't throw it off.
+    """
+
+    def __init__(self, endpoints, alpha=0.2, max_ratio=4.0):
+        # name -> (resource, units, prior seconds per unit)
+        self.endpoints = endpoints
+        self.alpha = alpha
+        self.max_ratio = max_ratio
+        self.rates = {name: prior for name, (_, _, prior) in endpoints.items()}
+        self.observations = dict.fromkeys(endpoints, 0)
+
+    def resource(self, endpoint):
+        return self.endpoints[endpoint][0]
+
+    def units(self, endpoint, params):
+        return max(float(self.endpoints[endpoint][1](params)), 1e-6)
+
+    def estimate(self, endpoint, units):
+        return self.rates[endpoint] * units
+
+    def observe(self, endpoint, units, seconds):
+        rate = self.rates[endpoint]
+        measured = min(max(seconds / units, rate / self.max_ratio), rate * self.max_ratio)
+        self.rates[endpoint] = math.exp((1 - self.alpha) * math.log(rate) + self.alpha * math.log(measured))
+        self.observations[endpoint] += 1
+
+    def stats(self):
+        return {
+            name: {"resource": self.resource(name), "seconds_per_unit": self.rates[name], "observations": self.observations[name]}
+            for name in self.endpoints
+        }
+
+
+class Ticket:
+    """One request's place in a ``FairQueue``, held with ``async with`` while it runs."""
+
+    def __init__(self, queue, cost_model, endpoint, user, units, cost):
+        self.queue = queue
+        self.cost_model = cost_model
+        self.endpoint = endpoint
+        self.user = user
+        self.units = units
+        self.cost = cost
+        self.tag = 0.0
+        self.admitted = time.monotonic()
+        self.started = None
+        # Lane queue waits while running aren't service time, see ``record_wait``
+        self.waited = 0.0
+        # Off for results that didn't do the work, e.g. result cache hits
+        self.calibrate = True
+        self.granted = None
+        self._token = None
+
+    @property
+    def remaining(self):
+        return max(self.cost - (time.monotonic() - self.started), 0.0)
+
+    async def __aenter__(self):
+        if self.queue is not None:
+            self.granted = asyncio.get_running_loop().create_future()
+            self.queue.enter(self)
+            try:
+                await self.granted
+            except asyncio.CancelledError:
+                # Cancelled just after being given a slot, hand it on
+                if self.granted.done() and not self.granted.cancelled():
+                    self.queue.release(self)
+                raise
+        else:
+            self.started = time.monotonic()
+        self._token = _ticket.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        _ticket.reset(self._token)
+        if self.queue is None:
+            return
+        self.queue.release(self)
+        if exc_type is None and self.calibrate:
+            service = time.monotonic() - self.started - self.waited
+            self.cost_model.observe(self.endpoint, self.units, max(service, 0.0))
+
+
+class FairQueue:
+    """Runs up to ``slots`` tickets at once, picking the next by start-time fair queuing.
+
+    Each ticket is tagged with where its user's work would start on a virtual
+    clock that advances with the estimated cost of what was dispatched, and
+    the lowest tag goes next. Shares are by cost, not request count: someone
+    sending one small request goes ahead of the tenth large one from someone
+    else, so small requests wait about one request's worth however big the
+    backlog is.
+    """
+
+    def __init__(self, name, slots=1):
+        self.name = name
+        self.slots = max(1, slots)
+        self.running = set()
+        self.waiting = []  # heap of (tag, seq, ticket)
+        self.admitted = set()
+        self.vtime = 0.0
+        self.finish = {}  # user -> virtual time their queued work finishes
+        self._seq = itertools.count()
+
+    def _tag(self, user):
+        return max(self.vtime, self.finish.get(user, 0.0))
+
+    def _live_admitted(self):
+        now = time.monotonic()
+        self.admitted = {ticket for ticket in self.admitted if now - ticket.admitted < ADMITTED_TTL}
+        return self.admitted
+
+    def wait_estimate(self, user):
+        """Seconds a new ticket from ``user`` would wait for a slot."""
+        tag = self._tag(user)
+        ahead = [t for _, _, t in self.waiting if not t.granted.cancelled() and t.tag <= tag]
+        ahead += self._live_admitted()
+        if len(self.running) + len(ahead) < self.slots:
+            return 0.0
+        work = sum(t.remaining for t in self.running) + sum(t.cost for t in ahead)
+        return work / self.slots
+
+    def admit(self, ticket):
+        self.admitted.add(ticket)
+
+    def enter(self, ticket):
+        self.admitted.discard(ticket)
+        ticket.tag = self._tag(ticket.user)
+        self.finish[ticket.user] = ticket.tag + ticket.cost
+        heapq.heappush(self.waiting, (ticket.tag, next(self._seq), ticket))
+        self._dispatch()
+
+    def release(self, ticket):
+        self.running.discard(ticket)
+        self._dispatch()
+        if not self.running and not self.waiting:
+            # Idle, nobody is behind or ahead any more
+            self.vtime = max([self.vtime, *self.finish.values()])
+            self.finish.clear()
+
+    def _dispatch(self):
+        while self.waiting and len(self.running) < self.slots:
+            tag, _, ticket = heapq.heappop(self.waiting)
+            if ticket.granted.cancelled():
+                continue
+            self.vtime = max(self.vtime, tag)
+            ticket.started = time.monotonic()
+            self.running.add(ticket)
+            ticket.granted.set_result(None)
+        if len(self.finish) > 1024:
+            # Users whose work is all behind the clock start from it anyway
+            self.finish = {user: end for user, end in self.finish.items() if end > self.vtime}
+
+    def backlog(self):
+        """Estimated seconds of work running and queued, per slot."""
+        queued = sum(t.cost for _, _, t in self.waiting if not t.granted.cancelled())
+        return (sum(t.remaining for t in self.running) + queued) / self.slots
+
+    def stats(self):
+        return {
+            "slots": self.slots,
+            "running": len(self.running),
+            "waiting": sum(1 for _, _, t in self.waiting if not t.granted.cancelled()),
+            "backlog_seconds": round(self.backlog(), 2),
+        }
+
+
+class AdmissionController:
+    """Rejects requests that would queue too long, and schedules the rest fairly.
+
+    ``admit`` estimates the request's cost and its wait in its resource's
+    ``FairQueue`` and raises ``Overloaded`` past ``max_wait``. The returned
+    ticket is then held with ``async with`` around the work, which waits for
+    a slot and afterwards feeds the measured time back into the cost model.
+    Endpoints the cost model doesn't know, and everything when disabled,
+    run unscheduled.
+    """
+
+    def __init__(self, cost_model, slots, enabled=True):
+        self.cost_model = cost_model
+        self.enabled = enabled
+        resources = {resource for resource, _, _ in cost_model.endpoints.values()}
+        self.queues = {resource: FairQueue(resource, slots.get(resource, 1)) for resource in resources}
+        self.rejected = dict.fromkeys(cost_model.endpoints, 0)
+
+    def admit(self, endpoint, params, max_wait=None):
+        if not self.enabled or endpoint not in self.cost_model.endpoints:
+            return Ticket(None, self.cost_model, endpoint, current_user(), 0.0, 0.0)
+        queue = self.queues[self.cost_model.resource(endpoint)]
+        units = self.cost_model.units(endpoint, params)
+        ticket = Ticket(queue, self.cost_model, endpoint, current_user(), units, self.cost_model.estimate(endpoint, units))
+        wait = queue.wait_estimate(ticket.user)
+        if max_wait is not None and wait > max_wait:
+            self.rejected[endpoint] += 1
+            raise Overloaded(queue.name, wait, max(1, math.ceil(wait - max_wait)))
+        queue.admit(ticket)
+        return ticket
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "resources": {name: queue.stats() for name, queue in sorted(self.queues.items())},
+            "endpoints": {
+                name: dict(stats, rejected=self.rejected[name]) for name, stats in self.cost_model.stats().items()
+            },
+        }
+
+
+def current_user():
+    return _user.get()
+
+
+def record_wait(seconds):
+    """Count ``seconds`` spent queued behind other work as not part of the current ticket's service time."""
+    ticket = _ticket.get()
+    if ticket is not None:
+        ticket.waited += seconds
+
+
+def skip_calibration():
+    """Keep the current ticket out of the cost model, its result came without doing the work."""
+    ticket = _ticket.get()
+    if ticket is not None:
+        ticket.calibrate = False
+
+
+class UserMiddleware:
+    """Sets who each request is scheduled as.
+
+    Clients can't be trusted to name themselves, anyone could send a fresh
+    ``X-User-Id`` or ``X-Forwarded-For`` with every request for a fresh fair
+    share. Those headers only count on requests from ``trusted_proxies``
+    (addresses or networks, e.g. the gateway): ``X-User-Id``, else the
+    address in ``X-Forwarded-For`` just before the trusted hops. Everyone
+    else is scheduled as their own address.
+    """
+
+    def __init__(self, app, header="x-user-id", trusted_proxies=()):
+        self.app = app
+        self.header = header.lower().encode()
+        self.trusted_proxies = [ipaddress.ip_network(proxy, strict=False) for proxy in trusted_proxies]
+
+    def trusted(self, address):
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        client = scope["client"][0] if scope.get("client") else ""
+        user = client
+        if self.trusted(client):
+            headers = dict(scope["headers"])
+            user = headers.get(self.header, b"").decode("latin-1").strip()
+            if not user:
+                # Each proxy appends who it got the request from, the first untrusted hop from the right is the client
+                hops = [hop.strip() for hop in headers.get(b"x-forwarded-for", b"").decode("latin-1").split(",") if hop.strip()]
+                user = next((hop for hop in reversed(hops) if not self.trusted(hop)), client)
+        token = _user.set(user or "anonymous")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _user.reset(token)
@@ -0,0 +1,29 @@
+import struct
+
+import numpy as np
+
+# Data size used in streamed WAV headers, players read until the connection closes
+STREAMING_SIZE = 0xFFFFFFFF - 36
+
+
+def as_numpy(audio):
+    if hasattr(audio, "detach"):
+        audio = audio.detach().cpu().numpy()
+    return np.asarray(audio, dtype=np.float32).reshape(-1)
+
+
+def to_pcm16(audio):
+    return (np.clip(as_numpy(audio), -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def wav_header(sample_rate, channels=1, data_size=STREAMING_SIZE):
+    """44-byte header for 16-bit PCM WAV, sized for streaming unless ``data_size`` is given."""
+    byte_rate = sample_rate * channels * 2
+    return b"".join([
+        b"RIFF",
+        struct.pack("<I", min(data_size + 36, 0xFFFFFFFF)),
+        b"WAVEfmt ",
+        struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, byte_rate, channels * 2, 16),
+        b"data",
+        struct.pack("<I", data_size),
+    ])
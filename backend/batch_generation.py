@@ -0,0 +1,79 @@
+import random
+import threading
+
+import torch
+
+
+def item_seeds(count, seed=None, seeds=None):
+    """One seed per output: ``seeds`` as given, else counting up from ``seed``, else random.
+
+    Random seeds are drawn here rather than left to the pipeline, so every
+    output of a batch can be reproduced on its own.
+    """
+    if seeds:
+        return list(seeds)
+    if seed is not None and seed >= 0:
+        return [seed + i for i in range(count)]
+    rng = random.SystemRandom()
+    return [rng.randrange(2 ** 32) for _ in range(count)]
+
+
+def is_out_of_memory(error):
+    # Allocator failures outside the CUDA caching allocator (cuDNN/cuBLAS workspaces) come as plain RuntimeErrors
+    return isinstance(error, torch.cuda.OutOfMemoryError) or (isinstance(error, RuntimeError) and "out of memory" in str(error))
+
+
+class ChunkSizes:
+    """How many outputs one pipeline call generates, per model and output shape.
+
+    Every shape starts at ``max_chunk``. A chunk that runs out of GPU memory
+    is retried at half the size, and the smaller size is kept for that shape
+    so later batches don't hit the same wall.
+    """
+
+    def __init__(self, max_chunk):
+        self.max_chunk = max(1, max_chunk)
+        self.fallbacks = 0
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._sizes.get(key, self.max_chunk)
+
+    def shrink(self, key, failed):
+        with self._lock:
+            size = max(1, min(failed // 2, self._sizes.get(key, self.max_chunk)))
+            self._sizes[key] = size
+            self.fallbacks += 1
+            return size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_chunk": self.max_chunk,
+                "fallbacks": self.fallbacks,
+                "sizes": dict(self._sizes),
+            }
+
+
+async def run_chunked(items, chunk_sizes, key, run_chunk):
+    """Outputs for ``items`` in order, ``await run_chunk(chunk)`` returning one output per item.
+
+    Chunks are sized by ``chunk_sizes`` for ``key``. Out of memory errors
+    shrink the chunk and retry it, only a single item that doesn't fit fails
+    the batch.
+    """
+    outputs = []
+    while len(outputs) < len(items):
+        chunk = items[len(outputs):len(outputs) + chunk_sizes.get(key)]
+        try:
+            outputs.extend(await run_chunk(chunk))
+        except Exception as e:
+            if not is_out_of_memory(e) or len(chunk) == 1:
+                raise
+            size = chunk_sizes.shrink(key, len(chunk))
+            print(f"Out of memory generating {len(chunk)} at once, retrying in chunks of {size}")
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+    return outputs
@@ -0,0 +1,90 @@
+import asyncio
+
+
+class MicroBatcher:
+    """Collects concurrent requests for a short window and runs them as one batch.
+
+    Requests are grouped by ``key`` (only requests with the same key can share a
+    forward pass). ``run_batch(key, items)`` is awaited with up to
+    ``max_batch_size`` items and must return one result per item, in order.
+
+    With ``max_inflight`` set, at most that many batches run at once. Requests
+    arriving meanwhile keep collecting and go as one batch as soon as a
+    running one finishes, so batches grow with load instead of queueing up
+    behind each other in small pieces.
+    """
+
+    def __init__(self, run_batch, max_batch_size=4, max_wait=0.05, max_inflight=None):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.batches_run = 0
+        self.items_run = 0
+        self._pending = {}
+        self._timers = {}
+
+    async def submit(self, key, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        bucket = self._pending.setdefault(key, [])
+        bucket.append((item, future))
+
+        if len(bucket) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+
+        return await future
+
+    def pending(self):
+        return sum(len(bucket) for bucket in self._pending.values())
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if self.max_inflight is not None and self.inflight >= self.max_inflight:
+            # Flushed again when a running batch finishes
+            return
+
+        bucket = self._pending.get(key, [])
+        batch = bucket[:self.max_batch_size]
+        rest = bucket[self.max_batch_size:]
+        if rest:
+            self._pending[key] = rest
+            loop = asyncio.get_running_loop()
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        else:
+            self._pending.pop(key, None)
+
+        # Requests whose client already gave up don't need a slot in the batch
+        batch = [(item, future) for item, future in batch if not future.cancelled()]
+        if batch:
+            self.inflight += 1
+            asyncio.ensure_future(self._run(key, batch))
+
+    async def _run(self, key, batch):
+        try:
+            await self._run_batch(key, batch)
+        finally:
+            self.inflight -= 1
+            while self.max_inflight is not None and self._pending and self.inflight < self.max_inflight:
+                self._flush(next(iter(self._pending)))
+
+    async def _run_batch(self, key, batch):
+        items = [item for item, _ in batch]
+        try:
+            results = await self.run_batch(key, items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches_run += 1
+        self.items_run += len(batch)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,105 @@
+"""Small requests under overload, with and without admission control.
+
+    python benchmarks/bench_admission.py --heavy-clients 8 --duration 30
+
+Runs the server on stub models (``stubs.py``). One user floods ``/text2img/``
+with large renders from ``--heavy-clients`` concurrent clients while another
+sends a small render every ``--light-interval`` seconds. With admission
+control off, every request waits in the image lane's FIFO, and the small
+ones queue behind the whole flood. With it on, the small user's requests go
+ahead by fair share, and the flood is held to ``ADMISSION_MAX_WAIT_SECONDS``
+with 429s.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import stubs  # noqa: E402
+from loadtest import summarize  # noqa: E402
+
+HEAVY = {"prompt": "a crowded market at night", "height": "1024", "width": "1024", "steps": "50"}
+LIGHT = {"prompt": "a red circle", "height": "512", "width": "512", "steps": "4"}
+
+
+async def scenario(server, args, enabled):
+    import httpx
+
+    server.admission.enabled = enabled
+    results = {"heavy": [], "light": [], "heavy_rejected": 0, "light_rejected": 0, "retry_after": []}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        deadline = time.perf_counter() + args.duration
+
+        async def send(kind, data):
+            start = time.perf_counter()
+            response = await client.post("/text2img/", data=data, headers={"X-User-Id": kind})
+            if response.status_code == 429:
+                results[f"{kind}_rejected"] += 1
+                results["retry_after"].append(int(response.headers["retry-after"]))
+                return float(response.headers["retry-after"])
+            response.raise_for_status()
+            results[kind].append(time.perf_counter() - start)
+            return 0.0
+
+        async def heavy():
+            while time.perf_counter() < deadline:
+                # A well-behaved client backs off as told, a real flood wouldn't
+                await asyncio.sleep(min(await send("heavy", HEAVY), args.max_backoff))
+
+        async def light():
+            while time.perf_counter() < deadline:
+                await send("light", LIGHT)
+                await asyncio.sleep(args.light_interval)
+
+        await asyncio.gather(light(), *[heavy() for _ in range(args.heavy_clients)])
+    return results
+
+
+async def run(args, server):
+    async with server.app.router.lifespan_context(server.app):
+        # Load the model and give the cost model a few measurements to calibrate on
+        server.admission.enabled = True
+        import httpx
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            await stubs.wait_ready(client)
+            for data in [LIGHT, HEAVY, LIGHT, HEAVY]:
+                (await client.post("/text2img/", data=data)).raise_for_status()
+        rate = server.admission.cost_model.rates["text2img"]
+        print(f"text2img calibrated to {rate:.3f}s per megapixel step")
+
+        print(f"\n{'admission':<11}{'light ok':>9}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}"
+              f"{'heavy ok':>10}{'p95 ms':>9}{'429s':>6}")
+        for enabled in [False, True]:
+            results = await scenario(server, args, enabled)
+            light, heavy = summarize(results["light"]), summarize(results["heavy"])
+            print(f"{'on' if enabled else 'off':<11}{light['count']:>9}{light['p50'] * 1000:>9.0f}{light['p95'] * 1000:>9.0f}"
+                  f"{light['max'] * 1000:>9.0f}{heavy['count']:>10}{heavy['p95'] * 1000:>9.0f}"
+                  f"{results['heavy_rejected'] + results['light_rejected']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--heavy-clients", type=int, default=8)
+    parser.add_argument("--light-interval", type=float, default=0.5)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--max-wait", type=float, default=10.0, help="ADMISSION_MAX_WAIT_SECONDS for the run")
+    parser.add_argument("--max-backoff", type=float, default=2.0, help="cap on how long heavy clients honour Retry-After")
+    stubs.add_timing_arguments(parser)
+    args = parser.parse_args()
+
+    stubs.prepare()
+    os.environ["ADMISSION_MAX_WAIT_SECONDS"] = str(args.max_wait)
+    import server
+
+    stubs.install(server, stubs.timings_from_args(args))
+    asyncio.run(run(args, server))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Compare the animation encoders with diffusers' ``export_to_gif``.
+
+    python benchmarks/bench_animation.py --frames 100 --size 512
+
+``export_to_gif`` lets Pillow quantize a palette for every frame on one
+thread. The GIF encoder here quantizes once from sampled frames and maps
+the frames onto it in parallel, WebP and MP4 are the smaller alternatives
+behind the ``format`` request parameter. MP4 is skipped without ffmpeg.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from media import ANIMATION_ENCODERS, ffmpeg_available  # noqa: E402
+
+
+def make_frames(count, size):
+    # A gradient drifting across the frame with a little noise, roughly like AnimateDiff output
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:size, 0:size]
+    frames = []
+    for i in range(count):
+        base = np.stack([(x + 4 * i) * 255 // size, y * 255 // size, (x + y + 8 * i) % 256], axis=-1)
+        frames.append(Image.fromarray(np.clip(base + rng.integers(-8, 8, base.shape), 0, 255).astype(np.uint8)))
+    return frames
+
+
+def export_to_gif(frames, fps=10):
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format="GIF", save_all=True, append_images=frames[1:], optimize=False, duration=1000 // fps, loop=0)
+    return buffer.getbuffer().nbytes
+
+
+def timed(fn, repeat):
+    best, size = float("inf"), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    frames = make_frames(args.frames, args.size)
+    baseline, baseline_size = timed(lambda: export_to_gif(frames), args.repeat)
+    print(f"{'export_to_gif':<14} {baseline_size / 1e6:7.2f} MB  {baseline:6.2f}s")
+    for format, (encode, _) in ANIMATION_ENCODERS.items():
+        if format == "mp4" and not ffmpeg_available():
+            print(f"{format:<14} skipped, ffmpeg not found")
+            continue
+
+        def run():
+            media = encode(frames)
+            media.close()
+            return media.size
+
+        seconds, size = timed(run, args.repeat)
+        print(f"{format:<14} {size / 1e6:7.2f} MB  {seconds:6.2f}s  ({baseline / seconds:.2f}x faster, {baseline_size / size:.2f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
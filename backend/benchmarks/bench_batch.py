@@ -0,0 +1,73 @@
+"""Images per second from the batch route against one request per image.
+
+    python benchmarks/bench_batch.py --images 8 --chunks 1,2,4,8 --step-batch-cost 0.3
+
+Runs the server on stub models (``stubs.py``). Generates ``--images`` images
+of one prompt as that many ``/text2img/`` requests in a row, then as one
+``/text2img-batch/`` request at each chunk size. The stub prices a batched
+step with ``--step-batch-cost``, so the numbers follow whatever batching
+gain that assumes. Chunks over ``--max-batch`` run out of memory and fall
+back to smaller ones.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import stubs  # noqa: E402
+
+PROMPT = "a lighthouse at dusk, waves crashing on the rocks"
+
+
+async def run(args, server):
+    import httpx
+    from batch_generation import ChunkSizes
+
+    data = {"height": "512", "width": "512", "steps": str(args.steps)}
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            await stubs.wait_ready(client)
+            (await client.post("/text2img/", data=dict(data, prompt=PROMPT, steps="1"))).raise_for_status()
+
+            print(f"{'run':<26}{'seconds':>9}{'images/s':>10}")
+            start = time.perf_counter()
+            for seed in range(args.images):
+                response = await client.post("/text2img/", data=dict(data, prompt=PROMPT, seed=str(seed)))
+                response.raise_for_status()
+            seconds = time.perf_counter() - start
+            print(f"{'sequential':<26}{seconds:>9.2f}{args.images / seconds:>10.2f}")
+
+            for chunk in (int(c) for c in args.chunks.split(",")):
+                server.image_chunks = ChunkSizes(chunk)
+                start = time.perf_counter()
+                response = await client.post("/text2img-batch/", data=dict(data, prompt=PROMPT, num_images_per_prompt=str(args.images), seed="0"))
+                response.raise_for_status()
+                seconds = time.perf_counter() - start
+                fallback = server.image_chunks.stats()["sizes"].get("image 512x512")
+                label = f"batch, chunks of {chunk}" + (f" -> {fallback}" if fallback else "")
+                print(f"{label:<26}{seconds:>9.2f}{args.images / seconds:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--chunks", default="1,2,4,8")
+    parser.add_argument("--steps", type=int, default=20)
+    stubs.add_timing_arguments(parser)
+    args = parser.parse_args()
+
+    stubs.prepare()
+    os.environ["BATCH_MAX_ITEMS"] = str(max(16, args.images))
+    import server
+
+    stubs.install(server, stubs.timings_from_args(args))
+    asyncio.run(run(args, server))
+
+
+if __name__ == "__main__":
+    main()
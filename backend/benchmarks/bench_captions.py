@@ -0,0 +1,76 @@
+"""Phi-4 caption throughput by batch size and token budget.
+
+    python benchmarks/bench_captions.py --images photos/*.jpg --batch-sizes 1,2,4,8 --max-new-tokens 96
+
+Captions the images with ``caption_batch`` at each batch size and reports
+images/s and tokens/s, then captions one image the old way (alone, with a
+budget of 1000 tokens) for comparison. Needs the Phi-4 weights and a GPU.
+Without ``--images`` it captions generated test pictures.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image, ImageDraw
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import loaders  # noqa: E402
+from captions import DEFAULT_CAPTION_PROMPT, caption_batch  # noqa: E402
+
+
+def test_images(count):
+    directory = tempfile.mkdtemp(prefix="captions-")
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        image = Image.new("RGB", (512, 512), tuple(int(c) for c in rng.integers(0, 256, 3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(6):
+            x, y, size = (int(v) for v in rng.integers(0, 400, 3))
+            draw.ellipse((x, y, x + size // 2 + 20, y + size // 2 + 20), fill=tuple(int(c) for c in rng.integers(0, 256, 3)))
+        path = os.path.join(directory, f"{i}.png")
+        image.save(path)
+        paths.append(path)
+    return paths
+
+
+def run(phi, paths, max_new_tokens):
+    torch.cuda.synchronize()
+    start = time.perf_counter()
+    images = [Image.open(path).convert("RGB") for path in paths]
+    captions, tokens = caption_batch(phi, images, [DEFAULT_CAPTION_PROMPT] * len(paths), max_new_tokens)
+    torch.cuda.synchronize()
+    return time.perf_counter() - start, captions, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", nargs="*")
+    parser.add_argument("--batch-sizes", default="1,2,4,8")
+    parser.add_argument("--max-new-tokens", type=int, default=96)
+    args = parser.parse_args()
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    paths = args.images or test_images(max(batch_sizes))
+
+    phi = loaders.load_phi()
+    run(phi, paths[:1], 8)  # warm up
+
+    print(f"{'batch':>6}{'seconds':>9}{'images/s':>10}{'tokens/s':>10}{'tokens':>8}")
+    for size in batch_sizes:
+        batch = (paths * size)[:size]
+        seconds, captions, tokens = run(phi, batch, args.max_new_tokens)
+        print(f"{size:>6}{seconds:>9.2f}{size / seconds:>10.2f}{sum(tokens) / seconds:>10.0f}{sum(tokens):>8}")
+
+    seconds, captions, tokens = run(phi, paths[:1], 1000)
+    print(f"\nunbounded single caption: {seconds:.2f}s, {tokens[0]} tokens")
+    print(captions[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Compare fp32 and int8 Kokoro/MusicGen on CPU, as served by SERVING_TIER=cpu.
+
+    python benchmarks/bench_cpu_tier.py --threads 8 --music-seconds 5 --repeat 3
+
+Loads each model as the GPU tier would (``load_speech``/``load_music``, forced
+onto the CPU) and as the CPU tier does (``load_speech_int8``/``load_music_int8``),
+then times the same text and a seeded MusicGen clip with both. Needs the model
+weights, which are downloaded on first use.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+# The baseline loaders pick CUDA when they can see it
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import loaders  # noqa: E402
+from audio import as_numpy  # noqa: E402
+from music import generate_music_batch, tokens_for_duration  # noqa: E402
+
+TEXT = (
+    "The lighthouse keeper climbed the stairs one last time. "
+    "Below him the harbour lights flickered on, one by one. "
+    "He wound the clock, lit the lamp, and waited for the ships."
+)
+
+
+def state_mb(module):
+    # Quantized Linear weights are packed params, not parameters, so measure the serialized state
+    buffer = io.BytesIO()
+    torch.save(module.state_dict(), buffer)
+    return buffer.tell() / 1e6
+
+
+def timed(fn, repeat):
+    fn()  # warm up allocators and kernels
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = fn()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)), output
+
+
+def speech(pipeline, repeat):
+    def synthesize():
+        return np.concatenate([as_numpy(audio) for _, _, audio in pipeline(TEXT, voice="af_heart")])
+    seconds, audio = timed(synthesize, repeat)
+    return seconds, len(audio) / 24000
+
+
+def music(processor, model, duration, repeat):
+    def generate():
+        return generate_music_batch(processor, model, ["calm lo-fi piano with soft drums"], tokens_for_duration(duration), seed=0)[0]
+    seconds, audio = timed(generate, repeat)
+    return seconds, len(audio) / model.config.audio_encoder.sampling_rate
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--music-seconds", type=float, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+    print(f"{args.threads} threads, quantized engine {torch.backends.quantized.engine}")
+
+    print(f"\n{'model':<16}{'size MB':>9}{'latency s':>11}{'audio s':>9}{'RTF':>7}")
+    results = {}
+    for name, load, run in [
+        ("kokoro fp32", loaders.load_speech, lambda m: speech(m, args.repeat)),
+        ("kokoro int8", loaders.load_speech_int8, lambda m: speech(m, args.repeat)),
+        ("musicgen fp32", loaders.load_music, lambda m: music(*m, args.music_seconds, args.repeat)),
+        ("musicgen int8", loaders.load_music_int8, lambda m: music(*m, args.music_seconds, args.repeat)),
+    ]:
+        model = load()
+        size = state_mb(model.model if name.startswith("kokoro") else model[1])
+        with torch.inference_mode():
+            latency, audio_seconds = run(model)
+        results[name] = latency
+        print(f"{name:<16}{size:>9.0f}{latency:>11.2f}{audio_seconds:>9.1f}{latency / audio_seconds:>7.2f}")
+        del model
+
+    for family in ["kokoro", "musicgen"]:
+        print(f"{family} int8 is {results[f'{family} fp32'] / results[f'{family} int8']:.2f}x the speed of fp32")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Route a request mix through gateway.py across stub replicas.
+
+    python benchmarks/bench_gateway.py --replicas "text2img,text2animation;text2img;text2speech,text2music" --requests 60
+
+Each ``;``-separated group starts a ``stub_server.py`` replica that serves
+those endpoints (empty for all of them). Requests go through the gateway
+in this process, halfway through ``--kill`` replicas are terminated to show
+failover, and the report has where each endpoint was routed and how many
+requests failed.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import stubs  # noqa: E402
+from loadtest import ENDPOINTS, LoadTest, make_uploads, summarize  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_replica(endpoints, args):
+    port = free_port()
+    env = dict(os.environ, SERVED_ENDPOINTS=endpoints)
+    timings = [f"--{field.replace('_', '-')}={getattr(args, field)}" for field in vars(stubs.StubTimings())]
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, "stub_server.py"), "--port", str(port), *timings], env=env)
+    return f"http://127.0.0.1:{port}", process
+
+
+async def run(args, groups):
+    import httpx
+
+    replicas = [start_replica(group, args) for group in groups]
+    try:
+        async with httpx.AsyncClient() as client:
+            await asyncio.gather(*[stubs.wait_ready(client, url) for url, _ in replicas])
+
+        os.environ["GATEWAY_REPLICAS"] = ",".join(url for url, _ in replicas)
+        os.environ["GATEWAY_POLL_SECONDS"] = str(args.poll)
+        import gateway
+
+        served = set().union(*[set(group.split(",")) if group else set(ENDPOINTS) for group in groups])
+        mix = dict.fromkeys([name for name in ENDPOINTS if name in served], 1.0)
+        transport = httpx.ASGITransport(app=gateway.app)
+        async with gateway.app.router.lifespan_context(gateway.app):
+            routes = defaultdict(Counter)
+
+            async def record_route(response):
+                # The gateway names the replica that answered
+                routes[response.request.url.path.strip("/")][response.headers.get("x-cre8-replica", "none")] += 1
+
+            async with httpx.AsyncClient(transport=transport, base_url="http://gateway", timeout=None,
+                                         event_hooks={"response": [record_route]}) as client:
+                test = LoadTest(client, mix, make_uploads(args.uploads), args.seed)
+                start = time.perf_counter()
+                await test.closed(args.concurrency, args.requests // 2)
+                for url, process in replicas[:args.kill]:
+                    print(f"killing {url}")
+                    process.terminate()
+                await test.closed(args.concurrency, args.requests - args.requests // 2)
+                wall = time.perf_counter() - start
+                states = [replica.describe() for replica in gateway.gateway.replicas]
+    finally:
+        for _, process in replicas:
+            process.terminate()
+            process.wait()
+
+    print(f"\n{test.completed} ok in {wall:.1f}s, {sum(test.errors.values())} errors")
+    print(f"\n{'endpoint':<16}{'ok':>5}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}  routed to")
+    for name in mix:
+        stats = summarize(test.latencies[name])
+        routed = ", ".join(f"{url.rsplit(':', 1)[1]}={count}" for url, count in routes[name].most_common())
+        print(f"{name:<16}{stats['count']:>5}{test.errors[name]:>8}{stats['p50'] * 1000:>9.0f}{stats['p95'] * 1000:>9.0f}  {routed}")
+    print(f"\n{'replica':<28}{'serves':<40}{'routed':>7}{'failures':>9}")
+    for group, state in zip(groups, states):
+        print(f"{state['url']:<28}{group or 'all':<40}{state['routed']:>7}{state['failures']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", default="text2img,text2animation;text2img,text2animation;text2speech,text2music",
+                        help="';'-separated SERVED_ENDPOINTS per replica")
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--kill", type=int, default=1, help="replicas to terminate halfway")
+    parser.add_argument("--poll", type=float, default=0.5, help="gateway status poll interval")
+    parser.add_argument("--uploads", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    stubs.add_timing_arguments(parser)
+    args = parser.parse_args()
+    asyncio.run(run(args, args.replicas.split(";")))
+
+
+if __name__ == "__main__":
+    main()
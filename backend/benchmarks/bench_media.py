@@ -0,0 +1,115 @@
+"""Compare writing outputs to disk and serving the file with encoding in memory.
+
+    python benchmarks/bench_media.py --requests 20 --concurrency 4
+
+Each case encodes a synthetic PNG, WAV and GIF and serves it through a small
+ASGI app: once the old way (save to a work directory, ``FileResponse``, remove
+the directory afterwards) and once with ``media.MediaResponse``. Encoding
+is the same in both, so the difference is the disk round trip.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+import soundfile as sf
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.responses import FileResponse
+from starlette.routing import Route
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from media import encode_gif, encode_png, encode_wav, media_response  # noqa: E402
+
+
+def make_inputs(size, frames):
+    # Smooth gradients with a little noise compress about like generated images
+    rng = np.random.default_rng(0)
+
+    def picture(n, shift=0):
+        y, x = np.mgrid[0:n, 0:n]
+        base = np.stack([x * 255 // n, y * 255 // n, (x + y + shift) % 256], axis=-1)
+        return Image.fromarray(np.clip(base + rng.integers(-8, 8, base.shape), 0, 255).astype(np.uint8))
+
+    image = picture(size)
+    audio = np.sin(np.linspace(0, 440 * 2 * np.pi * 10, 32000 * 10)).astype(np.float32) * 0.1
+    animation = [picture(size // 2, 16 * i) for i in range(frames)]
+    return image, audio, animation
+
+
+def build_app(root, image, audio, animation):
+    def to_disk(kind):
+        workdir = tempfile.mkdtemp(dir=root)
+        if kind == "png":
+            path = os.path.join(workdir, "output.png")
+            image.save(path)
+            media_type = "image/png"
+        elif kind == "wav":
+            path = os.path.join(workdir, "output.wav")
+            sf.write(path, audio, 32000, subtype="FLOAT")
+            media_type = "audio/wav"
+        else:
+            path = os.path.join(workdir, "animation.gif")
+            animation[0].save(path, save_all=True, append_images=animation[1:], optimize=False, duration=100, loop=0)
+            media_type = "image/gif"
+        return FileResponse(path, media_type=media_type, filename=os.path.basename(path),
+                            background=BackgroundTask(shutil.rmtree, workdir, ignore_errors=True))
+
+    def in_memory(kind):
+        if kind == "png":
+            return media_response(encode_png(image))
+        if kind == "wav":
+            return media_response(encode_wav(audio, 32000, subtype="FLOAT"))
+        return media_response(encode_gif(animation))
+
+    async def disk(request):
+        return await asyncio.to_thread(to_disk, request.path_params["kind"])
+
+    async def memory(request):
+        return await asyncio.to_thread(in_memory, request.path_params["kind"])
+
+    return Starlette(routes=[Route("/disk/{kind}", disk), Route("/memory/{kind}", memory)])
+
+
+async def measure(app, path, requests, concurrency):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        response = await client.get(path)
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with limit:
+                (await client.get(path)).raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(requests)])
+        return (time.perf_counter() - start) / requests, len(response.content)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--frames", type=int, default=16)
+    args = parser.parse_args()
+
+    inputs = make_inputs(args.size, args.frames)
+    with tempfile.TemporaryDirectory() as root:
+        app = build_app(root, *inputs)
+        for kind in ["png", "wav", "gif"]:
+            disk, size = asyncio.run(measure(app, f"/disk/{kind}", args.requests, args.concurrency))
+            memory, _ = asyncio.run(measure(app, f"/memory/{kind}", args.requests, args.concurrency))
+            print(f"{kind}  {size / 1e6:6.2f} MB  write+serve {disk * 1000:7.1f}ms  in memory {memory * 1000:7.1f}ms per request ({disk / memory:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
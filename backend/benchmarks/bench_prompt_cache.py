@@ -0,0 +1,75 @@
+"""Time the text encoders against the prompt-embedding cache.
+
+    python benchmarks/bench_prompt_cache.py --model image --repeat 5
+
+Loads the model as the server does and encodes a few prompts the way its
+pipeline would (prompt plus negative prompt, with classifier-free guidance),
+then fetches the same embeddings through ``PromptEmbeddingCache``. Needs the
+model weights and, for SD3.5, a GPU.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import loaders  # noqa: E402
+from prompt_cache import PromptEmbeddingCache  # noqa: E402
+
+PROMPTS = [
+    "a lighthouse at dusk, waves crashing on the rocks",
+    "a cat walking in the snow, cinematic lighting, highly detailed",
+    "portrait of an old fisherman, oil painting, warm palette",
+]
+NEGATIVE = "bad quality, worse quality"
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        synchronize()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", choices=["image", "animation"], default="image")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pipe = loaders.load_image() if args.model == "image" else loaders.load_animation()
+    fingerprint = loaders.MODEL_FINGERPRINTS[args.model]
+    cache = PromptEmbeddingCache(512 * 2 ** 20)
+    if args.model == "image":
+        uncached = lambda prompt: pipe.encode_prompt(prompt, None, None, device=pipe.device, negative_prompt=NEGATIVE)  # noqa: E731
+        cached = lambda prompt: cache.sd3_embeds(pipe, fingerprint, prompt, NEGATIVE)  # noqa: E731
+    else:
+        uncached = lambda prompt: pipe.encode_prompt(prompt, pipe.device, 1, True, NEGATIVE)  # noqa: E731
+        cached = lambda prompt: cache.animatediff_embeds(pipe, fingerprint, prompt, NEGATIVE)  # noqa: E731
+
+    print(f"{'prompt':<52}{'encode ms':>11}{'cached ms':>11}")
+    with torch.no_grad():
+        for prompt in PROMPTS:
+            uncached(prompt)  # warm up kernels
+            cached(prompt)  # fills the cache
+            encode = median_ms(lambda: uncached(prompt), args.repeat)
+            hit = median_ms(lambda: cached(prompt), args.repeat)
+            print(f"{prompt[:50]:<52}{encode:>11.1f}{hit:>11.2f}")
+    print(f"\n{cache.stats()['entries']} entries, {cache.stats()['bytes'] / 2 ** 20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
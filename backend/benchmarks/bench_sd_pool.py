@@ -0,0 +1,77 @@
+"""Compare one sd process per request with the warm sd.cpp worker pool.
+
+    python benchmarks/bench_sd_pool.py --requests 10 --load-seconds 2 --render-seconds 0.5
+
+Both paths use fake stand-ins that sleep for the given load/render times, so
+the difference is the model loading the pool avoids.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from sd_pool import WORKER_SCRIPT, SDModelKey, SDWorkerPool  # noqa: E402
+
+
+def per_request_subprocess(args, workdir):
+    timings = []
+    for i in range(args.requests):
+        start = time.perf_counter()
+        subprocess.run([
+            sys.executable, os.path.join(HERE, "fake_sd.py"),
+            "--mode", "img2img",
+            "-m", "fake.ckpt",
+            "-o", os.path.join(workdir, f"subprocess-{i}.png"),
+            "--fake-load-seconds", str(args.load_seconds),
+            "--fake-render-seconds", str(args.render_seconds),
+        ], check=True, capture_output=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def worker_pool(args, workdir):
+    pool = SDWorkerPool(command=[
+        sys.executable, WORKER_SCRIPT,
+        "--engine", "fake",
+        "--fake-load-seconds", str(args.load_seconds),
+        "--fake-render-seconds", str(args.render_seconds),
+    ])
+    key = SDModelKey("fake.ckpt")
+    timings = []
+    try:
+        for i in range(args.requests):
+            start = time.perf_counter()
+            await pool.img2img(key, prompt="", init_image="", output=os.path.join(workdir, f"pool-{i}.png"), width=64, height=64)
+            timings.append(time.perf_counter() - start)
+    finally:
+        await pool.shutdown()
+    return timings
+
+
+def summary(name, timings):
+    mean = sum(timings) / len(timings)
+    print(f"{name:<22} first {timings[0]:.3f}s  mean {mean:.3f}s  total {sum(timings):.2f}s")
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--load-seconds", type=float, default=2.0)
+    parser.add_argument("--render-seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        baseline = summary("subprocess per request", per_request_subprocess(args, workdir))
+        pooled = summary("warm worker pool", asyncio.run(worker_pool(args, workdir)))
+    print(f"saved per request: {baseline - pooled:.3f}s ({baseline / pooled:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
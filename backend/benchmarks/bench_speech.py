@@ -0,0 +1,94 @@
+"""Kokoro throughput on long texts, sequential against ``SpeechEngine``.
+
+    python benchmarks/bench_speech.py --sizes 1000,10000,50000 --workers 1,4
+
+For each text size, synthesizes the same generated narration by calling
+``KPipeline`` directly (one segment after another, as the server used to)
+and through ``SpeechEngine`` with each worker count, once with a cold
+phoneme cache and once warm. Reports characters/s and the real-time factor.
+Needs the Kokoro weights, ``--stub`` runs against the load-test stub instead.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from audio import as_numpy  # noqa: E402
+from speech import SpeechEngine  # noqa: E402
+
+SAMPLE_RATE = 24000
+VOICE = "af_heart"
+
+SUBJECTS = ["The keeper", "An old sailor", "The harbour master", "A young girl", "The fisherman", "Her brother"]
+VERBS = ["watched", "followed", "remembered", "painted", "described", "ignored"]
+OBJECTS = ["the grey waves", "the distant ships", "the lamp above the rocks", "the gulls over the pier", "the storm clouds", "the quiet town"]
+ENDINGS = ["before the sun went down.", "for a long time.", "without saying a word.", "as the tide came in.", "until the bells rang.", "and smiled."]
+
+
+def narration(characters, seed=0):
+    """Text of about ``characters`` length, mostly distinct sentences like a real script."""
+    rng = random.Random(seed)
+    sentences, length = [], 0
+    while length < characters:
+        sentence = f"{rng.choice(SUBJECTS)} {rng.choice(VERBS)} {rng.choice(OBJECTS)} {rng.choice(ENDINGS)}"
+        sentences.append(sentence)
+        length += len(sentence) + 1
+        if rng.random() < 0.15:
+            sentences.append("\n")
+    return " ".join(sentences)
+
+
+def sequential(pipeline, text):
+    return np.concatenate([as_numpy(audio) for _, _, audio in pipeline(text, voice=VOICE)])
+
+
+def engine_run(engine, pipeline, text):
+    return np.concatenate([audio for _, _, audio in engine.stream(pipeline, text, VOICE)])
+
+
+def report(label, size, seconds, audio):
+    audio_seconds = len(audio) / SAMPLE_RATE
+    print(f"{size:>7}  {label:<22}{seconds:>9.2f}{size / seconds:>10.0f}{audio_seconds / seconds:>9.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--workers", default="1,4")
+    parser.add_argument("--segment-phonemes", type=int, default=300)
+    parser.add_argument("--skip-sequential", action="store_true")
+    parser.add_argument("--stub", action="store_true", help="time the load-test stub instead of Kokoro")
+    args = parser.parse_args()
+
+    if args.stub:
+        from stubs import StubKPipeline, StubTimings
+        pipeline = StubKPipeline(StubTimings())
+    else:
+        import loaders
+        pipeline = loaders.load_speech()
+    sequential(pipeline, "Warming up.")
+
+    print(f"{'chars':>7}  {'run':<22}{'seconds':>9}{'chars/s':>10}{'realtime':>10}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        text = narration(size)
+        if not args.skip_sequential:
+            start = time.perf_counter()
+            audio = sequential(pipeline, text)
+            report("sequential", size, time.perf_counter() - start, audio)
+        for workers in (int(w) for w in args.workers.split(",")):
+            engine = SpeechEngine(workers=workers, segment_phonemes=args.segment_phonemes)
+            engine.preload(pipeline, [VOICE])
+            for label in ("cold", "warm"):
+                start = time.perf_counter()
+                audio = engine_run(engine, pipeline, text)
+                report(f"{workers} workers, {label}", size, time.perf_counter() - start, audio)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Upload preprocessing, copy-and-decode-per-consumer against ``read_upload``.
+
+    python benchmarks/bench_uploads.py --megapixels 12 --width 512 --height 512
+
+Builds a JPEG like a phone photo and prepares it for one img2img request both
+ways: the old path copies the upload to disk, hashes it, and decodes it at full
+size once for the caption and again for the render; the new one reads it once
+and decodes it once at the size the request needs. Reports time and the bytes
+of decoded pixels each path holds.
+"""
+import argparse
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from uploads import read_upload  # noqa: E402
+
+
+def photo(megapixels, seed=0):
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = width * 3 // 4
+    rng = np.random.default_rng(seed)
+    # Smooth gradients with some noise compress like a photo, pure noise would not
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1) + rng.normal(0, 12, (height, width, 3))
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def old_path(data, workdir, width, height):
+    path = os.path.join(workdir, "uploaded_image.png")
+    with open(path, "wb") as f:
+        shutil.copyfileobj(io.BytesIO(data), f)
+    with open(path, "rb") as f:
+        hashlib.sha256(f.read()).hexdigest()
+    decoded = 0
+    caption = Image.open(path).convert("RGB")
+    decoded += caption.width * caption.height * 3
+    render = Image.open(path).convert("RGB")
+    decoded += render.width * render.height * 3
+    render.resize((width, height), Image.LANCZOS)
+    return decoded
+
+
+def new_path(data, workdir, width, height, caption_size):
+    upload = read_upload(io.BytesIO(data), [caption_size, (width, height)])
+    upload.fitted(caption_size)
+    upload.save_resized(os.path.join(workdir, "init_image.png"), width, height)
+    return upload.image.width * upload.image.height * 3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--caption-size", type=int, default=896)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    data = photo(args.megapixels)
+    workdir = tempfile.mkdtemp(prefix="uploads-")
+    print(f"{len(data) / 2 ** 20:.1f} MB JPEG, {args.megapixels:g} MP, rendering at {args.width}x{args.height}")
+    print(f"{'path':<8}{'ms':>9}{'decoded MB':>12}")
+    for label, run in (("old", lambda: old_path(data, workdir, args.width, args.height)),
+                       ("new", lambda: new_path(data, workdir, args.width, args.height, args.caption_size))):
+        run()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            decoded = run()
+        print(f"{label:<8}{(time.perf_counter() - start) / args.repeat * 1000:>9.0f}{decoded / 2 ** 20:>12.1f}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Compare a cold Wan2.1 process per request with the warm video worker pool.
+
+    python benchmarks/bench_video_pool.py --requests 5 --load-seconds 3 --render-seconds 1
+
+Both paths run video_worker.py with the fake engine, which sleeps for the
+given load/render times and returns frames of the requested size. The cold
+path starts a new worker for every request like the old ``generate.py`` call
+did. Frame handoff (reading the shared memory) is timed separately.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from video_pool import WORKER_SCRIPT, VideoModelKey, VideoWorkerPool, with_frames  # noqa: E402
+
+
+def make_pool(args):
+    return VideoWorkerPool(command=[
+        sys.executable, WORKER_SCRIPT,
+        "--engine", "fake",
+        "--fake-load-seconds", str(args.load_seconds),
+        "--fake-render-seconds", str(args.render_seconds),
+    ], max_workers=args.workers)
+
+
+async def render(pool, args, handoff):
+    response = await pool.generate(VideoModelKey("fake"), prompt="", size=args.size, frame_num=args.frames)
+    start = time.perf_counter()
+    # Copy out like the encoder would read it
+    with_frames(response, lambda frames: frames.copy())
+    handoff.append(time.perf_counter() - start)
+
+
+async def cold(args, handoff):
+    timings = []
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        pool = make_pool(args)
+        try:
+            await render(pool, args, handoff)
+        finally:
+            await pool.shutdown()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def warm(args, handoff):
+    pool = make_pool(args)
+    timings = []
+
+    async def one():
+        start = time.perf_counter()
+        await render(pool, args, handoff)
+        timings.append(time.perf_counter() - start)
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(args.requests)])
+        wall = time.perf_counter() - start
+    finally:
+        await pool.shutdown()
+    return timings, wall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--load-seconds", type=float, default=3.0)
+    parser.add_argument("--render-seconds", type=float, default=1.0)
+    parser.add_argument("--size", default="832*480")
+    parser.add_argument("--frames", type=int, default=81)
+    args = parser.parse_args()
+
+    handoff = []
+    cold_timings = asyncio.run(cold(args, handoff))
+    cold_wall = sum(cold_timings)
+    warm_timings, warm_wall = asyncio.run(warm(args, handoff))
+
+    # Warm requests are submitted together, so their latency includes queueing
+    print(f"{'cold process per request':<26} latency {cold_wall / args.requests:.3f}s  throughput {args.requests / cold_wall * 60:.1f} videos/min")
+    print(f"{f'warm pool, {args.workers} worker(s)':<26} latency {sum(warm_timings) / args.requests:.3f}s  throughput {args.requests / warm_wall * 60:.1f} videos/min")
+    width, height = (int(v) for v in args.size.split("*"))
+    mb = args.frames * height * width * 3 / 1e6
+    print(f"{'frame handoff':<26} {mb:.0f} MB in {sum(handoff) / len(handoff) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""Stand-in for the stable-diffusion.cpp ``sd`` binary.
+
+Sleeps to simulate loading the checkpoint and rendering, then writes a blank
+image to ``-o``. Used to benchmark the worker pool without a GPU.
+"""
+import argparse
+import time
+
+from PIL import Image
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--fake-load-seconds", type=float, default=2.0)
+    parser.add_argument("--fake-render-seconds", type=float, default=0.5)
+    args, _ = parser.parse_known_args()
+
+    time.sleep(args.fake_load_seconds)
+    time.sleep(args.fake_render_seconds)
+    Image.new("RGB", (args.width, args.height)).save(args.output)
+
+
+if __name__ == "__main__":
+    main()
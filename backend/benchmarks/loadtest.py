@@ -0,0 +1,291 @@
+"""Offline load test of the whole API against stub models.
+
+    python benchmarks/loadtest.py --mode closed --concurrency 8 --requests 200
+    python benchmarks/loadtest.py --mode open --rate 4 --duration 60 --mix text2img=3,text2speech=1
+    python benchmarks/loadtest.py --json after.json --compare before.json
+
+The server runs in this process with every model swapped for a stub from
+``stubs.py`` (sd.cpp and Wan2.1 run their fake worker engines), so it needs
+no GPU or network. Requests go through the real ASGI app.
+
+- Closed loop: ``--concurrency`` clients each send their next request as soon as the last one finishes.
+- Open loop: requests arrive as a Poisson process at ``--rate`` per second, however slow the server gets.
+
+The report has latency percentiles and throughput per endpoint, a sample of
+each endpoint's errors, event loop lag (how late a 10 ms timer fires) and
+lane queue wait per model.
+``--compare`` exits non-zero when p95 latency or throughput is worse than a
+saved run by more than ``--tolerance``, so it can gate commits.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import stubs  # noqa: E402
+
+# Form fields per endpoint, small enough that a run takes seconds with the default stub timings.
+# Seeds of -1 keep requests out of the result cache even when it is enabled.
+ENDPOINTS = {
+    "text2speech": {"prompt": "The quick brown fox jumps over the lazy dog. It was not amused. Neither was the fox."},
+    "text2music": {"prompt": "lo-fi beat with warm piano", "duration": "5"},
+    "text2video": {"prompt": "a paper boat drifting down a rainy street"},
+    "text2animation": {"prompt": "a cat walking in the snow", "num_frames": "16", "num_inference_steps": "10", "seed": "-1"},
+    "text2img": {"prompt": "a lighthouse at dusk", "height": "512", "width": "512", "steps": "10"},
+    "img2img": {"prompt": "oil painting", "steps": "10", "upload": True},
+    "img2ghibli": {"steps": "10", "upload": True},
+    "img2pixar": {"steps": "10", "upload": True},
+    "img2animation": {"num_frames": "16", "num_inference_steps": "10", "seed": "-1", "upload": True},
+    "img2sound": {"duration": "5", "upload": True},
+}
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else float("nan"),
+    }
+
+
+def make_uploads(count, size=256):
+    # Distinct images so captions aren't all served from the caption cache
+    rng = np.random.default_rng(0)
+    uploads = []
+    for _ in range(count):
+        buffer = io.BytesIO()
+        Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)).save(buffer, format="PNG")
+        uploads.append(buffer.getvalue())
+    return uploads
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint {name!r}, expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class LoadTest:
+    def __init__(self, client, mix, uploads, seed=0, users=1):
+        self.client = client
+        self.names = list(mix)
+        self.weights = list(mix.values())
+        self.uploads = uploads
+        self.users = users
+        self.random = random.Random(seed)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        # The first few distinct failures per endpoint, so a broken one shows why
+        self.error_samples = defaultdict(list)
+        self.rejected = defaultdict(int)
+        self.completed = 0
+
+    async def one(self):
+        await self.send(self.random.choices(self.names, self.weights)[0])
+
+    async def send(self, name):
+        data = dict(ENDPOINTS[name])
+        files = None
+        if data.pop("upload", False):
+            files = {"file": ("upload.png", self.uploads[self.random.randrange(len(self.uploads))], "image/png")}
+        headers = {"X-User-Id": f"user-{self.random.randrange(self.users)}"}
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(f"/{name}/", data=data, files=files, headers=headers)
+        except Exception as e:
+            self.error(name, f"{type(e).__name__}: {e}")
+            return
+        if response.status_code == 200:
+            self.latencies[name].append(time.perf_counter() - start)
+            self.completed += 1
+        elif response.status_code == 429:
+            # Turned away by admission control, counted apart from failures
+            self.rejected[name] += 1
+        else:
+            self.error(name, f"HTTP {response.status_code}: {response.text[:200]}")
+
+    def error(self, name, message, samples=3):
+        self.errors[name] += 1
+        if message not in self.error_samples[name] and len(self.error_samples[name]) < samples:
+            self.error_samples[name].append(message)
+
+    async def closed(self, concurrency, requests):
+        remaining = requests
+
+        async def client():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                await self.one()
+
+        await asyncio.gather(*[client() for _ in range(concurrency)])
+
+    async def open(self, rate, duration):
+        tasks = []
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            tasks.append(asyncio.ensure_future(self.one()))
+            await asyncio.sleep(self.random.expovariate(rate))
+        await asyncio.gather(*tasks)
+
+
+async def watch_loop_lag(lags, stop, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - start - interval)
+
+
+def record_lane_waits(server):
+    waits = defaultdict(list)
+    for lane in server.executor.lanes.values():
+        previous = lane.on_wait
+
+        def on_wait(name, seconds, previous=previous):
+            waits[name].append(seconds)
+            if previous is not None:
+                previous(name, seconds)
+
+        lane.on_wait = on_wait
+    return waits
+
+
+async def run(args, server):
+    import httpx
+
+    # By default every endpoint this server serves (a CPU tier only has speech and music)
+    mix = parse_mix(args.mix) if args.mix else dict.fromkeys([name for name in ENDPOINTS if name in server.JOB_ENDPOINTS], 1.0)
+    waits = record_lane_waits(server)
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.app.router.lifespan_context(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+            await stubs.wait_ready(client)
+            if args.warmup:
+                # Load every model and start the workers so the run measures steady state
+                warm = LoadTest(client, mix, make_uploads(1))
+                for name in mix:
+                    await warm.send(name)
+                for values in waits.values():
+                    values.clear()
+
+            test = LoadTest(client, mix, make_uploads(args.uploads), args.seed, args.users)
+            lags, stop = [], asyncio.Event()
+            watcher = asyncio.ensure_future(watch_loop_lag(lags, stop))
+            start = time.perf_counter()
+            if args.mode == "closed":
+                await test.closed(args.concurrency, args.requests)
+            else:
+                await test.open(args.rate, args.duration)
+            wall = time.perf_counter() - start
+            stop.set()
+            await watcher
+
+    return {
+        "mode": args.mode,
+        "wall_seconds": wall,
+        "throughput": test.completed / wall,
+        "endpoints": {
+            name: dict(summarize(test.latencies[name]), errors=test.errors[name], rejected=test.rejected[name],
+                       throughput=len(test.latencies[name]) / wall, error_samples=test.error_samples[name])
+            for name in mix
+        },
+        "loop_lag": summarize(lags),
+        "queue_wait": {name: summarize(values) for name, values in waits.items() if values},
+    }
+
+
+def report(result):
+    ms = lambda value: f"{value * 1000:9.1f}"  # noqa: E731
+    print(f"{result['mode']} loop, {result['wall_seconds']:.1f}s, {result['throughput']:.2f} requests/s")
+    print(f"\n{'endpoint':<16}{'ok':>6}{'errors':>8}{'429s':>6}{'req/s':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in result["endpoints"].items():
+        print(f"{name:<16}{stats['count']:>6}{stats['errors']:>8}{stats.get('rejected', 0):>6}{stats['throughput']:>8.2f}"
+              f"{ms(stats['p50'])} {ms(stats['p95'])} {ms(stats['p99'])}")
+    failing = {name: stats["error_samples"] for name, stats in result["endpoints"].items() if stats.get("error_samples")}
+    if failing:
+        print("\nerrors")
+        for name, samples in failing.items():
+            for sample in samples:
+                print(f"  {name:<16}{sample}")
+    lag = result["loop_lag"]
+    print(f"\nevent loop lag   p50 {ms(lag['p50'])}  p99 {ms(lag['p99'])}  max {ms(lag['max'])} ms")
+    print(f"\n{'queue wait':<16}{'calls':>6}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name, stats in result["queue_wait"].items():
+        print(f"{name:<16}{stats['count']:>6}{ms(stats['p50'])} {ms(stats['p95'])} {ms(stats['max'])}")
+
+
+def compare(result, baseline, tolerance):
+    """Regressions against ``baseline`` beyond ``tolerance`` (a fraction)."""
+    problems = []
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        problems.append(f"throughput {result['throughput']:.2f}/s, was {baseline['throughput']:.2f}/s")
+    for name, stats in result["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before and stats["count"] and stats["p95"] > before["p95"] * (1 + tolerance):
+            problems.append(f"{name} p95 {stats['p95'] * 1000:.0f}ms, was {before['p95'] * 1000:.0f}ms")
+        if stats["errors"] > (before or {}).get("errors", 0):
+            problems.append(f"{name} {stats['errors']} errors")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=8, help="closed loop clients")
+    parser.add_argument("--requests", type=int, default=100, help="closed loop total requests")
+    parser.add_argument("--rate", type=float, default=2.0, help="open loop arrivals per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="open loop seconds of arrivals")
+    parser.add_argument("--mix", help="endpoints and weights, e.g. text2img=3,text2speech=1 (default: all equally)")
+    parser.add_argument("--uploads", type=int, default=16, help="distinct images to upload")
+    parser.add_argument("--users", type=int, default=1, help="X-User-Id values to spread requests over")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--compare", help="results of an earlier run to check against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    stubs.add_timing_arguments(parser)
+    args = parser.parse_args()
+
+    stubs.prepare()
+    import server
+
+    stubs.install(server, stubs.timings_from_args(args))
+    result = asyncio.run(run(args, server))
+    report(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Run server.py on stub models, e.g. as a local replica behind gateway.py.
+
+    SERVED_ENDPOINTS=text2img,text2animation python benchmarks/stub_server.py --port 8001
+
+Takes the same stub timing flags as loadtest.py.
+"""
+import argparse
+import os
+import sys
+
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stubs  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    stubs.add_timing_arguments(parser)
+    args = parser.parse_args()
+
+    stubs.prepare()
+    import server
+
+    stubs.install(server, stubs.timings_from_args(args))
+    uvicorn.run(server.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
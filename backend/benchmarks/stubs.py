@@ -0,0 +1,306 @@
+"""Lightweight stand-ins for every model behind server.py, for load testing.
+
+The stubs take the same calls as the real models (KPipeline, MusicGen,
+the diffusers pipelines, Phi-4) and the sd.cpp/Wan2.1 workers run their
+``fake`` engines, so requests go through all of the real serving code:
+lanes, batching, caches, encoding and responses. Each stub sleeps for a
+configurable time in place of inference and returns outputs of the real
+shapes, nothing needs a GPU or the network.
+
+Call ``prepare`` before importing server, then ``install`` on the module.
+"""
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import time
+import types
+from dataclasses import dataclass
+
+import numpy as np
+import torch
+from PIL import Image
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class StubTimings:
+    load_seconds: float = 0.5      # first use of each in-process model
+    step_seconds: float = 0.05     # per diffusion step
+    step_batch_cost: float = 0.3   # extra fraction of that per additional output in a batch
+    max_batch: float = 8           # outputs per pipeline call before running out of memory
+    encode_seconds: float = 0.05   # per prompt through the text encoders
+    decode_seconds: float = 0.05   # VAE decode after the last step
+    speech_seconds: float = 0.05   # per 100 phonemes through Kokoro
+    g2p_seconds: float = 0.005     # per sentence through Kokoro's G2P
+    music_rtf: float = 0.5         # MusicGen seconds per second of audio
+    caption_seconds: float = 0.3   # per Phi-4 generate call
+    caption_batch_cost: float = 0.1  # extra fraction of that per additional image in a batch
+    sd_seconds: float = 0.5        # per sd.cpp render
+    video_seconds: float = 2.0     # per Wan2.1 render
+    worker_load_seconds: float = 1.0  # sd.cpp/Wan2.1 worker start
+
+
+class StubKModel:
+    device = torch.device("cpu")
+
+
+class StubKPipeline:
+    """Kokoro: lower-cased text as phonemes, about 60 ms of audio per phoneme."""
+
+    sample_rate = 24000
+    lang_code = "a"
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.model = StubKModel()
+
+    def g2p(self, text):
+        time.sleep(self.timings.g2p_seconds)
+        words = text.lower().split()
+        return " ".join(words), words
+
+    def en_tokenize(self, words):
+        chunk = []
+        for word in words:
+            if chunk and len(" ".join(chunk + [word])) > 510:
+                yield " ".join(chunk), " ".join(chunk), chunk
+                chunk = []
+            chunk.append(word)
+        if chunk:
+            yield " ".join(chunk), " ".join(chunk), chunk
+
+    def load_voice(self, voice):
+        return torch.zeros(510, 1, 256)
+
+    def infer(self, model, ps, pack, speed=1):
+        time.sleep(self.timings.speech_seconds * len(ps) / 100)
+        return types.SimpleNamespace(audio=torch.zeros(int(len(ps) * 0.06 * self.sample_rate)))
+
+    def __call__(self, text, voice=None, **kwargs):
+        pack = self.load_voice(voice)
+        for sentence in [s for s in re.split(r"(?<=[.!?])\s+", text) if s.strip()]:
+            _, words = self.g2p(sentence)
+            for gs, ps, _ in self.en_tokenize(words):
+                yield gs, ps, self.infer(self.model, ps, pack).audio
+
+
+class StubMusicProcessor:
+    def __call__(self, text=None, audio=None, sampling_rate=None, padding=True, return_tensors="pt"):
+        inputs = {
+            "input_ids": torch.zeros(len(text), 8, dtype=torch.long),
+            "attention_mask": torch.ones(len(text), 8, dtype=torch.long),
+        }
+        if audio is not None:
+            inputs["input_values"] = torch.as_tensor(np.asarray(audio, dtype=np.float32))[None, None]
+        return inputs
+
+
+class StubMusicModel(torch.nn.Module):
+    """MusicGen: 256 tokens per 5 seconds, audio prompts are re-decoded in front of the output."""
+
+    sampling_rate = 32000
+
+    def __init__(self, timings):
+        super().__init__()
+        self.timings = timings
+        self.anchor = torch.nn.Parameter(torch.zeros(1))
+        self.config = types.SimpleNamespace(audio_encoder=types.SimpleNamespace(sampling_rate=self.sampling_rate))
+
+    def generate(self, input_ids=None, input_values=None, max_new_tokens=256, **kwargs):
+        seconds = max_new_tokens * 5 / 256
+        time.sleep(seconds * self.timings.music_rtf)
+        context = input_values.shape[-1] if input_values is not None else 0
+        return torch.zeros(input_ids.shape[0], 1, context + int(seconds * self.sampling_rate))
+
+
+class StubDiffusionPipeline:
+    """SD3.5 / AnimateDiff: sleeps per step, calls ``callback_on_step_end`` with latents of the real shape.
+
+    ``encode_prompt`` returns embeddings of the real shapes, for SD3.5 CLIP+T5
+    (333 tokens of 4096) with pooled CLIP, for AnimateDiff 77 CLIP tokens of 768.
+    A batch of outputs costs a little more per step than one, and more than
+    ``max_batch`` of them at once raise out of memory like a full GPU.
+    """
+
+    def __init__(self, timings, video=False, channels=4, size=512):
+        self.timings = timings
+        self.video = video
+        self.channels = channels
+        self.size = size
+        self.device = torch.device("cpu")
+
+    def encode_prompt(self, prompt=None, *args, do_classifier_free_guidance=True, **kwargs):
+        time.sleep(self.timings.encode_seconds * (2 if do_classifier_free_guidance else 1))
+        if self.video:
+            return torch.zeros(1, 77, 768, dtype=torch.float16), None
+        return torch.zeros(1, 333, 4096, dtype=torch.bfloat16), None, torch.zeros(1, 2048, dtype=torch.bfloat16), None
+
+    def __call__(self, prompt=None, num_inference_steps=25, height=None, width=None, num_frames=16,
+                 callback_on_step_end=None, **kwargs):
+        height, width = height or self.size, width or self.size
+        if kwargs.get("prompt_embeds") is not None:
+            batch = kwargs["prompt_embeds"].shape[0]
+        else:
+            batch = len(prompt) if isinstance(prompt, list) else 1
+            self.encode_prompt(prompt)
+        if batch > self.timings.max_batch:
+            raise torch.cuda.OutOfMemoryError(f"stub ran out of memory generating {batch} at once")
+        shape = (batch, self.channels, num_frames, height // 8, width // 8) if self.video else (batch, self.channels, height // 8, width // 8)
+        latents = torch.zeros(shape)
+        self.num_timesteps = num_inference_steps
+        for step in range(num_inference_steps):
+            time.sleep(self.timings.step_seconds * (1 + self.timings.step_batch_cost * (batch - 1)))
+            if callback_on_step_end is not None:
+                callback_on_step_end(self, step, 0, {"latents": latents})
+        time.sleep(self.timings.decode_seconds * batch)
+        y, x = np.mgrid[0:height, 0:width]
+        if not self.video:
+            return types.SimpleNamespace(images=[_frame(x, y, i) for i in range(batch)])
+        return types.SimpleNamespace(frames=[[_frame(x, y, i) for i in range(num_frames)] for _ in range(batch)])
+
+
+def _frame(x, y, shift):
+    # A moving gradient encodes about like generated content, flat colour would flatter the encoders
+    return Image.fromarray(np.stack([(x + 4 * shift) % 256, y % 256, (x + y) % 256], axis=-1).astype(np.uint8))
+
+
+class StubStylePipeline(StubDiffusionPipeline):
+    """Img2img base for the style presets, with the LoRA calls StyleEngine makes."""
+
+    def __init__(self, timings):
+        super().__init__(timings)
+        from diffusers import DDIMScheduler
+        self.scheduler = DDIMScheduler()
+
+    def __call__(self, image=None, strength=0.8, num_inference_steps=25, **kwargs):
+        steps = max(1, int((num_inference_steps or 25) * (strength or 0.8)))
+        for _ in range(steps):
+            time.sleep(self.timings.step_seconds)
+        return types.SimpleNamespace(images=[image])
+
+    def load_lora_weights(self, path, adapter_name=None):
+        pass
+
+    def delete_adapters(self, names):
+        pass
+
+    def set_adapters(self, names, adapter_weights=None):
+        pass
+
+    def fuse_lora(self, adapter_names=None):
+        pass
+
+    def unfuse_lora(self):
+        pass
+
+    def enable_lora(self):
+        pass
+
+    def disable_lora(self):
+        pass
+
+
+class _Batch(dict):
+    def to(self, device):
+        return self
+
+
+class StubPhiProcessor:
+    tokenizer = types.SimpleNamespace(pad_token_id=0, eos_token_id=2, padding_side="left")
+
+    def __call__(self, text=None, images=None, padding=False, return_tensors="pt"):
+        return _Batch(input_ids=torch.ones(len(text), 16, dtype=torch.long))
+
+    def batch_decode(self, ids, **kwargs):
+        return ["A stub caption of the uploaded image. Bright colours and soft light."] * len(ids)
+
+
+class StubPhiModel:
+    """Phi-4: 32-token captions ending in the end token, a batch costs a little more than a single image."""
+
+    device = torch.device("cpu")
+
+    def __init__(self, timings):
+        self.timings = timings
+
+    def generate(self, input_ids=None, max_new_tokens=1000, **kwargs):
+        batch = input_ids.shape[0]
+        time.sleep(self.timings.caption_seconds * (1 + self.timings.caption_batch_cost * (batch - 1)))
+        generated = torch.ones(batch, 32, dtype=torch.long)
+        generated[:, -1] = 2
+        generated = generated[:, :max_new_tokens]
+        return torch.cat([input_ids, generated], dim=1)
+
+
+def add_timing_arguments(parser):
+    """``--step-seconds`` etc. for every ``StubTimings`` field."""
+    for field, default in vars(StubTimings()).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", dest=field, type=float, default=default)
+
+
+def timings_from_args(args):
+    return StubTimings(**{field: getattr(args, field) for field in vars(StubTimings())})
+
+
+async def wait_ready(client, url="", timeout=60):
+    """Poll ``/ready`` until the models the server loads at startup are in."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(f"{url}/ready")).status_code == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise SystemExit(f"{url or 'server'} did not become ready")
+
+
+def _loading(timings, make):
+    def load():
+        time.sleep(timings.load_seconds)
+        return make()
+    return load
+
+
+def prepare(workdir=None):
+    """Environment for an offline server, call before ``import server``."""
+    workdir = workdir or tempfile.mkdtemp(prefix="cre8-load-")
+    os.environ.setdefault("WORK_DIR", os.path.join(workdir, "work"))
+    # Load tests measure generation, a warm result cache would hide it
+    os.environ.setdefault("RESULT_CACHE_MAX_GB", "0")
+    # The load generators (and the gateway in front of stub replicas) name their users with X-User-Id
+    os.environ.setdefault("TRUSTED_PROXIES", "127.0.0.1")
+    if BACKEND not in sys.path:
+        sys.path.insert(0, BACKEND)
+    # server.py registers the tunnel token on import, which downloads ngrok when missing
+    from pyngrok import ngrok
+    ngrok.set_auth_token = lambda *args, **kwargs: None
+    return workdir
+
+
+def install(server, timings=None):
+    """Point every model and worker pool of ``server`` at the stubs."""
+    timings = timings or StubTimings()
+    loaders = {
+        "speech": lambda: StubKPipeline(timings),
+        "music": lambda: (StubMusicProcessor(), StubMusicModel(timings)),
+        "animation": lambda: StubDiffusionPipeline(timings, video=True),
+        "image": lambda: StubDiffusionPipeline(timings, channels=16, size=1024),
+        "phi": lambda: (StubPhiProcessor(), StubPhiModel(timings), None),
+        "img2animate": lambda: StubDiffusionPipeline(timings, video=True),
+    }
+    for name, make in loaders.items():
+        # The CPU tier only registers some of the models
+        if name in server.models.entries:
+            server.models.entries[name].loader = _loading(timings, make)
+    server.loaders.load_style_base = lambda checkpoint: _loading(timings, lambda: StubStylePipeline(timings))()
+
+    fake = ["--engine", "fake", "--fake-load-seconds", str(timings.worker_load_seconds)]
+    server.sd_pool.command = [sys.executable, os.path.join(BACKEND, "sd_worker.py"), *fake,
+                              "--fake-render-seconds", str(timings.sd_seconds)]
+    server.video_pool.command = [sys.executable, os.path.join(BACKEND, "video_worker.py"), *fake,
+                                 "--fake-render-seconds", str(timings.video_seconds)]
+    return timings
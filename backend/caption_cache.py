@@ -0,0 +1,85 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+
+def caption_key(image_digest, caption_prompt, max_new_tokens=None, image_size=None):
+    """Key for a caption of the image with SHA-256 ``image_digest``, as captioned at ``image_size``."""
+    digest = hashlib.sha256(image_digest.encode())
+    digest.update(b"\0")
+    digest.update(caption_prompt.encode("utf-8"))
+    if max_new_tokens is not None:
+        digest.update(f"\0{max_new_tokens}".encode())
+    if image_size is not None:
+        digest.update(f"\0{image_size}px".encode())
+    return digest.hexdigest()
+
+
+class CaptionCache:
+    """Captions keyed on the image contents and the caption prompt.
+
+    Recent captions are kept in an in-memory LRU. If ``disk_dir`` is set every
+    caption is also written there so the cache survives restarts.
+    """
+
+    def __init__(self, max_entries=256, disk_dir=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+        caption = self._read(key)
+        if caption is not None:
+            self.disk_hits += 1
+            self._remember(key, caption)
+            return caption
+
+        self.misses += 1
+        return None
+
+    def put(self, key, caption):
+        self._remember(key, caption)
+        if self.disk_dir:
+            # Write then rename so a crash never leaves a truncated caption behind
+            path = self._path(key)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(caption)
+            os.replace(path + ".tmp", path)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "persistent": bool(self.disk_dir),
+        }
+
+    def _remember(self, key, caption):
+        self._entries[key] = caption
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.txt")
+
+    def _read(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
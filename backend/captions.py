@@ -0,0 +1,56 @@
+import re
+
+import torch
+
+DEFAULT_CAPTION_PROMPT = "Describe this image in detail."
+
+# Phi-4 multimodal chat format, every prompt in a batch refers to its own image as image_1
+PROMPT_TEMPLATE = "<|user|><|image_1|>{caption_prompt}<|end|><|assistant|>"
+
+_SENTENCE_END = re.compile(r"[.!?](?=\s|$)")
+
+
+def trim_caption(text, truncated):
+    """Drop the sentence the token budget cut off, unless it is the only one."""
+    text = text.strip()
+    if not truncated:
+        return text
+    ends = [match.end() for match in _SENTENCE_END.finditer(text)]
+    return text[:ends[-1]] if ends else text
+
+
+def end_token_ids(phi_processor, phi_model, generation_config=None):
+    """The ids ``generate`` stops a row at, from the generation config or else the tokenizer."""
+    for config in (generation_config, getattr(phi_model, "generation_config", None)):
+        eos = getattr(config, "eos_token_id", None)
+        if eos is not None:
+            return torch.tensor(eos if isinstance(eos, (list, tuple)) else [eos])
+    return torch.tensor([phi_processor.tokenizer.eos_token_id])
+
+
+def caption_batch(phi, images, caption_prompts, max_new_tokens):
+    """Caption several PIL images with one padded Phi-4 ``generate``.
+
+    Returns the captions and how many tokens were generated for each. Rows
+    that reach their end token stop there, the call ends when the last one
+    does or at ``max_new_tokens``.
+    """
+    phi_processor, phi_model, generation_config = phi
+    prompts = [PROMPT_TEMPLATE.format(caption_prompt=caption_prompt) for caption_prompt in caption_prompts]
+    inputs = phi_processor(text=prompts, images=images, padding=True, return_tensors='pt').to(phi_model.device)
+    with torch.no_grad():
+        generate_ids = phi_model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            generation_config=generation_config,
+            num_logits_to_keep=1,
+        )
+    # Prompts are left-padded, so the generated tokens start at the same column in every row
+    generate_ids = generate_ids[:, inputs['input_ids'].shape[1]:]
+    # A row is complete if it produced an end token, one that ran out of budget has none.
+    # Counting non-pad tokens can't tell: the end token may land on the cap, or share the pad id.
+    ended = torch.isin(generate_ids, end_token_ids(phi_processor, phi_model, generation_config).to(generate_ids.device))
+    complete = ended.any(dim=1)
+    tokens = torch.where(complete, ended.int().argmax(dim=1) + 1, generate_ids.shape[1]).tolist()
+    texts = phi_processor.batch_decode(generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+    return [trim_caption(text, not done) for text, done in zip(texts, complete.tolist())], tokens
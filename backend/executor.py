@@ -0,0 +1,176 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import queue
+import threading
+import time
+
+# Lists collecting a future per lane item submitted under them, resolved when
+# the item has finished or been skipped, whether or not its caller is still
+# waiting. Set by ``ModelRegistry.use`` to keep a model pinned while a lane runs on it.
+lane_work = contextvars.ContextVar("lane_work", default=())
+
+
+def _resolve(future, result=None, error=None):
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class Lane:
+    """FIFO work queue served by dedicated worker thread(s) for a single model.
+
+    Work runs in a copy of the submitter's context, so context variables (the
+    current job, metrics labels) carry over to the worker thread.
+    """
+
+    def __init__(self, name, workers=1, on_wait=None):
+        self.name = name
+        self.workers = workers
+        # Called on the worker thread, in the item's context, with the seconds it spent queued
+        self.on_wait = on_wait
+        self.pending = 0
+        self.running = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"lane-{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        finished = loop.create_future()
+        for work in lane_work.get():
+            work.append(finished)
+        with self._lock:
+            self.pending += 1
+        self._queue.put((loop, future, finished, contextvars.copy_context(), time.perf_counter(), fn, args, kwargs))
+        return future
+
+    def submit_threadsafe(self, fn, *args, **kwargs):
+        """Like ``submit`` from any thread, e.g. another lane's work, returning a ``concurrent.futures.Future``."""
+        future = concurrent.futures.Future()
+        with self._lock:
+            self.pending += 1
+        self._queue.put((None, future, None, contextvars.copy_context(), time.perf_counter(), fn, args, kwargs))
+        return future
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            loop, future, finished, context, queued, fn, args, kwargs = item
+            with self._lock:
+                self.pending -= 1
+                self.running += 1
+            # Work submitted from a thread is part of that thread's work, whose wait was already recorded
+            if self.on_wait is not None and loop is not None:
+                context.run(self.on_wait, self.name, time.perf_counter() - queued)
+            try:
+                if loop is None:
+                    # Submitted from a thread, its caller waits on it there
+                    if future.set_running_or_notify_cancel():
+                        try:
+                            future.set_result(context.run(fn, *args, **kwargs))
+                        except BaseException as e:
+                            future.set_exception(e)
+                    continue
+                # The caller went away (client disconnect, timeout), don't burn GPU time on it
+                if future.cancelled():
+                    continue
+                try:
+                    result = context.run(fn, *args, **kwargs)
+                except BaseException as e:
+                    loop.call_soon_threadsafe(_resolve, future, None, e)
+                else:
+                    loop.call_soon_threadsafe(_resolve, future, result)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                if finished is not None:
+                    loop.call_soon_threadsafe(_resolve, finished)
+
+
+class InferenceExecutor:
+    """Runs blocking model calls off the event loop, one lane per model.
+
+    Calls on the same lane are serialised (a pipeline is not safe to call from
+    two threads at once), calls on different lanes run concurrently.
+    """
+
+    def __init__(self, lanes, on_wait=None):
+        self.lanes = {name: Lane(name, workers, on_wait) for name, workers in lanes.items()}
+        self.started = False
+
+    def start(self):
+        for lane in self.lanes.values():
+            lane.start()
+        self.started = True
+
+    def shutdown(self):
+        for lane in self.lanes.values():
+            lane.stop()
+        self.started = False
+
+    async def run(self, lane, fn, *args, **kwargs):
+        if lane not in self.lanes:
+            raise KeyError(f"Unknown inference lane: {lane}")
+        return await self.lanes[lane].submit(fn, *args, **kwargs)
+
+    async def stream(self, lane, fn, *args, **kwargs):
+        """Run generator function ``fn`` on a lane and yield its items as they are produced."""
+        if lane not in self.lanes:
+            raise KeyError(f"Unknown inference lane: {lane}")
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+        stop = threading.Event()
+        end = object()
+
+        def produce():
+            try:
+                for item in fn(*args, **kwargs):
+                    # The consumer went away (client disconnect), stop generating
+                    if stop.is_set():
+                        return
+                    loop.call_soon_threadsafe(items.put_nowait, (item, None))
+            except BaseException as e:
+                loop.call_soon_threadsafe(items.put_nowait, (end, e))
+            else:
+                loop.call_soon_threadsafe(items.put_nowait, (end, None))
+
+        self.lanes[lane].submit(produce)
+        try:
+            while True:
+                item, error = await items.get()
+                if item is end:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            stop.set()
+
+    def queue_depth(self):
+        return {name: lane.pending for name, lane in self.lanes.items()}
+
+    def stats(self):
+        return {
+            name: {"pending": lane.pending, "running": lane.running, "workers": lane.workers}
+            for name, lane in self.lanes.items()
+        }
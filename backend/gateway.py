@@ -0,0 +1,279 @@
+"""Routes API requests across several server.py replicas.
+
+    GATEWAY_REPLICAS=http://gpu-a:8000,http://gpu-b:8000,http://cpu-a:8000 python gateway.py
+
+Every replica's ``/status`` is polled for the endpoints it serves, which of
+them are warm and its queue depth. A generation request goes to a replica
+that serves its endpoint, preferring ones where the model is already
+resident, then the least loaded. A connection error, a 429 or a 502/503/504
+response moves the request on to the next candidate. The replica is also
+benched with backoff until a poll succeeds again, unless it answered that
+it is busy or still loading the model (a 429, or a 503 with Retry-After).
+Any other response, other 5xx included, goes back to the client, replaying
+a model exception or a bad prompt elsewhere would only fail again.
+Replicas that report the endpoint as not ready are tried last. Job status,
+events and results are sent to the replica that created the job.
+"""
+import asyncio
+import os
+import random
+import time
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+# Not forwarded in either direction, they describe a single connection
+HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+# A replica that is down or unreachable behind its proxy, rather than failing the request
+FAILOVER_STATUSES = {502, 503, 504}
+
+
+class Replica:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.status = None
+        self.healthy = False
+        self.inflight = 0
+        self.routed = 0
+        self.failures = 0
+        self.benched_until = 0.0
+        self.checked = None
+        self.error = None
+
+    @property
+    def available(self):
+        return self.healthy and time.monotonic() >= self.benched_until
+
+    def serves(self, endpoint):
+        return self.status is not None and endpoint in self.status["endpoints"]
+
+    def warm(self, endpoint):
+        return self.serves(endpoint) and self.status["endpoints"][endpoint]["warm"]
+
+    def ready(self, endpoint):
+        # Still loading its models after a restart
+        return self.serves(endpoint) and self.status["endpoints"][endpoint].get("ready", True)
+
+    @property
+    def load(self):
+        # The polled queue depth is stale but sees other clients, our own count is
+        # current but only sees this gateway
+        return max(self.inflight, self.status["queue_depth"] if self.status else 0)
+
+    def fail(self, error):
+        self.failures += 1
+        self.error = str(error)
+        self.benched_until = time.monotonic() + min(2 ** self.failures, 60)
+
+    def describe(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "available": self.available,
+            "inflight": self.inflight,
+            "routed": self.routed,
+            "failures": self.failures,
+            "error": self.error,
+            "checked": self.checked,
+            "status": self.status,
+        }
+
+
+class Gateway:
+    def __init__(self, urls, poll_interval=2.0, retries=2, job_ttl=3600):
+        self.replicas = [Replica(url) for url in urls]
+        self.poll_interval = poll_interval
+        self.retries = retries
+        self.job_ttl = job_ttl
+        self.jobs = {}  # job id -> (replica, created)
+        self.client = None
+        self._poller = None
+
+    async def start(self):
+        # Generations can take many minutes, only connecting is bounded
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(None, connect=5.0))
+        await self.poll_all()
+        self._poller = asyncio.ensure_future(self._poll_forever())
+
+    async def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+        await self.client.aclose()
+
+    async def _poll_forever(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await self.poll_all()
+
+    async def poll_all(self):
+        await asyncio.gather(*[self.poll(replica) for replica in self.replicas])
+
+    async def poll(self, replica):
+        try:
+            response = await self.client.get(f"{replica.url}/status", timeout=5.0)
+            response.raise_for_status()
+            replica.status = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            replica.healthy = False
+            replica.error = str(e) or type(e).__name__
+        else:
+            replica.healthy = True
+            replica.failures = 0
+            replica.benched_until = 0.0
+            replica.error = None
+        replica.checked = time.time()
+
+    def candidates(self, endpoint=None):
+        """Replicas to try in order: ready and warm first, then least loaded, ties broken at random."""
+        replicas = [r for r in self.replicas if r.available and (endpoint is None or r.serves(endpoint))]
+        random.shuffle(replicas)
+        return sorted(replicas, key=lambda r: (
+            endpoint is not None and not r.ready(endpoint),
+            endpoint is not None and not r.warm(endpoint),
+            r.load,
+        ))
+
+    def remember_job(self, job_id, replica):
+        now = time.monotonic()
+        expired = [key for key, (_, created) in self.jobs.items() if now - created > self.job_ttl]
+        for key in expired:
+            del self.jobs[key]
+        self.jobs[job_id] = (replica, now)
+
+    async def forward(self, request, replicas):
+        """Send ``request`` to the first of ``replicas`` that is up and not too busy for it."""
+        body = await request.body()
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in HOP_HEADERS | {"x-forwarded-for"}]
+        # Replicas share GPU time out per user by this address (or X-User-Id) when they list the gateway in TRUSTED_PROXIES
+        if request.client is not None:
+            forwarded = request.headers.get("x-forwarded-for")
+            headers.append(("x-forwarded-for", f"{forwarded}, {request.client.host}" if forwarded else request.client.host))
+        path = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+        last_error = "no replica serves this endpoint"
+        tried = replicas[:self.retries + 1]
+        for replica in tried:
+            replica.inflight += 1
+            try:
+                upstream = await self.client.send(
+                    self.client.build_request(request.method, replica.url + path, headers=headers, content=body),
+                    stream=True,
+                )
+            except httpx.HTTPError as e:
+                replica.inflight -= 1
+                replica.fail(e)
+                last_error = f"{replica.url}: {e or type(e).__name__}"
+                continue
+            # The last candidate's error goes back to the client as is. A 429, or a
+            # 503 with Retry-After, is a replica too busy or still loading the
+            # model, not a broken one.
+            deferred = upstream.status_code == 429 or (upstream.status_code == 503 and "retry-after" in upstream.headers)
+            if (upstream.status_code in FAILOVER_STATUSES or deferred) and replica is not tried[-1]:
+                replica.inflight -= 1
+                if not deferred:
+                    replica.fail(f"HTTP {upstream.status_code}")
+                last_error = f"{replica.url}: HTTP {upstream.status_code}"
+                await upstream.aclose()
+                continue
+            replica.routed += 1
+            return replica, upstream
+        raise HTTPException(status_code=503, detail=f"No replica available ({last_error})")
+
+    def respond(self, replica, upstream, body=None):
+        released = False
+
+        async def release():
+            nonlocal released
+            if not released:
+                released = True
+                replica.inflight -= 1
+                await upstream.aclose()
+
+        async def content():
+            # Also released here, the background task doesn't run when the client disconnects
+            try:
+                if body is not None:
+                    yield body
+                else:
+                    async for chunk in upstream.aiter_raw():
+                        yield chunk
+            finally:
+                await release()
+
+        headers = {k: v for k, v in upstream.headers.items() if k.lower() not in HOP_HEADERS}
+        headers["x-cre8-replica"] = replica.url
+        if body is not None:
+            headers["content-length"] = str(len(body))
+        elif "content-length" in upstream.headers:
+            headers["content-length"] = upstream.headers["content-length"]
+        return StreamingResponse(content(), status_code=upstream.status_code, headers=headers, background=BackgroundTask(release))
+
+
+gateway = Gateway(
+    [url for url in os.environ.get("GATEWAY_REPLICAS", "http://127.0.0.1:8000").split(",") if url],
+    poll_interval=float(os.environ.get("GATEWAY_POLL_SECONDS", "2")),
+    retries=int(os.environ.get("GATEWAY_RETRIES", "2")),
+)
+
+app = FastAPI(title="Cre8.ai gateway")
+
+
+@app.on_event("startup")
+async def start_gateway():
+    await gateway.start()
+
+
+@app.on_event("shutdown")
+async def stop_gateway():
+    await gateway.stop()
+
+
+@app.get("/health")
+async def health_check():
+    available = sum(1 for replica in gateway.replicas if replica.available)
+    return {"status": "healthy" if available else "unavailable", "replicas": available}
+
+
+@app.get("/gateway/replicas")
+async def replica_status():
+    return [replica.describe() for replica in gateway.replicas]
+
+
+@app.api_route("/jobs/{job_id}{rest:path}", methods=["GET", "HEAD"])
+async def job_request(job_id: str, rest: str, request: Request):
+    # Jobs live on the replica that created them
+    replica, _ = gateway.jobs.get(job_id, (None, None))
+    if replica is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return gateway.respond(*await gateway.forward(request, [replica]))
+
+
+@app.post("/jobs/{endpoint}")
+async def submit_job(endpoint: str, request: Request):
+    replica, upstream = await gateway.forward(request, gateway.candidates(endpoint))
+    body = await upstream.aread()
+    if upstream.status_code == 200:
+        gateway.remember_job(upstream.json()["job_id"], replica)
+    return gateway.respond(replica, upstream, body)
+
+
+@app.api_route("/{path:path}", methods=["GET", "HEAD", "POST"])
+async def proxy(path: str, request: Request):
+    # Generation routes are /<endpoint>/ (or /stylize/<style>/), anything else can go anywhere
+    endpoint = path.strip("/").split("/")[0]
+    if request.method == "POST":
+        replicas = gateway.candidates(endpoint)
+    else:
+        replicas = gateway.candidates()
+    return gateway.respond(*await gateway.forward(request, replicas))
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("GATEWAY_PORT", "8080")))
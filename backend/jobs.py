@@ -0,0 +1,175 @@
+import asyncio
+import contextvars
+import os
+import shutil
+import tempfile
+import time
+import traceback
+import uuid
+
+current_job = contextvars.ContextVar("current_job", default=None)
+
+
+def set_progress(progress=None, stage=None):
+    """Report progress for the job running in this context, if any."""
+    job = current_job.get()
+    if job is None:
+        return
+    if progress is not None:
+        job.progress = progress
+    if stage is not None:
+        job.stage = stage
+    job.publish("status", job.describe())
+
+
+class Job:
+    def __init__(self, endpoint, workdir):
+        self.id = uuid.uuid4().hex
+        self.endpoint = endpoint
+        self.workdir = workdir
+        self.status = "queued"  # queued | running | done | failed
+        self.stage = None
+        self.progress = 0.0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.task = None
+        self._listeners = []  # (queue, wants previews)
+
+    def subscribe(self, previews=False, max_pending=100):
+        queue = asyncio.Queue(max_pending)
+        self._listeners.append((queue, previews))
+        return queue
+
+    def unsubscribe(self, queue):
+        self._listeners = [(q, p) for q, p in self._listeners if q is not queue]
+
+    @property
+    def wants_previews(self):
+        return any(previews for _, previews in self._listeners)
+
+    def publish(self, event, data, preview=False):
+        """Send ``(event, data)`` to subscribers, must be called on the event loop."""
+        for queue, previews in self._listeners:
+            if preview and not previews:
+                continue
+            try:
+                queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                # Slow client, drop the update rather than hold up the job
+                pass
+
+    def describe(self):
+        return {
+            "job_id": self.id,
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """Runs generations in the background, each in its own working directory.
+
+    Finished jobs (and their files) are removed ``ttl`` seconds after they
+    finish by a sweeper task.
+    """
+
+    def __init__(self, root, ttl=3600, sweep_interval=60):
+        self.root = root
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.jobs = {}
+        self._sweeper = None
+
+    def workdir(self, prefix="req-"):
+        os.makedirs(self.root, exist_ok=True)
+        return tempfile.mkdtemp(prefix=prefix, dir=self.root)
+
+    def create(self, endpoint):
+        job = Job(endpoint, None)
+        job.workdir = self.workdir(prefix=f"job-{job.id}-")
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def counts(self):
+        counts = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def start(self, job, coro):
+        job.task = asyncio.ensure_future(self._run(job, coro))
+        return job
+
+    async def _run(self, job, coro):
+        current_job.set(job)
+        job.status = "running"
+        job.started = time.time()
+        job.publish("status", job.describe())
+        try:
+            job.result = await coro
+        except Exception as e:
+            traceback.print_exc()
+            job.status = "failed"
+            job.error = getattr(e, "detail", None) or str(e) or type(e).__name__
+        else:
+            job.status = "done"
+            job.progress = 1.0
+        finally:
+            job.finished = time.time()
+            job.publish("status", job.describe())
+
+    def start_sweeper(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.ensure_future(self._sweep_forever())
+
+    async def stop_sweeper(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                traceback.print_exc()
+
+    def sweep(self, now=None):
+        now = now or time.time()
+        expired = [
+            job for job in self.jobs.values()
+            if job.finished is not None and now - job.finished > self.ttl
+        ]
+        for job in expired:
+            del self.jobs[job.id]
+            if job.result is not None:
+                job.result.close()
+            shutil.rmtree(job.workdir, ignore_errors=True)
+
+        # Request directories are normally removed once the response is sent,
+        # this catches the ones left behind by crashes or dropped connections
+        live = {job.workdir for job in self.jobs.values()}
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if path in live:
+                    continue
+                try:
+                    if now - os.path.getmtime(path) > self.ttl:
+                        shutil.rmtree(path, ignore_errors=True)
+                except FileNotFoundError:
+                    pass
+        return len(expired)
@@ -0,0 +1,153 @@
+import torch
+from kokoro import KPipeline
+from transformers import AutoModelForCausalLM, AutoProcessor, GenerationConfig, MusicgenForConditionalGeneration
+from diffusers import AnimateDiffPipeline, AnimateDiffSparseControlNetPipeline, DDIMScheduler, StableDiffusion3Pipeline
+from diffusers import StableDiffusionImg2ImgPipeline
+from diffusers.models import AutoencoderKL, MotionAdapter, SparseControlNetModel
+from diffusers.schedulers import DPMSolverMultistepScheduler
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+ANIMATION_MODEL_ID = "SG161222/Realistic_Vision_V5.1_noVAE"
+IMAGE_MODEL_ID = "stabilityai/stable-diffusion-3.5-large"
+MUSIC_MODEL_ID = "facebook/musicgen-medium"
+PHI_MODEL_ID = "microsoft/Phi-4-multimodal-instruct"
+
+# Everything besides the request that decides what a model generates, part of
+# the result cache keys. Change these whenever a loader below changes.
+MODEL_FINGERPRINTS = {
+    "animation": f"{ANIMATION_MODEL_ID}+animatediff-motion-adapter-v1-5-2/DDIMScheduler(linspace,linear)/fp16",
+    "image": f"{IMAGE_MODEL_ID}/FlowMatchEulerDiscreteScheduler/bf16",
+    "music": f"{MUSIC_MODEL_ID}/fp32",
+    "music-int8": f"{MUSIC_MODEL_ID}/int8-dynamic",
+    "phi": f"{PHI_MODEL_ID}/generation_config/left-padded",
+    "img2animate": f"{ANIMATION_MODEL_ID}+animatediff-motion-adapter-v1-5-3+sparsectrl-rgb+motion-lora-v1-5-3+sd-vae-ft-mse/DPMSolverMultistep(dpmsolver++,karras)/fp16",
+}
+
+
+def load_speech():
+    return KPipeline(lang_code='a')
+
+
+def load_music():
+    music_processor = AutoProcessor.from_pretrained(MUSIC_MODEL_ID)
+    # Weights go from the memory-mapped safetensors straight to the device, without a randomly initialised copy first
+    music_model = MusicgenForConditionalGeneration.from_pretrained(MUSIC_MODEL_ID, low_cpu_mem_usage=True, device_map=DEVICE)
+    return music_processor, music_model
+
+
+def quantize_int8(module):
+    """Dynamic int8 quantization of the Linear layers, in place, for CPU inference.
+
+    Weights are stored as int8 and activations quantized on the fly, which
+    speeds up the matmul-bound transformer parts. Convolutions (Kokoro's
+    decoder, EnCodec) stay fp32.
+    """
+    module.eval()
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_speech_int8():
+    speech_pipeline = KPipeline(lang_code='a', device='cpu')
+    quantize_int8(speech_pipeline.model)
+    return speech_pipeline
+
+
+def load_music_int8():
+    music_processor = AutoProcessor.from_pretrained(MUSIC_MODEL_ID)
+    music_model = MusicgenForConditionalGeneration.from_pretrained(MUSIC_MODEL_ID, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+    # The T5 text encoder and the token decoder do nearly all the work per step
+    quantize_int8(music_model.text_encoder)
+    quantize_int8(music_model.decoder)
+    return music_processor, music_model
+
+
+def load_animation():
+    adapter = MotionAdapter.from_pretrained(
+        "guoyww/animatediff-motion-adapter-v1-5-2",
+        torch_dtype=torch.float16
+    )
+    animation_pipe = AnimateDiffPipeline.from_pretrained(
+        ANIMATION_MODEL_ID,
+        motion_adapter=adapter,
+        torch_dtype=torch.float16
+    )
+
+    scheduler = DDIMScheduler.from_pretrained(
+        ANIMATION_MODEL_ID,
+        subfolder="scheduler",
+        clip_sample=False,
+        timestep_spacing="linspace",
+        beta_schedule="linear",
+        steps_offset=1,
+    )
+    animation_pipe.scheduler = scheduler
+
+    # Enable optimizations
+    animation_pipe.enable_vae_slicing()
+
+    # Instead of offloading, keep on GPU
+    animation_pipe.to(DEVICE)
+
+    # Optional: enable attention slicing for memory efficiency if needed
+    animation_pipe.enable_attention_slicing()
+    return animation_pipe
+
+
+def load_image():
+    image_pipe = StableDiffusion3Pipeline.from_pretrained(IMAGE_MODEL_ID, torch_dtype=torch.bfloat16)
+    return image_pipe.to(DEVICE)
+
+
+def load_phi():
+    phi_processor = AutoProcessor.from_pretrained(PHI_MODEL_ID, trust_remote_code=True)
+    # Captions are generated in padded batches, generation continues right after each prompt
+    phi_processor.tokenizer.padding_side = "left"
+    phi_model = AutoModelForCausalLM.from_pretrained(
+        PHI_MODEL_ID,
+        device_map=DEVICE,
+        torch_dtype="auto",
+        trust_remote_code=True,
+        _attn_implementation='flash_attention_2',
+    )
+    # Read once here instead of from disk on every caption
+    generation_config = GenerationConfig.from_pretrained(PHI_MODEL_ID)
+    return phi_processor, phi_model, generation_config
+
+
+def load_img2animate():
+    motion_adapter_id = "guoyww/animatediff-motion-adapter-v1-5-3"
+    controlnet_id = "guoyww/animatediff-sparsectrl-rgb"
+    lora_adapter_id = "guoyww/animatediff-motion-lora-v1-5-3"
+    vae_id = "stabilityai/sd-vae-ft-mse"
+
+    motion_adapter = MotionAdapter.from_pretrained(motion_adapter_id, torch_dtype=torch.float16)
+    controlnet = SparseControlNetModel.from_pretrained(controlnet_id, torch_dtype=torch.float16)
+    vae = AutoencoderKL.from_pretrained(vae_id, torch_dtype=torch.float16)
+    scheduler = DPMSolverMultistepScheduler.from_pretrained(
+        ANIMATION_MODEL_ID,
+        subfolder="scheduler",
+        beta_schedule="linear",
+        algorithm_type="dpmsolver++",
+        use_karras_sigmas=True,
+    )
+    img2animate_pipe = AnimateDiffSparseControlNetPipeline.from_pretrained(
+        ANIMATION_MODEL_ID,
+        motion_adapter=motion_adapter,
+        controlnet=controlnet,
+        vae=vae,
+        scheduler=scheduler,
+        torch_dtype=torch.float16,
+    )
+    img2animate_pipe.load_lora_weights(lora_adapter_id, adapter_name="motion_lora")
+
+    # move the model to the GPU
+    img2animate_pipe.to(DEVICE)
+    return img2animate_pipe
+
+
+def load_style_base(checkpoint):
+    # Base pipeline for the style presets, LoRAs are swapped in by StyleEngine
+    style_pipe = StableDiffusionImg2ImgPipeline.from_single_file(checkpoint, torch_dtype=torch.float16)
+    style_pipe.safety_checker = None
+    return style_pipe.to(DEVICE)
@@ -0,0 +1,370 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+from PIL import Image
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+from metrics import observe_stage, timed
+
+# Outputs stay in memory up to this size, larger ones roll over to an anonymous temp file
+SPOOL_BYTES = int(os.environ.get("MEDIA_SPOOL_MB", "32")) * 1024 * 1024
+CHUNK_SIZE = 256 * 1024
+
+# Animation encoding
+ENCODE_THREADS = int(os.environ.get("ENCODE_THREADS", min(8, os.cpu_count() or 1)))
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+WEBP_QUALITY = int(os.environ.get("WEBP_QUALITY", "80"))
+MP4_CRF = int(os.environ.get("MP4_CRF", "23"))
+MP4_PRESET = os.environ.get("MP4_PRESET", "veryfast")
+
+_encode_pool = ThreadPoolExecutor(ENCODE_THREADS, thread_name_prefix="encode")
+
+
+class Media:
+    """One encoded output, served straight from memory (or a temp file past ``SPOOL_BYTES``).
+
+    Bytes written are hashed as they go, the digest is used as the ETag.
+    Reads are positional so several responses can stream the same media.
+    """
+
+    def __init__(self, media_type, filename, file=None, etag=None):
+        self.media_type = media_type
+        self.filename = filename
+        # New media is written to memory until it rolls over to an anonymous temp file
+        self.file = file
+        self._buffer = io.BytesIO() if file is None else None
+        self.size = os.fstat(file.fileno()).st_size if file is not None else 0
+        # Existing files are hashed on first use (``hashed`` is False until then), new media while it is written
+        self._digest = None if file is not None else hashlib.blake2b(digest_size=16)
+        self._etag = etag
+        self._lock = threading.Lock()
+        # Extra response headers, e.g. encode timings
+        self.headers = {}
+
+    @classmethod
+    def from_path(cls, path, media_type, filename, unlink=False, etag=None):
+        """Media backed by an existing file. With ``unlink`` the file is removed
+        right away, the open handle keeps its data until the media is closed.
+        ``etag`` saves hashing the file when it is known already."""
+        media = cls(media_type, filename, open(path, "rb"), etag)
+        if unlink:
+            os.unlink(path)
+        return media
+
+    def write(self, data):
+        if self._buffer is not None and self.size + len(data) > SPOOL_BYTES:
+            self.file = tempfile.TemporaryFile()
+            self.file.write(self._buffer.getbuffer())
+            self._buffer = None
+        (self._buffer if self._buffer is not None else self.file).write(data)
+        self.size += len(data)
+        self._digest.update(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    @property
+    def in_memory(self):
+        return self._buffer is not None
+
+    @property
+    def hashed(self):
+        """Whether ``etag`` is ready without reading the file."""
+        return self._etag is not None or self._digest is not None
+
+    @property
+    def etag(self):
+        if self._etag is None:
+            if self._digest is None:
+                # Reads the whole file, call it off the event loop
+                digest = hashlib.blake2b(digest_size=16)
+                for chunk in self.chunks(0, self.size):
+                    digest.update(chunk)
+                self._etag = digest.hexdigest()
+            else:
+                self._etag = self._digest.hexdigest()
+        return self._etag
+
+    def read(self, offset, length):
+        if self.in_memory:
+            return bytes(self._buffer.getbuffer()[offset:offset + length])
+        with self._lock:
+            self.file.seek(offset)
+            return self.file.read(length)
+
+    def chunks(self, start, end):
+        """Bytes ``start`` up to (not including) ``end``."""
+        while start < end:
+            chunk = self.read(start, min(CHUNK_SIZE, end - start))
+            if not chunk:
+                return
+            start += len(chunk)
+            yield chunk
+
+    def getvalue(self):
+        return self.read(0, self.size)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            for chunk in self.chunks(0, self.size):
+                f.write(chunk)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self._buffer = None
+
+
+@timed("encode")
+def encode_png(image, filename="output.png"):
+    media = Media("image/png", filename)
+    image.save(media, format="PNG")
+    return media
+
+
+@timed("encode")
+def encode_wav(audio, sample_rate, filename="output.wav", subtype=None):
+    """``subtype`` as in soundfile, e.g. ``"FLOAT"`` to keep float32 samples (default PCM_16)."""
+    media = Media("audio/wav", filename)
+    # soundfile needs to seek back to patch the header, encode to a buffer first
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sample_rate, format="WAV", subtype=subtype)
+    media.write(buffer.getbuffer())
+    return media
+
+
+def shared_palette(frames, colors=256, samples=8, thumb_size=128):
+    """One palette for a whole animation, quantized from a strip of sampled thumbnails."""
+    step = max(1, len(frames) // samples)
+    thumbs = []
+    for frame in frames[::step]:
+        thumb = frame.convert("RGB")
+        thumb.thumbnail((thumb_size, thumb_size))
+        thumbs.append(thumb)
+    strip = Image.new("RGB", (sum(t.width for t in thumbs), max(t.height for t in thumbs)))
+    x = 0
+    for thumb in thumbs:
+        strip.paste(thumb, (x, 0))
+        x += thumb.width
+    return strip.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+
+
+def encode_gif(frames, fps=10, filename="animation.gif"):
+    # Every frame maps to the same palette, so the file carries one global
+    # color table and the frames can be quantized in parallel
+    palette = shared_palette(frames)
+    quantized = list(_encode_pool.map(lambda frame: frame.convert("RGB").quantize(palette=palette), frames))
+    media = Media("image/gif", filename)
+    quantized[0].save(
+        media,
+        format="GIF",
+        save_all=True,
+        append_images=quantized[1:],
+        optimize=False,
+        duration=1000 // fps,
+        loop=0,
+    )
+    return media
+
+
+def encode_webp(frames, fps=10, filename="animation.webp"):
+    media = Media("image/webp", filename)
+    frames[0].save(
+        media,
+        format="WEBP",
+        save_all=True,
+        append_images=frames[1:],
+        duration=1000 // fps,
+        loop=0,
+        quality=WEBP_QUALITY,
+        method=4,
+    )
+    return media
+
+
+def ffmpeg_available():
+    return shutil.which(FFMPEG_BINARY) is not None
+
+
+def encode_mp4(frames, fps=10, filename="animation.mp4"):
+    """H.264 by piping raw RGB frames (PIL images or HxWx3 uint8 arrays) into ffmpeg."""
+    first = np.asarray(frames[0])
+    height, width = first.shape[:2]
+    # +faststart rewrites the file to put the index first, so ffmpeg needs a real path
+    fd, path = tempfile.mkstemp(suffix=".mp4")
+    os.close(fd)
+    command = [
+        FFMPEG_BINARY, "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+        # yuv420p needs even dimensions
+        "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        "-c:v", "libx264", "-preset", MP4_PRESET, "-crf", str(MP4_CRF), "-pix_fmt", "yuv420p",
+        "-movflags", "+faststart", path,
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for frame in frames:
+            if isinstance(frame, Image.Image):
+                frame = frame.convert("RGB")
+            process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+        process.stdin.close()
+    except BrokenPipeError:
+        # ffmpeg exited early, the reason is on stderr
+        pass
+    error = process.stderr.read().decode(errors="replace").strip()
+    if process.wait() != 0:
+        os.unlink(path)
+        raise RuntimeError(f"ffmpeg failed: {error[-500:]}")
+    return Media.from_path(path, "video/mp4", filename, unlink=True)
+
+
+ANIMATION_ENCODERS = {
+    "gif": (encode_gif, "animation.gif"),
+    "webp": (encode_webp, "animation.webp"),
+    "mp4": (encode_mp4, "animation.mp4"),
+}
+
+
+def encode_animation(frames, format="gif", fps=10):
+    """Encode ``frames`` as one of ``ANIMATION_ENCODERS``, timing goes into ``Server-Timing``."""
+    encode, filename = ANIMATION_ENCODERS[format]
+    start = time.perf_counter()
+    media = encode(frames, fps=fps, filename=filename)
+    seconds = time.perf_counter() - start
+    media.headers["server-timing"] = f"encode;dur={seconds * 1000:.1f}"
+    observe_stage("encode", seconds)
+    print(f"Encoded {len(frames)} frames as {format}: {media.size / 1e6:.2f} MB in {seconds:.2f}s")
+    return media
+
+
+@timed("encode")
+def encode_zip(members, manifest=None, filename="batch.zip"):
+    """Zip of ``(name, Media)`` members, stored without compression since they are compressed already."""
+    media = Media("application/zip", filename)
+    with zipfile.ZipFile(media, "w", zipfile.ZIP_STORED) as archive:
+        for name, member in members:
+            with archive.open(name, "w") as f:
+                for chunk in member.chunks(0, member.size):
+                    f.write(chunk)
+        if manifest is not None:
+            archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+    return media
+
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(value, size):
+    """``(start, end)`` (end exclusive) for a single byte range, None to send everything,
+    ``ValueError`` when it can't be satisfied."""
+    match = _RANGE.match(value.strip())
+    if match is None:
+        # Multiple ranges or another unit, the full response is a valid answer
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size
+    else:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+    if start >= size or start >= end:
+        raise ValueError(value)
+    return start, end
+
+
+class MediaResponse(Response):
+    """Streams a ``Media`` with ETag, conditional GET and single byte ranges."""
+
+    def __init__(self, media, background=None, content_disposition_type="attachment"):
+        self.media = media
+        self.background = background
+        self.status_code = 200
+        self.raw_headers = []
+        self.content_disposition_type = content_disposition_type
+
+    async def __call__(self, scope, receive, send):
+        media = self.media
+        request_headers = Headers(scope=scope)
+        # Hashing a file read back from disk would hold up every other request
+        etag = f'"{media.etag if media.hashed else await asyncio.to_thread(getattr, media, "etag")}"'
+        headers = {
+            "content-type": media.media_type,
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "content-disposition": f'{self.content_disposition_type}; filename="{media.filename}"',
+            **media.headers,
+        }
+
+        status, start, end = 200, 0, media.size
+        if etag in [tag.strip() for tag in request_headers.get("if-none-match", "").split(",")]:
+            status, end = 304, 0
+        elif "range" in request_headers and request_headers.get("if-range", etag) == etag:
+            try:
+                byte_range = parse_range(request_headers["range"], media.size)
+            except ValueError:
+                status, end = 416, 0
+                headers["content-range"] = f"bytes */{media.size}"
+            else:
+                if byte_range is not None:
+                    status, (start, end) = 206, byte_range
+                    headers["content-range"] = f"bytes {start}-{end - 1}/{media.size}"
+        if status != 304:
+            headers["content-length"] = str(end - start)
+
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+        })
+        if scope.get("method") == "HEAD":
+            end = start
+        position = start
+        while True:
+            length = min(CHUNK_SIZE, end - position)
+            if length <= 0:
+                break
+            # Spooled-to-disk media is read off the event loop
+            chunk = media.read(position, length) if media.in_memory else await asyncio.to_thread(media.read, position, length)
+            if not chunk:
+                break
+            position += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
+
+
+def media_response(media, cleanup=None):
+    """Response for a freshly generated ``media``, closed (and ``cleanup`` run) once sent."""
+    def finish():
+        media.close()
+        if cleanup is not None:
+            cleanup()
+    return MediaResponse(media, background=BackgroundTask(finish))
+
+
+def persist(media, directory, prefix):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{prefix}-{media.filename}")
+    media.save(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return path
+
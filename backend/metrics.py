@@ -0,0 +1,227 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Label values come from requests, past this many series a metric folds new ones into "other"
+MAX_SERIES = 1000
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        if key not in self._series and len(self._series) >= MAX_SERIES:
+            key = ("other",) * len(self.labelnames)
+        return key
+
+    def _labels(self, pairs):
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def samples(self):
+        """``(suffix, label pairs, value)`` for every series."""
+        with self._lock:
+            items = list(self._series.items())
+        for key, value in items:
+            yield "", list(zip(self.labelnames, key)), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, pairs, value in self.samples():
+            lines.append(f"{self.name}{suffix}{self._labels(pairs)} {_number(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Set directly, or read at scrape time from ``collect()`` returning ``(labels, value)`` pairs."""
+
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    def samples(self):
+        if self.collect is None:
+            yield from super().samples()
+            return
+        for labels, value in self.collect():
+            yield "", [(name, labels.get(name, "")) for name in self.labelnames], value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf) and the sum, made cumulative when rendered
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        for key, counts, total in items:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", pairs + [("le", _number(bound))], cumulative
+            yield "_sum", pairs, total
+            yield "_count", pairs, cumulative
+
+
+class Registry:
+    """Metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "cre8_request_seconds", "Time from receiving a request to the end of its response", ["endpoint", "method", "status"])
+STAGE_SECONDS = registry.histogram(
+    "cre8_stage_seconds", "Time spent in each stage of serving a request", ["endpoint", "stage"])
+
+_scope = contextvars.ContextVar("metrics_scope", default=None)
+_endpoint = contextvars.ContextVar("metrics_endpoint", default=None)
+
+
+def _route(scope):
+    route = scope.get("route")
+    # Unmatched paths are arbitrary, keep them out of the labels
+    return getattr(route, "path", "unmatched").strip("/") or "/"
+
+
+def current_endpoint():
+    """Endpoint label for the work running in this context."""
+    endpoint = _endpoint.get()
+    if endpoint is not None:
+        return endpoint
+    scope = _scope.get()
+    return _route(scope) if scope is not None else "unknown"
+
+
+def set_endpoint(name):
+    """Label work started from here on as ``name``, e.g. a job's endpoint instead of ``jobs/{endpoint}``."""
+    _endpoint.set(name)
+
+
+def observe_stage(stage, seconds, endpoint=None):
+    STAGE_SECONDS.observe(seconds, endpoint=endpoint or current_endpoint(), stage=stage)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """Decorator recording every call as stage ``name``."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class MetricsMiddleware:
+    """Times every HTTP request, and the response send as the ``send`` stage."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _scope.set(scope)
+        start = time.perf_counter()
+        status, sending = 500, None
+
+        async def timed_send(message):
+            nonlocal status, sending
+            if message["type"] == "http.response.start":
+                status, sending = message["status"], time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            end = time.perf_counter()
+            endpoint = _route(scope)
+            REQUEST_SECONDS.observe(end - start, endpoint=endpoint, method=scope["method"], status=status)
+            if sending is not None:
+                STAGE_SECONDS.observe(end - sending, endpoint=endpoint, stage="send")
+            _scope.reset(token)
@@ -0,0 +1,117 @@
+import numpy as np
+import torch
+
+
+def tokens_for_duration(duration):
+    # 256 tokens is about 5 seconds of music
+    return int((256 * duration) / 5)
+
+
+def generate_music_batch(processor, model, prompts, max_new_tokens, seed=None):
+    """Run one padded MusicGen ``generate`` for several prompts.
+
+    Returns one mono waveform (numpy array) per prompt. ``seed`` makes the
+    sampling repeatable, only meaningful for a single prompt.
+    """
+    if seed is not None:
+        torch.manual_seed(seed)
+    inputs = processor(
+        text=list(prompts),
+        padding=True,
+        return_tensors="pt",
+    )
+
+    # Move inputs to the same device as the model
+    device = next(model.parameters()).device
+    inputs = {k: v.to(device) if hasattr(v, 'to') else v for k, v in inputs.items()}
+
+    with torch.no_grad():
+        audio_values = model.generate(**inputs, max_new_tokens=max_new_tokens)
+
+    return [audio_values[i, 0].cpu().numpy() for i in range(len(prompts))]
+
+
+class MusicWindows:
+    """Generates a track window by window instead of in one ``generate`` call.
+
+    Every window after the first is conditioned on the last ``context_seconds``
+    of audio generated so far, and the seams are crossfaded. Each call to
+    ``next_chunk`` runs one bounded ``generate`` and returns the audio that is
+    final so far, so it serves both streaming (short first window, chunks sent
+    as they are ready) and tracks longer than the model's context.
+    """
+
+    def __init__(self, processor, model, prompt, duration, window_seconds=10, context_seconds=5, first_window_seconds=None, crossfade_seconds=0.5, seed=None):
+        self.processor = processor
+        self.model = model
+        self.prompt = prompt
+        self.sampling_rate = model.config.audio_encoder.sampling_rate
+        self.window_seconds = window_seconds
+        self.first_window_seconds = first_window_seconds or window_seconds
+        self.context_samples = int(context_seconds * self.sampling_rate)
+        self.crossfade_samples = min(int(crossfade_seconds * self.sampling_rate), self.context_samples)
+        self.remaining = int(duration * self.sampling_rate)
+        self.context = None
+        self.held = np.zeros(0, dtype=np.float32)
+        self.seed = seed
+        self.windows = 0
+
+    @property
+    def done(self):
+        return self.remaining <= 0 and len(self.held) == 0
+
+    def _generate(self, new_seconds):
+        if self.context is None:
+            inputs = self.processor(text=[self.prompt], padding=True, return_tensors="pt")
+        else:
+            inputs = self.processor(
+                audio=self.context,
+                sampling_rate=self.sampling_rate,
+                text=[self.prompt],
+                padding=True,
+                return_tensors="pt",
+            )
+        device = next(self.model.parameters()).device
+        inputs = {k: v.to(device) if hasattr(v, 'to') else v for k, v in inputs.items()}
+        # Seed every window, other requests may use the lane in between
+        if self.seed is not None:
+            torch.manual_seed(self.seed + self.windows)
+        self.windows += 1
+        with torch.no_grad():
+            audio_values = self.model.generate(**inputs, max_new_tokens=max(1, tokens_for_duration(new_seconds)))
+        return audio_values[0, 0].float().cpu().numpy()
+
+    def next_chunk(self):
+        if self.remaining <= 0:
+            chunk, self.held = self.held, np.zeros(0, dtype=np.float32)
+            return chunk
+
+        seconds = self.first_window_seconds if self.context is None else self.window_seconds
+        audio = self._generate(min(seconds, self.remaining / self.sampling_rate))
+
+        if self.context is None:
+            history = np.zeros(0, dtype=np.float32)
+            head, new = history, audio
+        else:
+            # The output starts with the re-decoded context, fade from the audio
+            # held back last window into the same stretch, then continue after it
+            n = min(len(self.context), len(audio))
+            overlap = min(len(self.held), n)
+            fade = np.linspace(0.0, 1.0, overlap, dtype=np.float32)
+            head = self.held[:overlap] * (1 - fade) + audio[n - overlap:n] * fade
+            new = audio[n:]
+            history = self.context[:len(self.context) - len(self.held)]
+
+        new = new[:self.remaining]
+        # Nothing new came out, don't loop forever on a degenerate window
+        self.remaining = self.remaining - len(new) if len(new) else 0
+        audio = np.concatenate([head, new]).astype(np.float32)
+        self.context = np.concatenate([history, audio])[-self.context_samples:]
+
+        if self.remaining <= 0:
+            self.held = np.zeros(0, dtype=np.float32)
+            return audio
+        # Keep the end of this window back so the next one can fade into it
+        hold = min(self.crossfade_samples, len(audio))
+        self.held = audio[len(audio) - hold:]
+        return audio[:len(audio) - hold]
@@ -0,0 +1,161 @@
+import asyncio
+import base64
+import io
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from jobs import current_job
+from metrics import current_endpoint, observe_stage
+
+# Linear latent -> RGB projections, by number of latent channels. Good enough
+# to see composition and colours without running the VAE.
+LATENT_RGB_FACTORS = {
+    # SD 1.x / AnimateDiff
+    4: [
+        [0.3512, 0.2297, 0.3227],
+        [0.3250, 0.4974, 0.2350],
+        [-0.2829, 0.1762, 0.2721],
+        [-0.2120, -0.2616, -0.7177],
+    ],
+    # SD3 / SD3.5
+    16: [
+        [-0.0922, -0.0175, 0.0749],
+        [0.0311, 0.0633, 0.0954],
+        [0.1994, 0.0927, 0.0458],
+        [0.0856, 0.0339, 0.0902],
+        [0.0587, 0.0272, -0.0496],
+        [-0.0006, 0.1104, 0.0309],
+        [0.0978, 0.0306, 0.0427],
+        [-0.0042, 0.1038, 0.1358],
+        [-0.0194, 0.0020, 0.0669],
+        [-0.0488, 0.0130, -0.0268],
+        [0.0922, 0.0580, 0.0556],
+        [-0.0336, 0.0061, 0.0236],
+        [0.0279, 0.0436, 0.0307],
+        [0.0190, 0.0290, 0.0319],
+        [-0.0022, 0.0131, 0.0245],
+        [-0.0151, -0.0137, 0.0030],
+    ],
+}
+
+
+def latent_preview(latents):
+    """Base64 JPEG of the first latent in the batch, or None for unknown latent layouts.
+
+    Video latents (``B, C, F, H, W``) are previewed by their middle frame.
+    """
+    factors = LATENT_RGB_FACTORS.get(latents.shape[1])
+    if factors is None:
+        return None
+    x = latents[0].float()
+    if x.dim() == 4:
+        x = x[:, x.shape[1] // 2]
+    factors = torch.tensor(factors, dtype=x.dtype, device=x.device)
+    rgb = ((torch.einsum("chw,cr->hwr", x, factors) + 1) / 2).clamp(0, 1)
+    image = Image.fromarray((rgb.cpu().numpy() * 255).astype(np.uint8))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=80)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+class StepProgress:
+    """``callback_on_step_end`` for diffusers pipelines that reports to the current job.
+
+    Create it on the event loop (it picks up the job from the context), call
+    ``begin`` on the lane thread right before running the pipeline and ``end``
+    right after it returns. Outside a job it only records stage timings.
+    Previews are only decoded while a client is asking for them, at most every
+    ``preview_every`` steps, and skipped whenever their measured cost is above
+    ``preview_budget`` of the average step time.
+    """
+
+    def __init__(self, total_steps, preview_every=5, preview_budget=0.05):
+        self.job = current_job.get()
+        self.loop = asyncio.get_running_loop() if self.job is not None else None
+        self.total_steps = total_steps
+        self.preview_every = max(1, preview_every)
+        self.preview_budget = preview_budget
+        self.started = None
+        self.previews = 0
+        self.skipped_previews = 0
+        self.preview_seconds = 0.0
+        self.endpoint = current_endpoint()
+        self.steps = 0
+        self.first_step = None
+        self.last_step = None
+
+    def begin(self):
+        self.started = time.perf_counter()
+
+    def end(self):
+        """Record prompt encoding, denoising and VAE decode as stages.
+
+        The pipeline only calls back after each step, so prompt encoding is
+        the time before the first callback less one average step, and decode
+        is everything after the last one.
+        """
+        if self.started is None or self.last_step is None:
+            return
+        now = time.perf_counter()
+        step_seconds = (self.last_step - self.first_step) / (self.steps - 1) if self.steps > 1 else 0.0
+        prepare = max(self.first_step - self.started - step_seconds, 0.0)
+        observe_stage("encode_prompt", prepare, self.endpoint)
+        observe_stage("denoise", self.last_step - self.started - prepare, self.endpoint)
+        observe_stage("vae_decode", now - self.last_step, self.endpoint)
+
+    def _send(self, event, data, preview=False):
+        if event == "progress":
+            self.job.progress = data["step"] / data["total"]
+        self.job.publish(event, data, preview=preview)
+
+    def __call__(self, pipe, step, timestep, callback_kwargs):
+        now = time.perf_counter()
+        if self.started is None:
+            self.started = now
+        if self.first_step is None:
+            self.first_step = now
+        self.last_step = now
+        self.steps += 1
+        if self.job is None:
+            return callback_kwargs
+        done = step + 1
+        total = getattr(pipe, "num_timesteps", None) or self.total_steps
+        elapsed = now - self.started
+        # Time spent on previews is ours, not the model's
+        step_seconds = max(elapsed - self.preview_seconds, 1e-6) / done
+        self.loop.call_soon_threadsafe(self._send, "progress", {
+            "step": done,
+            "total": total,
+            "elapsed": round(elapsed, 3),
+            "steps_per_second": round(1 / step_seconds, 3),
+            "eta": round(step_seconds * max(total - done, 0), 3),
+        })
+
+        latents = callback_kwargs.get("latents")
+        if latents is None or done % self.preview_every or done == total or not self.job.wants_previews:
+            return callback_kwargs
+        if self.previews and self.preview_seconds / self.previews > self.preview_budget * step_seconds:
+            self.skipped_previews += 1
+            return callback_kwargs
+
+        # Wait for the step itself so it isn't billed to the preview
+        if latents.is_cuda:
+            torch.cuda.synchronize(latents.device)
+        start = time.perf_counter()
+        image = latent_preview(latents)
+        decode_seconds = time.perf_counter() - start
+        self.previews += 1
+        self.preview_seconds += decode_seconds
+        if image is not None:
+            self.loop.call_soon_threadsafe(self._send, "preview", {
+                "step": done,
+                "total": total,
+                "image": image,
+                "format": "jpeg",
+                "decode_ms": round(decode_seconds * 1000, 2),
+                "skipped": self.skipped_previews,
+            }, True)
+        return callback_kwargs
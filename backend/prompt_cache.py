@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def _nbytes(tensors):
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def batch_embeds(embeds):
+    """Keyword arguments for one pipeline call over several prompts, from their ``*_embeds`` results."""
+    batch = {}
+    for name, value in embeds[0].items():
+        values = [e[name] for e in embeds]
+        if torch.is_tensor(value):
+            batch[name] = torch.cat(values)
+        elif name.endswith("prompt"):
+            # The cache is off and the pipeline encodes the texts itself
+            batch[name] = None if all(v is None for v in values) else [v or "" for v in values]
+        else:
+            batch[name] = value
+    return batch
+
+
+class PromptEmbeddingCache:
+    """Text encoder outputs keyed on the model and the prompt text.
+
+    Prompts and negative prompts are encoded one text at a time, so a fixed
+    negative prompt or style prefix is encoded once however many prompts it
+    is paired with. Entries are kept on the CPU, they are small next to the
+    cost of encoding (a T5-XXL prompt for SD3.5 is under 3 MB) and stay valid
+    when the model is demoted or reloaded. Least recently used entries are
+    evicted past ``max_bytes``, and a budget of 0 turns the cache off.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Lanes for different models encode at the same time
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get_or_encode(self, key, encode, device):
+        """The tensors ``encode()`` returns for ``key``, on ``device``."""
+        with self._lock:
+            tensors = self._entries.get(key)
+            if tensors is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if tensors is None:
+            # Pipelines only turn off autograd inside __call__
+            with torch.no_grad():
+                tensors = tuple(t.to("cpu") for t in encode())
+            with self._lock:
+                self.misses += 1
+                self._remember(key, tensors)
+        return tuple(t.to(device) for t in tensors)
+
+    def sd3_embeds(self, pipe, model, prompt, negative_prompt=None, max_sequence_length=256):
+        """Keyword arguments for a ``StableDiffusion3Pipeline`` call, in place of ``prompt``/``negative_prompt``."""
+        if not self.enabled:
+            return {"prompt": prompt, "negative_prompt": negative_prompt, "max_sequence_length": max_sequence_length}
+
+        def encode(text):
+            # The pipeline encodes a missing negative prompt as "", through the same encoders
+            embeds, _, pooled, _ = pipe.encode_prompt(
+                prompt=text, prompt_2=None, prompt_3=None, device=pipe.device,
+                do_classifier_free_guidance=False, max_sequence_length=max_sequence_length,
+            )
+            return embeds, pooled
+
+        embeds, pooled = self.get_or_encode((model, max_sequence_length, prompt), lambda: encode(prompt), pipe.device)
+        negative = negative_prompt or ""
+        negative_embeds, negative_pooled = self.get_or_encode((model, max_sequence_length, negative), lambda: encode(negative), pipe.device)
+        return {
+            "prompt_embeds": embeds,
+            "pooled_prompt_embeds": pooled,
+            "negative_prompt_embeds": negative_embeds,
+            "negative_pooled_prompt_embeds": negative_pooled,
+        }
+
+    def animatediff_embeds(self, pipe, model, prompt, negative_prompt=None):
+        """Keyword arguments for an AnimateDiff pipeline call, in place of ``prompt``/``negative_prompt``."""
+        if not self.enabled:
+            return {"prompt": prompt, "negative_prompt": negative_prompt}
+
+        def encode(text):
+            # SD 1.5 CLIP pads every text to 77 tokens, a negative prompt encodes like any other
+            embeds, _ = pipe.encode_prompt(text, pipe.device, 1, False)
+            return (embeds,)
+
+        (embeds,) = self.get_or_encode((model, prompt), lambda: encode(prompt), pipe.device)
+        negative = negative_prompt or ""
+        (negative_embeds,) = self.get_or_encode((model, negative), lambda: encode(negative), pipe.device)
+        return {"prompt_embeds": embeds, "negative_prompt_embeds": negative_embeds}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _remember(self, key, tensors):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= _nbytes(previous)
+        self._entries[key] = tensors
+        self.bytes += _nbytes(tensors)
+        while self.bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= _nbytes(evicted)
@@ -0,0 +1,263 @@
+import asyncio
+import gc
+import time
+from contextlib import asynccontextmanager
+
+import torch
+
+from executor import lane_work
+
+GB = 1024 ** 3
+
+
+def _modules(value):
+    """Things inside a loaded model that own weights and can be moved with ``.to``."""
+    if value is None:
+        return []
+    if isinstance(value, (tuple, list)):
+        return [m for v in value for m in _modules(v)]
+    if isinstance(value, torch.nn.Module):
+        return [value]
+    # diffusers pipelines
+    if hasattr(value, "components") and hasattr(value, "to"):
+        return [value]
+    # kokoro's KPipeline wraps a KModel
+    if isinstance(getattr(value, "model", None), torch.nn.Module):
+        return [value.model]
+    return []
+
+
+def module_bytes(value):
+    total = 0
+    for module in _modules(value):
+        if hasattr(module, "components"):
+            parts = [c for c in module.components.values() if isinstance(c, torch.nn.Module)]
+        else:
+            parts = [module]
+        for part in parts:
+            total += sum(p.numel() * p.element_size() for p in part.parameters())
+            total += sum(b.numel() * b.element_size() for b in part.buffers())
+    return total
+
+
+def move_to(value, device):
+    for module in _modules(value):
+        module.to(device)
+
+
+class ModelEntry:
+    def __init__(self, name, loader, device, size_hint):
+        self.name = name
+        self.loader = loader
+        self.device = device
+        self.footprint = size_hint
+        self.value = None
+        self.state = "unloaded"  # unloaded | loading | cpu | <device>
+        self.last_used = 0.0
+        self.load_seconds = None
+        self.error = None
+        self.users = 0
+        self.loading = None
+
+    @property
+    def on_device(self):
+        return self.state == self.device
+
+    def status(self):
+        return {
+            "state": self.state,
+            "device": self.device,
+            "footprint_gb": round(self.footprint / GB, 2),
+            "last_used": self.last_used or None,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+            "in_use": self.users,
+        }
+
+
+class ModelRegistry:
+    """Loads models on first use and keeps the accelerator under a memory budget.
+
+    When a model needs to be resident and the budget is exceeded, the least
+    recently used idle models are demoted to CPU, and if the CPU budget is also
+    exceeded, unloaded entirely. A budget of ``None`` means unlimited.
+    """
+
+    def __init__(self, budget_bytes=None, cpu_budget_bytes=None):
+        self.budget_bytes = budget_bytes
+        self.cpu_budget_bytes = cpu_budget_bytes
+        self.entries = {}
+        self._residency = None
+
+    def register(self, name, loader, device="cuda", size_hint_gb=0):
+        self.entries[name] = ModelEntry(name, loader, device, int(size_hint_gb * GB))
+
+    def fitting(self, names):
+        """The first of ``names`` that fit the accelerator budget together, by size hint."""
+        chosen, planned = [], 0
+        for name in names:
+            entry = self.entries[name]
+            if self.budget_bytes is not None and planned + entry.footprint > self.budget_bytes:
+                print(f"Not preloading {name}, it doesn't fit the memory budget with the others")
+                continue
+            planned += entry.footprint
+            chosen.append(name)
+        return chosen
+
+    async def preload(self, names):
+        """Load ``names`` at the same time, so disk reads and weight copies overlap.
+
+        Returns the ones that loaded, a model that fails is reported and left
+        unloaded.
+        """
+        async def load(name):
+            async with self.use(name):
+                pass
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[load(name) for name in names], return_exceptions=True)
+        loaded = []
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                print(f"Preloading {name} failed: {result!r}")
+            else:
+                loaded.append(name)
+        print(f"Preloaded {', '.join(loaded) or 'nothing'} in {time.perf_counter() - start:.1f}s")
+        return loaded
+
+    def peek(self, name):
+        """Return the model if it is already on its device, without loading it."""
+        entry = self.entries[name]
+        return entry.value if entry.on_device else None
+
+    @asynccontextmanager
+    async def use(self, name):
+        value = await self.acquire(name)
+        work = []
+        outer = lane_work.get()
+        lane_work.set(outer + (work,))
+        try:
+            yield value
+        finally:
+            lane_work.set(outer)
+            running = [finished for finished in work if not finished.done()]
+            if running:
+                # The caller went away (client disconnect) while a lane still runs on the
+                # model, keep it pinned so it isn't demoted or unloaded under that work
+                asyncio.gather(*running).add_done_callback(lambda _: self.release(name))
+            else:
+                self.release(name)
+
+    async def acquire(self, name):
+        entry = self.entries[name]
+        # Pin first so the model can't be evicted between loading and use
+        entry.users += 1
+        try:
+            if not entry.on_device:
+                await self._make_resident(entry)
+        except BaseException:
+            entry.users -= 1
+            raise
+        entry.last_used = time.time()
+        return entry.value
+
+    def release(self, name):
+        entry = self.entries[name]
+        entry.users -= 1
+        entry.last_used = time.time()
+
+    async def _make_resident(self, entry):
+        if entry.state == "unloaded":
+            # Concurrent first requests share a single load
+            if entry.loading is None:
+                entry.loading = asyncio.ensure_future(self._load(entry))
+            await asyncio.shield(entry.loading)
+        elif entry.state == "loading":
+            await asyncio.shield(entry.loading)
+
+        if entry.state == "cpu":
+            async with self._lock():
+                if entry.state == "cpu":
+                    await self._evict_for(entry)
+                    await asyncio.to_thread(move_to, entry.value, entry.device)
+                    entry.state = entry.device
+
+    async def _load(self, entry):
+        entry.state = "loading"
+        try:
+            async with self._lock():
+                await self._evict_for(entry)
+            start = time.perf_counter()
+            value = await asyncio.to_thread(entry.loader)
+            entry.load_seconds = round(time.perf_counter() - start, 2)
+        except BaseException as e:
+            entry.state = "unloaded"
+            entry.error = repr(e)
+            raise
+        finally:
+            entry.loading = None
+
+        entry.value = value
+        entry.error = None
+        entry.footprint = module_bytes(value) or entry.footprint
+        entry.state = entry.device
+        print(f"Loaded {entry.name} in {entry.load_seconds}s ({entry.footprint / GB:.1f} GB)")
+
+        # The size hint may have been too small, trim again with the real footprint
+        async with self._lock():
+            await self._evict_for(entry)
+
+    def _lock(self):
+        if self._residency is None:
+            self._residency = asyncio.Lock()
+        return self._residency
+
+    def _usage(self, state):
+        return sum(e.footprint for e in self.entries.values() if e.state == state and e.value is not None)
+
+    def _idle(self, state, exclude):
+        candidates = [
+            e for e in self.entries.values()
+            if e.state == state and e.users == 0 and e is not exclude and e.value is not None
+        ]
+        return sorted(candidates, key=lambda e: e.last_used)
+
+    async def _evict_for(self, entry):
+        if self.budget_bytes is not None:
+            needed = entry.footprint if entry.state != entry.device else 0
+            for victim in self._idle(entry.device, entry):
+                if self._usage(entry.device) + needed <= self.budget_bytes:
+                    break
+                await self._demote(victim)
+            if self._usage(entry.device) + needed > self.budget_bytes:
+                print(f"Memory budget exceeded while making {entry.name} resident, all other models are in use")
+
+        if self.cpu_budget_bytes is not None:
+            for victim in self._idle("cpu", entry):
+                if self._usage("cpu") <= self.cpu_budget_bytes:
+                    break
+                self._unload(victim)
+
+    async def _demote(self, entry):
+        if entry.device == "cpu" or (self.cpu_budget_bytes is not None and entry.footprint > self.cpu_budget_bytes):
+            self._unload(entry)
+            return
+        print(f"Demoting {entry.name} to CPU")
+        await asyncio.to_thread(move_to, entry.value, "cpu")
+        entry.state = "cpu"
+        _free_accelerator_memory()
+
+    def _unload(self, entry):
+        print(f"Unloading {entry.name}")
+        entry.value = None
+        entry.state = "unloaded"
+        _free_accelerator_memory()
+
+    def status(self):
+        return {name: entry.status() for name, entry in self.entries.items()}
+
+
+def _free_accelerator_memory():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
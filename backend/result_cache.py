@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from media import Media
+
+
+def result_key(identity, params):
+    """Key for a generation, ``identity`` names the model/scheduler, ``params`` the request."""
+    payload = json.dumps({"identity": identity, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Generated files on disk, keyed by ``result_key``, evicted LRU once over ``max_bytes``.
+
+    Identical requests that arrive while one is already generating wait for
+    it instead of running their own copy.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight = {}
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for key in os.listdir(self.root):
+            meta_path = os.path.join(self.root, key, "meta.json")
+            try:
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+                data = os.path.join(self.root, key, meta["filename"])
+                found.append((os.path.getmtime(data), key, os.path.getsize(data)))
+            except (OSError, ValueError, KeyError):
+                # Half-written or foreign entry
+                shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total_bytes += size
+
+    def get(self, key):
+        if key not in self.entries:
+            return None
+        entry_dir = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(entry_dir, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            path = os.path.join(entry_dir, meta["filename"])
+            os.utime(path)
+            # The open file stays readable even if the entry is evicted mid-response
+            media = Media.from_path(path, meta["media_type"], meta["filename"], etag=meta.get("etag"))
+        except (OSError, ValueError, KeyError):
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return media
+
+    def put(self, key, media):
+        if self._write(key, media):
+            self._add(key, media.size)
+
+    def _write(self, key, media):
+        # Only touches the disk, safe to run off the event loop
+        if media.size > self.max_bytes or key in self.entries:
+            return False
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        try:
+            media.save(os.path.join(tmp, media.filename))
+            with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"media_type": media.media_type, "filename": media.filename, "etag": media.etag}, f)
+            os.replace(tmp, os.path.join(self.root, key))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return False
+        return True
+
+    def _add(self, key, size):
+        self.entries[key] = size
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        self.total_bytes -= self.entries.pop(key, 0)
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+    async def get_or_compute(self, key, compute):
+        """Return the cached media for ``key`` or ``await compute()`` (and cache it)."""
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            self.coalesced += 1
+            try:
+                await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The leader's client went away, take over unless we were cancelled ourselves
+                if not future.cancelled():
+                    raise
+            else:
+                if key not in self.entries:
+                    # Too big to keep, generate our own copy
+                    break
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            media = await compute()
+            if await asyncio.to_thread(self._write, key, media):
+                self._add(key, media.size)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Waiters are optional, don't warn about an unretrieved exception
+            future.exception()
+            raise
+        else:
+            future.set_result(None)
+        finally:
+            del self._inflight[key]
+        return media
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
@@ -0,0 +1,35 @@
+import os
+import sys
+from typing import NamedTuple, Optional
+
+from workers import WorkerError, WorkerPool
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sd_worker.py")
+
+__all__ = ["WORKER_SCRIPT", "SDModelKey", "SDWorkerPool", "WorkerError"]
+
+
+class SDModelKey(NamedTuple):
+    model: str
+    lora_model_dir: Optional[str] = None
+    vae: Optional[str] = None
+
+
+class SDWorkerPool(WorkerPool):
+    """Keeps sd.cpp worker processes warm, one checkpoint/LoRA/VAE combination each."""
+
+    kind = "sd.cpp"
+
+    def __init__(self, command=None, **kwargs):
+        super().__init__(command or [sys.executable, WORKER_SCRIPT], **kwargs)
+
+    def _worker_command(self, key):
+        command = list(self.command) + ["--model", key.model]
+        if key.lora_model_dir:
+            command += ["--lora-model-dir", key.lora_model_dir]
+        if key.vae:
+            command += ["--vae", key.vae]
+        return command
+
+    async def img2img(self, key, **request):
+        return await self.request(key, **request)
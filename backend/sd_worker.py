@@ -0,0 +1,142 @@
+"""Long-lived stable-diffusion.cpp worker.
+
+Loads one checkpoint (plus optional LoRA dir / VAE) once and then renders
+img2img requests read as JSON lines from stdin, answering each with a JSON line
+on stdout. The first line written is ``{"ready": true, ...}`` once the model is
+loaded. Started and managed by ``sd_pool.SDWorkerPool``.
+
+Engines:
+  bindings  keep the model loaded with the stable-diffusion-cpp-python bindings
+  cli       run the sd binary for every request (no warm model, fallback only)
+  fake      sleep instead of rendering, for testing and benchmarking the pool
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+SD_BINARY = "/home/h039y17/FH/stable-diffusion.cpp/build/bin/sd"
+
+
+class BindingsEngine:
+    def __init__(self, args):
+        from stable_diffusion_cpp import StableDiffusion
+
+        self.sd = StableDiffusion(
+            model_path=args.model,
+            lora_model_dir=args.lora_model_dir or "",
+            vae_path=args.vae or "",
+        )
+
+    def render(self, request):
+        from PIL import Image
+
+        images = self.sd.generate_image(
+            prompt=request["prompt"],
+            negative_prompt=request.get("negative_prompt", ""),
+            init_image=Image.open(request["init_image"]).convert("RGB"),
+            strength=request.get("strength", 0.75),
+            cfg_scale=request.get("cfg_scale", 7.0),
+            sample_method=request.get("sampling_method", "euler_a"),
+            sample_steps=request.get("steps", 20),
+            seed=request.get("seed", -1),
+            width=request.get("width", 512),
+            height=request.get("height", 512),
+            control_strength=request.get("control_strength", 0.9),
+            style_strength=request.get("style_ratio", 20),
+        )
+        images[0].save(request["output"])
+
+
+class CliEngine:
+    def __init__(self, args):
+        self.args = args
+
+    def render(self, request):
+        command = [SD_BINARY, "--mode", "img2img", "-m", self.args.model]
+        if self.args.lora_model_dir:
+            command += ["--lora-model-dir", self.args.lora_model_dir]
+        if self.args.vae:
+            command += ["--vae", self.args.vae]
+        command += [
+            "-p", request["prompt"],
+            "--negative-prompt", request.get("negative_prompt", ""),
+            "-i", request["init_image"],
+            "-o", request["output"],
+        ]
+        for option, field in [
+            ("--strength", "strength"),
+            ("--style-ratio", "style_ratio"),
+            ("--cfg-scale", "cfg_scale"),
+            ("--control-strength", "control_strength"),
+            ("--steps", "steps"),
+            ("--sampling-method", "sampling_method"),
+            ("--seed", "seed"),
+            ("--height", "height"),
+            ("--width", "width"),
+        ]:
+            if request.get(field) is not None:
+                command += [option, str(request[field])]
+        result = subprocess.run(command, capture_output=True, text=True)
+        print(result.stdout, file=sys.stderr)
+        print(result.stderr, file=sys.stderr)
+        if result.returncode != 0:
+            raise RuntimeError(f"sd exited with {result.returncode}")
+
+
+class FakeEngine:
+    def __init__(self, args):
+        self.render_seconds = args.fake_render_seconds
+        time.sleep(args.fake_load_seconds)
+
+    def render(self, request):
+        from PIL import Image
+
+        time.sleep(self.render_seconds)
+        Image.new("RGB", (request.get("width", 512), request.get("height", 512))).save(request["output"])
+
+
+ENGINES = {"bindings": BindingsEngine, "cli": CliEngine, "fake": FakeEngine}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--lora-model-dir")
+    parser.add_argument("--vae")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default=os.environ.get("SD_WORKER_ENGINE", "bindings"))
+    parser.add_argument("--fake-load-seconds", type=float, default=2.0)
+    parser.add_argument("--fake-render-seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    # stdout carries the protocol, anything the native library prints goes to stderr
+    protocol = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+
+    def reply(message):
+        protocol.write(json.dumps(message) + "\n")
+
+    start = time.perf_counter()
+    engine = ENGINES[args.engine](args)
+    reply({"ready": True, "pid": os.getpid(), "load_seconds": round(time.perf_counter() - start, 3)})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if request.get("op") == "ping":
+            reply({"op": "pong"})
+            continue
+        start = time.perf_counter()
+        try:
+            engine.render(request)
+        except Exception as e:
+            reply({"id": request.get("id"), "ok": False, "error": str(e)})
+        else:
+            reply({"id": request.get("id"), "ok": True, "output": request["output"], "seconds": round(time.perf_counter() - start, 3)})
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,45 @@
+import asyncio
+import inspect
+import json
 import os
-import subprocess
+from functools import partial, wraps
 import tempfile
+import time
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional, get_origin
 from pyngrok import ngrok
 from fastapi.responses import RedirectResponse
-from kokoro import KPipeline
-from IPython.display import display, Audio
-from transformers import AutoProcessor, MusicgenForConditionalGeneration
-from diffusers import AnimateDiffPipeline, DDIMScheduler, MotionAdapter
-from diffusers import StableDiffusion3Pipeline
-from diffusers.utils import export_to_gif
-import soundfile as sf
+from diffusers.utils import export_to_video
+import numpy as np
 import torch
-import scipy
 import shutil
-from fastapi import FastAPI, File, Form, UploadFile
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from pydantic import TypeAdapter
 from PIL import Image
-from transformers import AutoModelForCausalLM, AutoProcessor, GenerationConfig
-from diffusers import AnimateDiffSparseControlNetPipeline
-from diffusers.models import AutoencoderKL, MotionAdapter, SparseControlNetModel
-from diffusers.schedulers import DPMSolverMultistepScheduler
-from diffusers.utils import export_to_gif, load_image
 from fastapi.middleware.cors import CORSMiddleware
+import loaders
+from admission import AdmissionController, CostModel, Overloaded, UserMiddleware, record_wait, skip_calibration
+from executor import InferenceExecutor
+from batching import MicroBatcher
+from batch_generation import ChunkSizes, item_seeds, run_chunked
+from music import MusicWindows, generate_music_batch, tokens_for_duration
+from audio import to_pcm16, wav_header
+from registry import GB, ModelRegistry
+from caption_cache import CaptionCache, caption_key
+from captions import DEFAULT_CAPTION_PROMPT, caption_batch
+from jobs import JobManager, set_progress
+from media import ANIMATION_ENCODERS, Media, MediaResponse, encode_animation, encode_png, encode_wav, encode_zip, ffmpeg_available, media_response, persist
+from metrics import CONTENT_TYPE, MetricsMiddleware, current_endpoint, observe_stage, registry, set_endpoint, stage, timed
+from progress import StepProgress
+from prompt_cache import PromptEmbeddingCache, batch_embeds
+from result_cache import ResultCache, result_key
+from speech import SpeechEngine
+from sd_pool import SDModelKey, SDWorkerPool, WorkerError
+from video_pool import VideoModelKey, VideoWorkerPool, release_frames, with_frames
+from styles import SCHEDULERS, SD_CPP_DIR, SD_CPP_ONLY_PARAMETERS, SD_CPP_SAMPLERS, StyleEngine, load_presets
+from uploads import UploadLimitMiddleware, read_upload
 
 app = FastAPI(title="Cre8.ai API")
 app.add_middleware(
@@ -34,111 +49,210 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+# Gateways and proxies whose X-User-Id / X-Forwarded-For say who a request is for
+TRUSTED_PROXIES = [proxy.strip() for proxy in os.environ.get("TRUSTED_PROXIES", "").split(",") if proxy.strip()]
+app.add_middleware(UserMiddleware, trusted_proxies=TRUSTED_PROXIES)
+# Uploads over the cap are turned away while they stream in
+UPLOAD_MAX_BYTES = int(float(os.environ.get("UPLOAD_MAX_MB", "20")) * 2 ** 20)
+app.add_middleware(UploadLimitMiddleware, max_bytes=UPLOAD_MAX_BYTES)
+
+# Requests and jobs each get an isolated working directory under WORK_DIR
+WORK_DIR = os.environ.get("WORK_DIR", os.path.join(os.getcwd(), "work"))
+jobs = JobManager(WORK_DIR, ttl=int(os.environ.get("JOB_TTL_SECONDS", "3600")))
+
+# "gpu" serves every endpoint. "cpu" is for nodes without an accelerator and
+# only serves speech and music, from int8-quantized Kokoro and MusicGen.
+SERVING_TIER = os.environ.get("SERVING_TIER", "gpu")
+CPU_ENDPOINTS = {"text2speech", "text2music"}
+
+VIDEO_WORKERS = int(os.environ.get("VIDEO_WORKERS", "1"))
+# Segments of a long text are synthesized in parallel. On the CPU tier every one
+# already spreads over all CPU_THREADS, more at once would only oversubscribe the cores.
+SPEECH_WORKERS = 1 if SERVING_TIER == "cpu" else int(os.environ.get("SPEECH_WORKERS", "4"))
+
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "cre8_queue_wait_seconds", "Time inference calls wait for their model's lane", ["model"])
+
+def record_queue_wait(lane, seconds):
+    QUEUE_WAIT_SECONDS.observe(seconds, model=lane)
+    observe_stage("queue_wait", seconds)
+    record_wait(seconds)
+
+# One worker queue per model so blocking inference never runs on the event loop.
+# Lanes are independent, e.g. Kokoro and MusicGen can generate at the same time.
+executor = InferenceExecutor({
+    "speech": 1,
+    "speech-segments": SPEECH_WORKERS,
+    "music": 1,
+    "animation": 1,
+    "image": 1,
+    "phi": 1,
+    "img2animate": 1,
+    "style": 1,
+    "video": VIDEO_WORKERS,
+}, on_wait=record_queue_wait)
+
+def _budget(name):
+    value = os.environ.get(name)
+    return int(float(value) * GB) if value else None
+
+# Models are loaded on first use. When the accelerator budget is exceeded the
+# least recently used idle models are demoted to CPU, then unloaded.
+models = ModelRegistry(
+    budget_bytes=_budget("MODEL_MEMORY_BUDGET_GB"),
+    cpu_budget_bytes=_budget("MODEL_CPU_BUDGET_GB"),
+)
+
+# Size hints are only used until the real footprint is known after loading
+if SERVING_TIER == "cpu":
+    # One pool of intra-op threads shared by the speech and music lanes
+    torch.set_num_threads(int(os.environ.get("CPU_THREADS", os.cpu_count() or 1)))
+    models.register("speech", loaders.load_speech_int8, "cpu", size_hint_gb=0.3)
+    models.register("music", loaders.load_music_int8, "cpu", size_hint_gb=2)
+    MUSIC_MODEL = "music-int8"
+else:
+    models.register("speech", loaders.load_speech, loaders.DEVICE, size_hint_gb=0.5)
+    models.register("music", loaders.load_music, loaders.DEVICE, size_hint_gb=6)
+    models.register("animation", loaders.load_animation, loaders.DEVICE, size_hint_gb=4)
+    models.register("image", loaders.load_image, loaders.DEVICE, size_hint_gb=18)
+    models.register("phi", loaders.load_phi, loaders.DEVICE, size_hint_gb=12)
+    models.register("img2animate", loaders.load_img2animate, loaders.DEVICE, size_hint_gb=5)
+    MUSIC_MODEL = "music"
+
+# stable-diffusion.cpp renders go to long-lived workers that keep their checkpoint
+# loaded instead of starting the sd binary (and reloading the model) per request
+sd_pool = SDWorkerPool(
+    command=os.environ.get("SD_WORKER_CMD", "").split() or None,
+    max_workers=int(os.environ.get("SDCPP_WORKERS", "1")),
+    request_timeout=float(os.environ.get("SD_WORKER_TIMEOUT", "600")),
+)
+
+async def run_sd(key, **request):
+    try:
+        with stage("subprocess"):
+            response = await sd_pool.img2img(key, **request)
+    except WorkerError as e:
+        raise HTTPException(status_code=500, detail=f"Image generation failed: {e}")
+    print(f"Image generated in {response['seconds']}s at: {response['output']}")
+    return response
 
-# Global variables to store models
-speech_pipeline = None
-music_processor = None
-music_model = None
-animation_pipe = None
-image_pipe = None
-phi_model = None
-phi_processor = None
-img2animate_pipe = None
+# Wan2.1 stays loaded in VIDEO_WORKERS worker processes, frames come back over
+# shared memory and are encoded on the video lane
+video_pool = VideoWorkerPool(
+    command=os.environ.get("VIDEO_WORKER_CMD", "").split() or None,
+    max_workers=VIDEO_WORKERS,
+    request_timeout=float(os.environ.get("VIDEO_WORKER_TIMEOUT", "1800")),
+)
+VIDEO_MODEL = VideoModelKey(os.environ.get("WAN_CKPT_DIR", "/home/h039y17/FH/Wan2.1-T2V-1.3B"), "t2v-1.3B")
+
+# img2ghibli, niggafy, img2pixar, anti-ghibli and /stylize/{style}/ are all
+# driven by presets (styles.py, extended with STYLE_PRESETS_FILE). They render
+# in-process with diffusers by default, or through the sd.cpp pool.
+STYLE_ENGINE = os.environ.get("STYLE_ENGINE", "diffusers")
+style_presets = load_presets(os.environ.get("STYLE_PRESETS_FILE"))
+style_engine = StyleEngine(max_adapters=int(os.environ.get("STYLE_MAX_ADAPTERS", "4")))
+
+# Users often send the same photo to several styles, don't caption it twice
+caption_cache = CaptionCache(
+    max_entries=int(os.environ.get("CAPTION_CACHE_SIZE", "256")),
+    disk_dir=os.environ.get("CAPTION_CACHE_DIR") or None,
+)
 
-UPLOAD_DIR = "/home/h039y17/FH/stable-diffusion.cpp/uploads"
+# Text encoder outputs for SD3.5 and the AnimateDiff pipelines, repeated
+# prompts and the fixed negative prompts skip the encoders (T5-XXL for SD3.5)
+prompt_embeddings = PromptEmbeddingCache(int(float(os.environ.get("EMBEDDING_CACHE_MB", "512")) * 2 ** 20))
+
+# Diffusion jobs stream step progress over /jobs/{id}/events, previews are
+# decoded from latents every PREVIEW_EVERY steps while they stay cheap
+PREVIEW_EVERY = int(os.environ.get("PREVIEW_EVERY", "5"))
+PREVIEW_BUDGET = float(os.environ.get("PREVIEW_BUDGET", "0.05"))
+
+def step_progress(total_steps):
+    return StepProgress(total_steps, preview_every=PREVIEW_EVERY, preview_budget=PREVIEW_BUDGET)
+
+# Concurrent MusicGen requests with the same duration share one generate call
+MUSIC_BATCH_SIZE = int(os.environ.get("MUSIC_BATCH_SIZE", "4"))
+MUSIC_BATCH_WAIT_MS = float(os.environ.get("MUSIC_BATCH_WAIT_MS", "50"))
+
+async def run_music_batch(max_new_tokens, prompts):
+    async with models.use("music") as (music_processor, music_model):
+        audios = await executor.run("music", generate_music_batch, music_processor, music_model, prompts, max_new_tokens)
+        sampling_rate = music_model.config.audio_encoder.sampling_rate
+    return [(audio, sampling_rate) for audio in audios]
+
+music_batcher = MicroBatcher(run_music_batch, max_batch_size=MUSIC_BATCH_SIZE, max_wait=MUSIC_BATCH_WAIT_MS / 1000)
+
+# Longer tracks and streams are generated in windows, each conditioned on the
+# end of the previous one, so memory stays bounded and chunks arrive early
+MUSIC_MAX_SINGLE_SECONDS = float(os.environ.get("MUSIC_MAX_SINGLE_SECONDS", "20"))
+MUSIC_WINDOW_SECONDS = float(os.environ.get("MUSIC_WINDOW_SECONDS", "10"))
+MUSIC_CONTEXT_SECONDS = float(os.environ.get("MUSIC_CONTEXT_SECONDS", "5"))
+MUSIC_FIRST_WINDOW_SECONDS = float(os.environ.get("MUSIC_FIRST_WINDOW_SECONDS", "3"))
+MUSIC_CROSSFADE_SECONDS = float(os.environ.get("MUSIC_CROSSFADE_SECONDS", "0.5"))
+
+async def music_windows(prompt, duration, first_window_seconds=None, seed=None):
+    async with models.use("music") as (music_processor, music_model):
+        windows = MusicWindows(
+            music_processor,
+            music_model,
+            prompt,
+            duration,
+            window_seconds=MUSIC_WINDOW_SECONDS,
+            context_seconds=MUSIC_CONTEXT_SECONDS,
+            first_window_seconds=first_window_seconds,
+            crossfade_seconds=MUSIC_CROSSFADE_SECONDS,
+            seed=seed,
+        )
+        # One lane call per window, batched requests can run in between
+        while not windows.done:
+            chunk = await executor.run("music", windows.next_chunk)
+            yield chunk, windows.sampling_rate
+
+async def generate_track(prompt, duration, seed=None):
+    if duration <= MUSIC_MAX_SINGLE_SECONDS:
+        if seed is None:
+            return await music_batcher.submit(tokens_for_duration(duration), prompt)
+        # A fixed seed only holds for a batch of one
+        async with models.use("music") as (music_processor, music_model):
+            audios = await executor.run("music", generate_music_batch, music_processor, music_model, [prompt], tokens_for_duration(duration), seed)
+            return audios[0], music_model.config.audio_encoder.sampling_rate
+    chunks, sampling_rate = [], None
+    async for chunk, sampling_rate in music_windows(prompt, duration, seed=seed):
+        chunks.append(chunk)
+        set_progress(progress=sum(len(c) for c in chunks) / (duration * sampling_rate))
+    return np.concatenate(chunks), sampling_rate
+
+async def stream_music(prompt, duration, ticket, seed=None):
+    # Short first window so the client hears something quickly, header goes with it
+    header_sent = False
+    async with ticket:
+        async for chunk, sampling_rate in music_windows(prompt, duration, MUSIC_FIRST_WINDOW_SECONDS, seed):
+            if not header_sent:
+                yield wav_header(sampling_rate)
+                header_sent = True
+            yield to_pcm16(chunk)
+
+startup_loading = None
 
-# Initialize models on startup
 @app.on_event("startup")
-async def load_models():
-    global speech_pipeline, music_processor, music_model, animation_pipe, image_pipe, phi_model, phi_processor
-    
-    # Move models to GPU and keep them there
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    
-    # Load speech model
-    speech_pipeline = KPipeline(lang_code='a')
-    
-    # Load music model
-    music_processor = AutoProcessor.from_pretrained("facebook/musicgen-medium")
-    music_model = MusicgenForConditionalGeneration.from_pretrained("facebook/musicgen-medium")
-    music_model.to(device)
-    
-    # Load animation model
-    adapter = MotionAdapter.from_pretrained(
-        "guoyww/animatediff-motion-adapter-v1-5-2", 
-        torch_dtype=torch.float16
-    )
-    model_id = "SG161222/Realistic_Vision_V5.1_noVAE"
-    animation_pipe = AnimateDiffPipeline.from_pretrained(
-        model_id, 
-        motion_adapter=adapter, 
-        torch_dtype=torch.float16
-    )
-    
-    scheduler = DDIMScheduler.from_pretrained(
-        model_id,
-        subfolder="scheduler",
-        clip_sample=False,
-        timestep_spacing="linspace",
-        beta_schedule="linear",
-        steps_offset=1,
-    )
-    animation_pipe.scheduler = scheduler
-    
-    # Enable optimizations
-    animation_pipe.enable_vae_slicing()
-    
-    # Instead of offloading, keep on GPU
-    animation_pipe.to(device)
-    
-    # Optional: enable attention slicing for memory efficiency if needed
-    animation_pipe.enable_attention_slicing()
-
-    image_pipe = StableDiffusion3Pipeline.from_pretrained("stabilityai/stable-diffusion-3.5-large", torch_dtype=torch.bfloat16)
-    image_pipe = image_pipe.to("cuda")
-
-    phi_model_path = "microsoft/Phi-4-multimodal-instruct"
-    phi_processor = AutoProcessor.from_pretrained(phi_model_path, trust_remote_code=True)
-    phi_model = AutoModelForCausalLM.from_pretrained(
-        phi_model_path, 
-        device_map="cuda", 
-        torch_dtype="auto", 
-        trust_remote_code=True,
-        _attn_implementation='flash_attention_2',
-    ).cuda()
-
-    model_id = "SG161222/Realistic_Vision_V5.1_noVAE"
-    motion_adapter_id = "guoyww/animatediff-motion-adapter-v1-5-3"
-    controlnet_id = "guoyww/animatediff-sparsectrl-rgb"
-    lora_adapter_id = "guoyww/animatediff-motion-lora-v1-5-3"
-    vae_id = "stabilityai/sd-vae-ft-mse"
-    device = "cuda"
-
-    motion_adapter = MotionAdapter.from_pretrained(motion_adapter_id, torch_dtype=torch.float16).to(device)
-    controlnet = SparseControlNetModel.from_pretrained(controlnet_id, torch_dtype=torch.float16).to(device)
-    vae = AutoencoderKL.from_pretrained(vae_id, torch_dtype=torch.float16).to(device)
-    scheduler = DPMSolverMultistepScheduler.from_pretrained(
-        model_id,
-        subfolder="scheduler",
-        beta_schedule="linear",
-        algorithm_type="dpmsolver++",
-        use_karras_sigmas=True,
-    )
-    img2animate_pipe = AnimateDiffSparseControlNetPipeline.from_pretrained(
-        model_id,
-        motion_adapter=motion_adapter,
-        controlnet=controlnet,
-        vae=vae,
-        scheduler=scheduler,
-        torch_dtype=torch.float16,
-    ).to(device)
-    img2animate_pipe.load_lora_weights(lora_adapter_id, adapter_name="motion_lora")
-
-    # move the model to the GPU
-    img2animate_pipe.to(device)
-    print("Loaded Image2Animation pipeline")
-
-    print("All models loaded and ready on GPU")
+async def start_executor():
+    global startup_loading
+    executor.start()
+    jobs.start_sweeper()
+    sd_pool.start_health_checks()
+    video_pool.start_health_checks()
+    # Loaded in the background, each route opens as soon as its own models are in
+    startup_loading = asyncio.ensure_future(models.preload(STARTUP_MODELS))
+
+@app.on_event("shutdown")
+async def stop_executor():
+    if startup_loading is not None:
+        startup_loading.cancel()
+    await jobs.stop_sweeper()
+    await sd_pool.shutdown()
+    await video_pool.shutdown()
+    executor.shutdown()
 
 ngrok.set_auth_token("2tIdLS08W1jZ7UTpLqU8vO7G84S_7BuNoFdSU533QDctd2g3x")  
 tunnel_config = {
@@ -155,128 +269,301 @@ class AnimatePrompt(BaseModel):
     num_inference_steps: int = Form(25, ge=1, le=100)
     seed: Optional[int] = Form(None)
 
-def caption_image(image_path, caption_prompt="Describe this image in detail."):
-    global phi_processor, phi_model
-    image = Image.open(image_path)
-    generation_config = GenerationConfig.from_pretrained("microsoft/Phi-4-multimodal-instruct")
-    user_prompt = '<|user|>'
-    assistant_prompt = '<|assistant|>'
-    prompt_suffix = '<|end|>'
-    prompt = f'{user_prompt}<|image_1|>{caption_prompt}{prompt_suffix}{assistant_prompt}'
-    inputs = phi_processor(text=prompt, images=image, return_tensors='pt').to('cuda:0')
-    generate_ids = phi_model.generate(
-    **inputs,
-    max_new_tokens=1000,
-    generation_config=generation_config,
-    num_logits_to_keep=1
-    )
-    generate_ids = generate_ids[:, inputs['input_ids'].shape[1]:]
-    response = phi_processor.batch_decode(
-        generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False
-    )[0]
-    return response
+# Concurrent captions share one padded Phi-4 generate. One batch runs at a
+# time and the next collects while it does, so batches grow with load.
+CAPTION_BATCH_SIZE = int(os.environ.get("CAPTION_BATCH_SIZE", "8"))
+CAPTION_BATCH_WAIT_MS = float(os.environ.get("CAPTION_BATCH_WAIT_MS", "20"))
+
+# Captions are appended to prompts that CLIP cuts at 77 tokens, longer ones
+# only cost generation time. img2sound's caption is the whole MusicGen prompt.
+CAPTION_MAX_TOKENS = int(os.environ.get("CAPTION_MAX_TOKENS", "96"))
+CAPTION_TOKEN_BUDGETS = {"img2sound": int(os.environ.get("IMG2SOUND_CAPTION_MAX_TOKENS", "256"))}
+# Phi-4 tiles images into 448px crops, 2x2 of them is plenty for a caption
+CAPTION_IMAGE_SIZE = int(os.environ.get("CAPTION_IMAGE_SIZE", "896"))
+
+CAPTION_TOKENS = registry.counter("cre8_caption_tokens_total", "Tokens generated for captions", ["endpoint"])
+CAPTION_GENERATE_SECONDS = registry.histogram("cre8_caption_generate_seconds", "Time per batched caption generate call")
+CAPTION_BATCH_SIZE_OBSERVED = registry.histogram(
+    "cre8_caption_batch_size", "Images captioned per generate call", buckets=(1, 2, 4, 8, 16, 32))
+
+async def run_caption_batch(max_new_tokens, items):
+    def caption(phi):
+        images = [upload.fitted(CAPTION_IMAGE_SIZE) for upload, _ in items]
+        return caption_batch(phi, images, [prompt for _, prompt in items], max_new_tokens)
+
+    async with models.use("phi") as phi:
+        start = time.perf_counter()
+        captions, tokens = await executor.run("phi", caption, phi)
+    seconds = time.perf_counter() - start
+    CAPTION_GENERATE_SECONDS.observe(seconds)
+    CAPTION_BATCH_SIZE_OBSERVED.observe(len(items))
+    print(f"Captioned {len(items)} images in {seconds:.2f}s, {sum(tokens) / seconds:.0f} tokens/s")
+    return list(zip(captions, tokens))
+
+caption_batcher = MicroBatcher(run_caption_batch, max_batch_size=CAPTION_BATCH_SIZE, max_wait=CAPTION_BATCH_WAIT_MS / 1000, max_inflight=1)
+
+async def describe_image(upload, caption_prompt=DEFAULT_CAPTION_PROMPT):
+    endpoint = current_endpoint().split("/")[0]
+    max_new_tokens = CAPTION_TOKEN_BUDGETS.get(endpoint, CAPTION_MAX_TOKENS)
+    key = caption_key(upload.digest, caption_prompt, max_new_tokens, CAPTION_IMAGE_SIZE)
+    caption = caption_cache.get(key)
+    if caption is not None:
+        return caption
+
+    # Batched by budget, a batch generates until its longest caption is done
+    with stage("caption"):
+        caption, tokens = await caption_batcher.submit(max_new_tokens, (upload, caption_prompt))
+    CAPTION_TOKENS.inc(tokens, endpoint=endpoint)
+    caption_cache.put(key, caption)
+    return caption
 
 @app.get("/")
 async def redirect_root_to_docs():
     return RedirectResponse("/docs")
 
-@app.post("/text2speech/")
-async def generate_speech(prompt: str = Form(...)):
-    global speech_pipeline
-    text = prompt
+# What AnimateDiff renders at, the conditioning frame is resized to it
+ANIMATION_SIZE = 512
+
+# Uploads are read once, off the event loop, and decoded once at the smallest
+# size that still covers the caption and the requested output
+async def receive_upload(file, params):
+    covers = [CAPTION_IMAGE_SIZE, (params.get("width") or ANIMATION_SIZE, params.get("height") or ANIMATION_SIZE)]
+    with stage("upload"):
+        try:
+            return await asyncio.to_thread(read_upload, file.file, covers)
+        except (OSError, Image.DecompressionBombError):
+            raise HTTPException(status_code=400, detail="Upload is not a readable image")
+
+# Outputs are encoded in memory and streamed from there, OUTPUT_DIR opts in to
+# also keeping a copy of every result on disk
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR") or None
+
+GENERATION_SECONDS = registry.histogram(
+    "cre8_generation_seconds",
+    "Time to produce a result, by endpoint and the parameters that drive its cost",
+    ["endpoint", "steps", "frames", "resolution", "duration"],
+)
 
-    output_dir = os.path.join(os.getcwd(), "generated_speech")
-    os.makedirs(output_dir, exist_ok=True)
+def generation_labels(params):
+    steps = params.get("num_inference_steps", params.get("steps"))
+    height, width = params.get("height"), params.get("width")
+    return {
+        "steps": "" if steps is None else steps,
+        "frames": params.get("num_frames", ""),
+        "resolution": f"{width}x{height}" if height and width else "",
+        "duration": params.get("duration", ""),
+    }
+
+async def produce(run, workdir, name, ticket, **params):
+    # Waits for the request's turn on its model or worker pool (admission.py)
+    set_progress(stage="queued")
+    queued = time.perf_counter()
+    async with ticket:
+        start = time.perf_counter()
+        observe_stage("admission", start - queued)
+        media = await run(workdir, **params)
+        GENERATION_SECONDS.observe(time.perf_counter() - start, endpoint=current_endpoint(), **generation_labels(params))
+    if OUTPUT_DIR:
+        await asyncio.to_thread(persist, media, OUTPUT_DIR, name)
+    return media
+
+async def run_request(run, **params):
+    # Turned away before anything is uploaded or generated when the wait would be too long
+    ticket = admit(current_endpoint().split("/")[0], params)
+    # Every request gets its own working directory (uploads, tool outputs), removed once the response is sent
+    workdir = jobs.workdir()
+    try:
+        if "file" in params:
+            params["upload"] = await receive_upload(params.pop("file"), params)
+        media = await produce(run, workdir, os.path.basename(workdir), ticket, **params)
+    except BaseException:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+    return media_response(media, cleanup=partial(shutil.rmtree, workdir, ignore_errors=True))
+
+# Seeded generations are deterministic, repeated ones are served from disk
+RESULT_CACHE_MAX_GB = float(os.environ.get("RESULT_CACHE_MAX_GB", "5"))
+result_cache = ResultCache(
+    os.environ.get("RESULT_CACHE_DIR") or os.path.join(os.getcwd(), "cache", "results"),
+    int(RESULT_CACHE_MAX_GB * GB),
+) if RESULT_CACHE_MAX_GB > 0 else None
+
+def cached(model, *settings, default_seed=None):
+    """Serve ``run`` from the result cache when its output is fully determined.
+
+    The key covers the model fingerprint, ``settings`` and every parameter
+    (uploads by content). Calls without a seed (or with -1) are random and
+    always run.
+    """
+    identity = [loaders.MODEL_FINGERPRINTS[model], *settings]
+
+    def decorate(run):
+        @wraps(run)
+        async def run_cached(workdir, **params):
+            params.pop("stream", None)
+            seed = params.get("seed")
+            if seed is None:
+                seed = default_seed
+            if result_cache is None or seed is None or seed < 0:
+                return await run(workdir, **params)
+
+            key_params = dict(params, seed=seed)
+            if "upload" in key_params:
+                # Keyed on the uploaded bytes, as when uploads were hashed from disk
+                key_params["file_path"] = key_params.pop("upload").digest
+            key = result_key([run.__name__, *identity], key_params)
+            computed = False
+
+            async def compute():
+                nonlocal computed
+                computed = True
+                return await run(workdir, **params)
+
+            media = await result_cache.get_or_compute(key, compute)
+            if not computed:
+                # A hit (or someone else's generation) says nothing about what generating costs
+                skip_calibration()
+            return media
+        return run_cached
+    return decorate
+
+SPEECH_SAMPLE_RATE = 24000
+
+# Long texts are split into segments synthesized on the speech-segments lane and
+# joined in order. Phonemized sentences and voice packs are cached across requests.
+SPEECH_VOICES = [voice.strip() for voice in os.environ.get("SPEECH_VOICES", "af_heart").split(",") if voice.strip()]
+speech_engine = SpeechEngine(
+    workers=SPEECH_WORKERS,
+    segment_phonemes=int(os.environ.get("SPEECH_SEGMENT_PHONEMES", "300")),
+    phoneme_cache_size=int(os.environ.get("PHONEME_CACHE_SIZE", "4096")),
+    submit=executor.lanes["speech-segments"].submit_threadsafe,
+)
 
-    output_filename = "output.wav"
-    output_path = os.path.join(output_dir, output_filename)
+def check_speech_voice(voice):
+    if voice not in SPEECH_VOICES:
+        raise HTTPException(status_code=400, detail=f"Unknown voice: {voice}, expected one of {', '.join(SPEECH_VOICES)}")
 
-    generator = speech_pipeline(text, voice='af_heart')
-    for i, (gs, ps, audio) in enumerate(generator):
-        print(i, gs, ps)
-        display(Audio(data=audio, rate=24000, autoplay=i==0))
-        sf.write(output_path, audio, 24000)
+def speech_segments(speech_pipeline, text, voice):
+    # Every voice is loaded onto the model's device before the first request needs it
+    speech_engine.preload(speech_pipeline, SPEECH_VOICES)
+    return speech_engine.stream(speech_pipeline, text, voice)
 
-    return FileResponse(output_path, media_type="audio/wav", filename="output.wav")
+async def run_text2speech(workdir, prompt, voice=None, stream=False):
+    # Jobs always produce the whole file, streaming is only for the direct route
+    text = prompt
+    voice = voice or SPEECH_VOICES[0]
+    check_speech_voice(voice)
 
-@app.post("/text2music/")
-async def generate_music(prompt: str = Form(...), duration: Optional[int] = Form(10)):    
-    global music_processor, music_model
-    # music_model.set_generatioan_params(duration=duration)
+    def synthesize():
+        segments = [audio for gs, ps, audio in speech_segments(speech_pipeline, text, voice)]
+        audio = np.concatenate(segments) if segments else np.zeros(0, dtype=np.float32)
+        return encode_wav(audio, SPEECH_SAMPLE_RATE)
 
-    output_dir = os.path.join(os.getcwd(), "generated_music")
-    os.makedirs(output_dir, exist_ok=True)
+    set_progress(stage="generating")
+    async with models.use("speech") as speech_pipeline:
+        return await executor.run("speech", synthesize)
 
-    output_filename = "output.wav"
-    output_path = os.path.join(output_dir, output_filename)
+async def stream_speech(text, voice, ticket):
+    # Send a WAV header straight away, then each segment as soon as it is ready
+    async with ticket, models.use("speech") as speech_pipeline:
+        yield wav_header(SPEECH_SAMPLE_RATE)
+        async for gs, ps, audio in executor.stream("speech", speech_segments, speech_pipeline, text, voice):
+            yield to_pcm16(audio)
 
-    # Use the already-loaded models
-    inputs = music_processor(
-        text=[prompt],
-        padding=True,
-        return_tensors="pt",
-    )
-    
-    # Move inputs to the same device as the model
-    device = next(music_model.parameters()).device
-    inputs = {k: v.to(device) if hasattr(v, 'to') else v for k, v in inputs.items()}
-    
-    # 256 tokens is about 5 seconds of music
-    with torch.no_grad():
-        audio_values = music_model.generate(**inputs, max_new_tokens=int((256*duration)/5))
-    
-    sampling_rate = music_model.config.audio_encoder.sampling_rate
-    scipy.io.wavfile.write(output_path, rate=sampling_rate, data=audio_values[0, 0].cpu().numpy())
+@app.post("/text2speech/")
+async def generate_speech(prompt: str = Form(...), voice: Optional[str] = Form(None), stream: Optional[bool] = Form(False)):
+    if stream:
+        voice = voice or SPEECH_VOICES[0]
+        check_speech_voice(voice)
+        return StreamingResponse(stream_speech(prompt, voice, admit_stream("text2speech", prompt=prompt)), media_type="audio/wav")
+    return await run_request(run_text2speech, prompt=prompt, voice=voice)
+
+@cached(MUSIC_MODEL, MUSIC_MAX_SINGLE_SECONDS, MUSIC_WINDOW_SECONDS, MUSIC_CONTEXT_SECONDS, MUSIC_CROSSFADE_SECONDS)
+async def run_text2music(workdir, prompt, duration, seed=None):
+    # music_model.set_generatioan_params(duration=duration)
+    set_progress(stage="generating")
+    audio, sampling_rate = await generate_track(prompt, duration, seed)
+    return encode_wav(audio, sampling_rate, subtype="FLOAT")
 
-    return FileResponse(output_path, media_type="audio/wav", filename="output.wav")
+@app.post("/text2music/")
+async def generate_music(prompt: str = Form(...), duration: Optional[int] = Form(10), stream: Optional[bool] = Form(False), seed: Optional[int] = Form(None)):    
+    if stream:
+        return StreamingResponse(stream_music(prompt, duration, admit_stream("text2music", duration=duration), seed), media_type="audio/wav")
+    return await run_request(run_text2music, prompt=prompt, duration=duration, seed=seed)
 
-@app.post("/text2video/")
-async def generate_video(prompt: str = Form(...)):
-    # Use a fixed output directory
-    output_dir = os.path.join(os.getcwd(), "generated_videos")
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Fixed output filename
+async def run_text2video(workdir, prompt):
     output_filename = "output.mp4"
-    output_path = os.path.join(output_dir, output_filename)
-    
+    output_path = os.path.join(workdir, output_filename)
+
+    set_progress(stage="generating")
     try:
-    #     # Remove the existing file if it exists
-        if os.path.exists(output_path):
-            os.remove(output_path)
-        
-    #     # Run the video generation command with absolute paths
-    #     # Note: This is using a separate process, so GPU memory persistence
-    #     # would need to be handled in the Wan2.1 script itself
-        result = subprocess.run([
-            "python", "/home/h039y17/FH/Wan2.1/generate.py",
-            "--task", "t2v-1.3B",
-            "--size", "832*480",
-            "--ckpt_dir", "/home/h039y17/FH/Wan2.1-T2V-1.3B",
-            "--sample_shift", "8",
-            "--sample_guide_scale", "6",
-            "--prompt", prompt,
-            "--save_file", output_path,
-            "--offload_model", "False"  # Ensuring the model stays on GPU
-        ], capture_output=True, text=True)
-        
-    #     # Check if the command was successful
-        if result.returncode != 0:
-            raise HTTPException(status_code=500, detail=f"Video generation failed: {result.stderr}")
-        
-    #     # Verify the file was created
-        if not os.path.exists(output_path):
-            raise HTTPException(status_code=404, detail="No video file was generated")
-
-        # Return the video file for download
-        return FileResponse(
-            output_path,
-            media_type="video/mp4",
-            filename=output_filename
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error in video generation: {str(e)}")
-    
+        with stage("subprocess"):
+            response = await video_pool.generate(
+                VIDEO_MODEL,
+                prompt=prompt,
+                size="832*480",
+                sample_shift=8,
+                sample_guide_scale=6,
+            )
+    except WorkerError as e:
+        raise HTTPException(status_code=500, detail=f"Video generation failed: {e}")
+    print(f"Video generated in {response['seconds']}s")
+
+    # The mp4 muxer needs a real file, it is unlinked as soon as it's open
+    @timed("encode")
+    def encode(frames):
+        export_to_video([Image.fromarray(frame) for frame in frames], output_path, fps=response["fps"])
+        return Media.from_path(output_path, "video/mp4", output_filename, unlink=True)
+
+    set_progress(stage="encoding")
+    try:
+        return await executor.run("video", with_frames, response, encode)
+    except asyncio.CancelledError:
+        # Skipped on the lane, nobody else will free the frames
+        release_frames(response)
+        raise
+
+@app.post("/text2video/")
+async def generate_video(prompt: str = Form(...)):
+    return await run_request(run_text2video, prompt=prompt)
+
+def check_animation_format(format):
+    # Checked before generating, a bad format shouldn't cost a full diffusion run
+    if format not in ANIMATION_ENCODERS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}, expected one of {', '.join(ANIMATION_ENCODERS)}")
+    if format == "mp4" and not ffmpeg_available():
+        raise HTTPException(status_code=400, detail="mp4 output needs ffmpeg on the server")
+
+@cached("animation", default_seed=42)
+async def run_text2animation(workdir, prompt, negative_prompt, num_frames, guidance_scale, num_inference_steps, seed, format="gif"):
+    check_animation_format(format)
+    seed_value = seed if seed is not None else 42
+
+    progress = step_progress(num_inference_steps)
+
+    # Generate animation
+    def animate(animation_pipe):
+        generator = torch.Generator(device=animation_pipe.device).manual_seed(seed_value)
+        progress.begin()
+        with torch.no_grad():
+            embeds = prompt_embeddings.animatediff_embeds(animation_pipe, loaders.MODEL_FINGERPRINTS["animation"], prompt, negative_prompt)
+            output = animation_pipe(
+                **embeds,
+                num_frames=num_frames,
+                guidance_scale=guidance_scale,
+                num_inference_steps=num_inference_steps,
+                generator=generator,
+                callback_on_step_end=progress,
+            )
+        progress.end()
+        return output
+
+    set_progress(stage="generating")
+    async with models.use("animation") as animation_pipe:
+        output = await executor.run("animation", animate, animation_pipe)
+    set_progress(stage="encoding")
+    return await asyncio.to_thread(encode_animation, output.frames[0], format)
+
 @app.post("/text2animation/")
 async def generate_animation(
     prompt: str = Form(...),
@@ -284,63 +571,184 @@ async def generate_animation(
     num_frames: int = Form(16),
     guidance_scale: float = Form(7.5),
     num_inference_steps: int = Form(25),
-    seed: Optional[int] = Form(None)
+    seed: Optional[int] = Form(None),
+    format: str = Form("gif")
 ):
-    global animation_pipe
-
-    # Use a fixed output directory
-    output_dir = os.path.join(os.getcwd(), "generated_animations")
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Fixed output filename
-    output_filename = "animation.gif"
-    output_path = os.path.join(output_dir, output_filename)
+    return await run_request(
+        run_text2animation,
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        num_frames=num_frames,
+        guidance_scale=guidance_scale,
+        num_inference_steps=num_inference_steps,
+        seed=seed,
+        format=format,
+    )
 
-    # Use the already-loaded pipeline
-    seed_value = seed if seed is not None else 42
-    generator = torch.Generator(device=animation_pipe.device).manual_seed(seed_value)
-    
-    # Generate animation
-    with torch.no_grad():
-        output = animation_pipe(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            num_frames=num_frames,
-            guidance_scale=guidance_scale,
-            num_inference_steps=num_inference_steps,
+@cached("image")
+async def run_text2img(workdir, prompt, height, width, steps, seed=None):
+    progress = step_progress(steps)
+
+    def render(image_pipe):
+        generator = None
+        if seed is not None and seed >= 0:
+            generator = torch.Generator(device=image_pipe.device).manual_seed(seed)
+        progress.begin()
+        embeds = prompt_embeddings.sd3_embeds(image_pipe, loaders.MODEL_FINGERPRINTS["image"], prompt)
+        output = image_pipe(
+            **embeds,
+            num_inference_steps=steps,
+            guidance_scale=3.5,
+            height=height,
+            width=width,
             generator=generator,
+            callback_on_step_end=progress,
         )
-        
-    frames = output.frames[0]
-    export_to_gif(frames, output_path)  
+        progress.end()
+        return output
 
-    return FileResponse(output_path, media_type="image/gif", filename="animation.gif")
+    set_progress(stage="generating")
+    async with models.use("image") as image_pipe:
+        output = await executor.run("image", render, image_pipe)
+    return await asyncio.to_thread(encode_png, output.images[0])
 
 @app.post("/text2img/")
-async def generate_image(prompt: str = Form(...), height: Optional[int] = Form(512), width: Optional[int] = Form(512), steps: Optional[int] = Form(50)):
-    output_dir = os.path.join(os.getcwd(), "generated_images")
-    os.makedirs(output_dir, exist_ok=True)
-
-    output_filename = "output.png"
-    output_path = os.path.join(output_dir, output_filename)
-
-    image = image_pipe(
-        prompt,
-        num_inference_steps=steps,
-        guidance_scale=3.5,
-        height=height,
-        width=width,
-    ).images[0]
-    image.save(output_path)
-
-    return FileResponse(output_path, media_type="image/png", filename="output.png")
+async def generate_image(prompt: str = Form(...), height: Optional[int] = Form(512), width: Optional[int] = Form(512), steps: Optional[int] = Form(50), seed: Optional[int] = Form(None)):
+    return await run_request(run_text2img, prompt=prompt, height=height, width=width, steps=steps, seed=seed)
+
+# The batch routes generate up to BATCH_MAX_ITEMS outputs per request, several
+# per pipeline call (IMAGE_BATCH_CHUNK / ANIMATION_BATCH_CHUNK, less once a
+# shape has run out of memory), and answer with a zip
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "16"))
+image_chunks = ChunkSizes(int(os.environ.get("IMAGE_BATCH_CHUNK", "4")))
+animation_chunks = ChunkSizes(int(os.environ.get("ANIMATION_BATCH_CHUNK", "2")))
+
+def batch_items(prompts, per_prompt, seed=None, seeds=None):
+    """(prompt, seed) for every output, each prompt repeated ``per_prompt`` times."""
+    prompts = [prompt for prompt in prompts if prompt.strip()]
+    if not prompts:
+        raise HTTPException(status_code=400, detail="At least one prompt is needed")
+    count = len(prompts) * per_prompt
+    if per_prompt < 1 or count > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch makes 1 to {BATCH_MAX_ITEMS} outputs, this one asks for {count}")
+    if seeds:
+        try:
+            seeds = [int(value) for value in seeds.split(",")]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="seeds must be comma separated integers")
+        if len(seeds) != count:
+            raise HTTPException(status_code=400, detail=f"Got {len(seeds)} seeds for {count} outputs")
+    return list(zip([prompt for prompt in prompts for _ in range(per_prompt)], item_seeds(count, seed, seeds)))
+
+def encode_batch(items, outputs, encode, extension):
+    """Zip of the outputs in request order, manifest.json has the prompt and seed of each."""
+    members = [(f"{i:03d}.{extension}", encode(output)) for i, output in enumerate(outputs)]
+    manifest = [{"file": name, "prompt": prompt, "seed": seed} for (name, _), (prompt, seed) in zip(members, items)]
+    try:
+        return encode_zip(members, manifest)
+    finally:
+        for _, member in members:
+            member.close()
+
+async def run_text2img_batch(workdir, prompt, num_images_per_prompt, height, width, steps, seed=None, seeds=None):
+    items = batch_items(prompt, num_images_per_prompt, seed, seeds)
+
+    async def run_chunk(chunk):
+        progress = step_progress(steps)
+
+        def render():
+            # One generator per image, each comes out as it would alone with its seed
+            generators = [torch.Generator(device=image_pipe.device).manual_seed(s) for _, s in chunk]
+            progress.begin()
+            embeds = batch_embeds([prompt_embeddings.sd3_embeds(image_pipe, loaders.MODEL_FINGERPRINTS["image"], p) for p, _ in chunk])
+            output = image_pipe(
+                **embeds,
+                num_inference_steps=steps,
+                guidance_scale=3.5,
+                height=height,
+                width=width,
+                generator=generators,
+                callback_on_step_end=progress,
+            )
+            progress.end()
+            return output.images
+
+        return await executor.run("image", render)
+
+    set_progress(stage="generating")
+    async with models.use("image") as image_pipe:
+        images = await run_chunked(items, image_chunks, f"image {width}x{height}", run_chunk)
+    set_progress(stage="encoding")
+    return await asyncio.to_thread(encode_batch, items, images, encode_png, "png")
+
+@app.post("/text2img-batch/")
+async def generate_image_batch(prompt: List[str] = Form(...), num_images_per_prompt: Optional[int] = Form(4), height: Optional[int] = Form(512), width: Optional[int] = Form(512), steps: Optional[int] = Form(50), seed: Optional[int] = Form(None), seeds: Optional[str] = Form(None)):
+    return await run_request(run_text2img_batch, prompt=prompt, num_images_per_prompt=num_images_per_prompt, height=height, width=width, steps=steps, seed=seed, seeds=seeds)
+
+async def run_text2animation_batch(workdir, prompt, num_videos_per_prompt, negative_prompt, num_frames, guidance_scale, num_inference_steps, seed=None, seeds=None, format="gif"):
+    check_animation_format(format)
+    items = batch_items(prompt, num_videos_per_prompt, seed, seeds)
+
+    async def run_chunk(chunk):
+        progress = step_progress(num_inference_steps)
+
+        def animate():
+            generators = [torch.Generator(device=animation_pipe.device).manual_seed(s) for _, s in chunk]
+            progress.begin()
+            with torch.no_grad():
+                embeds = batch_embeds([
+                    prompt_embeddings.animatediff_embeds(animation_pipe, loaders.MODEL_FINGERPRINTS["animation"], p, negative_prompt)
+                    for p, _ in chunk
+                ])
+                output = animation_pipe(
+                    **embeds,
+                    num_frames=num_frames,
+                    guidance_scale=guidance_scale,
+                    num_inference_steps=num_inference_steps,
+                    generator=generators,
+                    callback_on_step_end=progress,
+                )
+            progress.end()
+            return output.frames
+
+        return await executor.run("animation", animate)
+
+    set_progress(stage="generating")
+    async with models.use("animation") as animation_pipe:
+        videos = await run_chunked(items, animation_chunks, f"animation {num_frames} frames", run_chunk)
+    set_progress(stage="encoding")
+    return await asyncio.to_thread(encode_batch, items, videos, partial(encode_animation, format=format), format)
+
+@app.post("/text2animation-batch/")
+async def generate_animation_batch(
+    prompt: List[str] = Form(...),
+    num_videos_per_prompt: int = Form(2),
+    negative_prompt: str = Form("bad quality, worse quality"),
+    num_frames: int = Form(16),
+    guidance_scale: float = Form(7.5),
+    num_inference_steps: int = Form(25),
+    seed: Optional[int] = Form(None),
+    seeds: Optional[str] = Form(None),
+    format: str = Form("gif")
+):
+    return await run_request(
+        run_text2animation_batch,
+        prompt=prompt,
+        num_videos_per_prompt=num_videos_per_prompt,
+        negative_prompt=negative_prompt,
+        num_frames=num_frames,
+        guidance_scale=guidance_scale,
+        num_inference_steps=num_inference_steps,
+        seed=seed,
+        seeds=seeds,
+        format=format,
+    )
 
-@app.post("/img2img/")
-async def img2img(file: UploadFile = File(...), prompt: str = Form(...), negative_prompt: Optional[str] = Form(default="unrealistic, blurry"), height: Optional[int] = Form(512), width: Optional[int] = Form(512), steps: Optional[int] = Form(50)):
-    # Save the uploaded image
-    save_dir = UPLOAD_DIR
-    os.makedirs(save_dir, exist_ok=True)
+@app.get("/batches")
+async def batch_status():
+    return {"max_items": BATCH_MAX_ITEMS, "image": image_chunks.stats(), "animation": animation_chunks.stats()}
 
+async def run_img2img(workdir, upload, prompt, negative_prompt, height, width, steps):
     print("Request Parameters:")
     print(f"Prompt: {prompt}")
     print(f"Negative Prompt: {negative_prompt}")
@@ -348,353 +756,561 @@ async def img2img(file: UploadFile = File(...), prompt: str = Form(...), negativ
     print(f"Width: {width}")
     print(f"Steps: {steps}")
 
-
-    filename = "uploaded_image.png"
-    file_path = os.path.join(save_dir, filename)
-
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    caption = caption_image(file_path)
+    set_progress(stage="captioning")
+    caption = await describe_image(upload)
     print("Image Caption:")
     print(caption)
 
-    output_path = "/home/h039y17/FH/stable-diffusion.cpp/build/img2img_output.png"
-
-    # we need this command
-    # ./bin/sd --mode img2img -m /home/h039y17/FH/stable-diffusion.cpp/models/v1-5-pruned-emaonly.safetensors -p "cat with blue eyes" -i /home/h039y17/FH/stable-diffusion.cpp/uploads/uploaded_image.png -o /home/h039y17/FH/stable-diffusion.cpp/build/img2img_output.png --strength 0.4
-
-    # Run the image generation command with absolute paths
+    output_path = os.path.join(workdir, "img2img_output.png")
+    # The worker gets the image at the render size instead of decoding the upload again
+    init_image = await asyncio.to_thread(upload.save_resized, os.path.join(workdir, "init_image.png"), width, height)
 
     print("Running the image generation command...")
 
-    result = subprocess.run([
-        "/home/h039y17/FH/stable-diffusion.cpp/build/bin/sd",
-        "--mode", "img2img",
-        "-m", "/home/h039y17/FH/stable-diffusion.cpp/models/v1-5-pruned-emaonly.safetensors",
-        "-p", prompt+ " " +caption,
-        "--negative-prompt", negative_prompt,
-        "-i", file_path,
-        "-o", output_path,
-        "--strength", "0.4",
-        "--height", str(height),
-        "--width", str(width),
-        "--steps", str(steps)
-    ], capture_output=True, text=True)
-    
-    # Print command output to server terminal
-    print("Command stdout:")
-    print(result.stdout)
-    
-    print("Command stderr:")
-    print(result.stderr)
-    
-    print("Return code:", result.returncode)
-    
-    if result.returncode != 0:
-        print("Command failed with error:", result.stderr)
-    else:
-        print("Image generated successfully at:", output_path)
-    
-    return FileResponse(output_path, media_type="image/png", filename="output.png")
-    
-@app.post("/img2ghibli/")
-async def img2ghibli(file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), strength: Optional[float] = Form(0.53), style_ratio: Optional[int] = Form(80), cfg_scale: Optional[int] = Form(15), control_strength: Optional[float] = Form(1.0), steps: Optional[int] = Form(100), sampling_method: Optional[str] = Form("euler_a"), height: Optional[int] = Form(512), width: Optional[int] = Form(512)):
-    # Save the uploaded image
-    save_dir = UPLOAD_DIR
-    os.makedirs(save_dir, exist_ok=True)
-
-    filename = "uploaded_image.png"
-    file_path = os.path.join(save_dir, filename)
-
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    caption_prompt = "Describe this image in detail for an artistic transformation to Studio Ghibli style. Focus on key visual elements such as facial expressions, character emotions, color palette, lighting, and background details. Emphasize textures, scenery, and atmosphere. Avoid photorealistic or overly technical descriptions."
-
-    positive_prompt = "Studio Ghibli animation style, Hayao Miyazaki artistic interpretation, hand-drawn animation quality, delicate anime features, expressive eyes, soft facial expressions, Ghibli character design, painterly textures, watercolor effect, vibrant and pastel tones, lush landscapes, whimsical backgrounds, magical lighting, fantastical scenery with Ghibli aesthetics, cel-shading."
-
-    negative_prompt = "Photorealism, 3D rendering, hyper-realistic textures, distorted proportions, deformed features, asymmetry, unnatural anatomy, misaligned eyes, facial distortion, noisy output, low quality, pixelation, poor shading, visual artifacts."
-
-    file_path = "/home/h039y17/FH/stable-diffusion.cpp/uploads/uploaded_image.png"
-    output_path = "/home/h039y17/FH/stable-diffusion.cpp/build/ghibli.png"
-
-    caption = caption_image(file_path, caption_prompt)
-    print("Image Caption:")
-    print(caption)
-
-    print("Running the image generation command...")
-
-    result = subprocess.run([
-        "/home/h039y17/FH/stable-diffusion.cpp/build/bin/sd",
-        "--mode", "img2img",
-        "-m", "/home/h039y17/FH/stable-diffusion.cpp/models/sd-v1-4.ckpt",
-        "--lora-model-dir", "/home/h039y17/FH/stable-diffusion.cpp/lora",
-        "-p", positive_prompt + " " +caption+ " " +prompt,
-        "--negative-prompt", negative_prompt,
-        "-i", file_path,
-        "-o", output_path,
-        "--strength", str(strength), # how much to apply the prompt
-        "--style-ratio", str(style_ratio), # how much to apply the style
-        "--cfg-scale", str(cfg_scale), # how much to apply the config
-        "--control-strength", str(control_strength), # how much to apply the control
-        "--steps", str(steps), # how many steps to run
-        "--sampling-method", str(sampling_method), # how to sample
-        "--seed", "-1",
-        "--height", str(height),
-        "--width", str(width)
-    ], capture_output=True, text=True)
-    
-    print("Command stdout:")
-    print(result.stdout)
-
-    print("Command stderr:")
-    print(result.stderr)
-
-    return FileResponse(output_path, media_type="image/png", filename="output.png")
-
-@app.post("/img2animation/")
-async def img2animation(file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), negative_prompt: Optional[str] = Form("bad quality, worse quality"), num_frames: Optional[int] = Form(16), guidance_scale: Optional[float] = Form(7.5), num_inference_steps: Optional[int] = Form(25), seed: Optional[int] = Form(None)):
-    global animation_pipe
-
-    output_dir = os.path.join(os.getcwd(), "generated_animations")
-    os.makedirs(output_dir, exist_ok=True)
-
-    output_filename = "animation.gif"
-    output_path = os.path.join(output_dir, output_filename)
-
-    filename = "uploaded_image.png"
-    file_path = os.path.join(UPLOAD_DIR, filename)
-
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    caption = caption_image(file_path)
-    print(caption)
-
-    output = animation_pipe(
-        prompt=caption+" "+prompt,
+    set_progress(stage="generating")
+    await run_sd(
+        SDModelKey(f"{SD_CPP_DIR}/models/v1-5-pruned-emaonly.safetensors"),
+        prompt=prompt+ " " +caption,
         negative_prompt=negative_prompt,
-        num_frames=num_frames,
-        guidance_scale=guidance_scale,
-        num_inference_steps=num_inference_steps,
-        seed=seed,
-        image = Image.open(file_path)
+        init_image=init_image,
+        output=output_path,
+        strength=0.4,
+        height=height,
+        width=width,
+        steps=steps,
     )
 
-    frames = output.frames[0]
-    export_to_gif(frames, output_path)
+    # The sd.cpp worker writes to disk, serve that file and let it go with the workdir
+    return Media.from_path(output_path, "image/png", "output.png", unlink=True)
 
-    return FileResponse(output_path, media_type="image/gif", filename="animation.gif")
-
-@app.post("/niggafy/")
-async def niggafy(file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), strength: Optional[float] = Form(0.2), style_ratio: Optional[int] = Form(80), cfg_scale: Optional[int] = Form(15), control_strength: Optional[float] = Form(1.0), steps: Optional[int] = Form(100), sampling_method: Optional[str] = Form("euler_a"), height: Optional[int] = Form(512), width: Optional[int] = Form(512)):
-    # Save the uploaded image
-    save_dir = UPLOAD_DIR
-    os.makedirs(save_dir, exist_ok=True)
+@app.post("/img2img/")
+async def img2img(file: UploadFile = File(...), prompt: str = Form(...), negative_prompt: Optional[str] = Form(default="unrealistic, blurry"), height: Optional[int] = Form(512), width: Optional[int] = Form(512), steps: Optional[int] = Form(50)):
+    return await run_request(run_img2img, file=file, prompt=prompt, negative_prompt=negative_prompt, height=height, width=width, steps=steps)
+
+async def run_style(workdir, upload, style, prompt, strength, style_ratio, cfg_scale, control_strength, steps, sampling_method, height, width, seed=-1):
+    preset = style_presets.get(style)
+    if preset is None:
+        raise HTTPException(status_code=404, detail=f"Unknown style: {style}")
+
+    # Anything the request leaves out comes from the preset
+    strength = preset.strength if strength is None else strength
+    style_ratio = preset.style_ratio if style_ratio is None else style_ratio
+    cfg_scale = preset.cfg_scale if cfg_scale is None else cfg_scale
+    control_strength = preset.control_strength if control_strength is None else control_strength
+    steps = preset.steps if steps is None else steps
+    sampling_method = sampling_method or preset.sampling_method
+    samplers = SD_CPP_SAMPLERS if STYLE_ENGINE == "sdcpp" else list(SCHEDULERS)
+    if sampling_method not in samplers:
+        raise HTTPException(status_code=400, detail=f"Unknown sampling_method: {sampling_method}, expected one of {', '.join(samplers)}")
+
+    caption = ""
+    if preset.caption_prompt:
+        set_progress(stage="captioning")
+        caption = await describe_image(upload, preset.caption_prompt)
+        print("Image Caption:")
+        print(caption)
+
+    positive_prompt, negative_prompt = preset.prompts(caption, prompt)
 
-    filename = "uploaded_image.png"
-    file_path = os.path.join(save_dir, filename)
+    print("Running the image generation command...")
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    set_progress(stage="generating")
+    if STYLE_ENGINE == "sdcpp":
+        output_path = os.path.join(workdir, f"{preset.name}.png")
+        init_image = await asyncio.to_thread(upload.save_resized, os.path.join(workdir, "init_image.png"), width, height)
+        await run_sd(
+            SDModelKey(preset.checkpoint, preset.lora_model_dir, preset.vae),
+            prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            init_image=init_image,
+            output=output_path,
+            strength=strength, # how much to apply the prompt
+            style_ratio=style_ratio, # how much to apply the style
+            cfg_scale=cfg_scale, # how much to apply the config
+            control_strength=control_strength, # how much to apply the control
+            steps=steps, # how many steps to run
+            sampling_method=sampling_method, # how to sample
+            seed=seed,
+            height=height,
+            width=width,
+        )
+        return Media.from_path(output_path, "image/png", "output.png", unlink=True)
+
+    # One resident base pipeline per checkpoint, styles on it only swap LoRAs
+    model_name = f"style:{preset.checkpoint}"
+    if model_name not in models.entries:
+        models.register(model_name, partial(loaders.load_style_base, preset.checkpoint), loaders.DEVICE, size_hint_gb=2.5)
+    def render(style_pipe):
+        return style_engine.render(
+            style_pipe,
+            preset,
+            upload.resized(width, height),
+            positive_prompt,
+            negative_prompt,
+            strength,
+            cfg_scale,
+            steps,
+            sampling_method,
+            seed,
+        )
 
-    caption_prompt = "Describe this image in detail for an artistic transformation to Studio Ghibli style. Focus on key visual elements such as facial expressions, character emotions, color palette, lighting, and background details. Emphasize textures, scenery, and atmosphere. Avoid photorealistic or overly technical descriptions."
+    async with models.use(model_name) as style_pipe:
+        image = await executor.run("style", render, style_pipe)
+    return await asyncio.to_thread(encode_png, image)
 
-    positive_prompt = "Studio Ghibli animation style, Hayao Miyazaki artistic interpretation, hand-drawn animation quality, delicate anime features, expressive eyes, soft facial expressions, Ghibli character design, painterly textures, watercolor effect, vibrant and pastel tones, lush landscapes, whimsical backgrounds, magical lighting, fantastical scenery with Ghibli aesthetics, cel-shading."
+@app.get("/styles")
+async def list_styles():
+    return {name: preset._asdict() for name, preset in style_presets.items()}
 
-    negative_prompt = "Photorealism, 3D rendering, hyper-realistic textures, distorted proportions, deformed features, asymmetry, unnatural anatomy, misaligned eyes, facial distortion, noisy output, low quality, pixelation, poor shading, visual artifacts."
+@app.get("/styles/engine")
+async def style_engine_status():
+    # What a style request can ask for on this replica
+    if STYLE_ENGINE == "sdcpp":
+        return {"engine": "sdcpp", "sampling_methods": list(SD_CPP_SAMPLERS), "ignored_parameters": []}
+    return {"engine": "diffusers", "sampling_methods": list(SCHEDULERS), "ignored_parameters": list(SD_CPP_ONLY_PARAMETERS)}
 
-    file_path = "/home/h039y17/FH/stable-diffusion.cpp/uploads/uploaded_image.png"
-    output_path = "/home/h039y17/FH/stable-diffusion.cpp/build/anti-ghibli.png"
+@app.post("/stylize/{style}/")
+async def stylize(style: str, file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), strength: Optional[float] = Form(None), style_ratio: Optional[int] = Form(None), cfg_scale: Optional[float] = Form(None), control_strength: Optional[float] = Form(None), steps: Optional[int] = Form(None), sampling_method: Optional[str] = Form(None), height: Optional[int] = Form(512), width: Optional[int] = Form(512)):
+    return await run_request(run_style, style=style, file=file, prompt=prompt, strength=strength, style_ratio=style_ratio, cfg_scale=cfg_scale, control_strength=control_strength, steps=steps, sampling_method=sampling_method, height=height, width=width)
 
-    caption = caption_image(file_path, caption_prompt)
-    print("Image Caption:")
+@app.post("/img2ghibli/")
+async def img2ghibli(file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), strength: Optional[float] = Form(None), style_ratio: Optional[int] = Form(None), cfg_scale: Optional[float] = Form(None), control_strength: Optional[float] = Form(None), steps: Optional[int] = Form(None), sampling_method: Optional[str] = Form(None), height: Optional[int] = Form(512), width: Optional[int] = Form(512)):
+    return await run_request(run_style, style="ghibli", file=file, prompt=prompt, strength=strength, style_ratio=style_ratio, cfg_scale=cfg_scale, control_strength=control_strength, steps=steps, sampling_method=sampling_method, height=height, width=width)
+
+# The animation is prompted with the upload's caption, so the captioner and its settings are part of the key
+@cached("img2animate", loaders.MODEL_FINGERPRINTS["phi"], DEFAULT_CAPTION_PROMPT, CAPTION_TOKEN_BUDGETS.get("img2animation", CAPTION_MAX_TOKENS), CAPTION_IMAGE_SIZE, default_seed=42)
+async def run_img2animation(workdir, upload, prompt, negative_prompt, num_frames, guidance_scale, num_inference_steps, seed, format="gif"):
+    check_animation_format(format)
+    set_progress(stage="captioning")
+    caption = await describe_image(upload)
     print(caption)
 
-    print("Running the image generation command...")
+    progress = step_progress(num_inference_steps)
+
+    # The SparseCtrl RGB pipeline conditions the first frame on the uploaded image
+    def animate(img2animate_pipe):
+        generator = torch.Generator(device=img2animate_pipe.device).manual_seed(seed if seed is not None else 42)
+        progress.begin()
+        with torch.no_grad():
+            embeds = prompt_embeddings.animatediff_embeds(img2animate_pipe, loaders.MODEL_FINGERPRINTS["img2animate"], caption+" "+prompt, negative_prompt)
+            output = img2animate_pipe(
+                **embeds,
+                num_frames=num_frames,
+                guidance_scale=guidance_scale,
+                num_inference_steps=num_inference_steps,
+                conditioning_frames=upload.resized(ANIMATION_SIZE, ANIMATION_SIZE),
+                controlnet_frame_indices=[0],
+                generator=generator,
+                callback_on_step_end=progress,
+            )
+        progress.end()
+        return output
+
+    set_progress(stage="generating")
+    async with models.use("img2animate") as img2animate_pipe:
+        output = await executor.run("img2animate", animate, img2animate_pipe)
+
+    set_progress(stage="encoding")
+    return await asyncio.to_thread(encode_animation, output.frames[0], format)
 
-    result = subprocess.run([
-        "/home/h039y17/FH/stable-diffusion.cpp/build/bin/sd",
-        "--mode", "img2img",
-        # "-m", "/home/h039y17/FH/stable-diffusion.cpp/models/sd-v1-4.ckpt",
-        "-m", "/home/h039y17/FH/stable-diffusion.cpp/lora/ghibli-diffusion-v1.ckpt",
-        "--negative-prompt", positive_prompt + " " +caption+ " " +prompt,
-        "-p", negative_prompt,
-        "-i", file_path,
-        "-o", output_path,
-        "--strength", str(strength), # how much to apply the prompt
-        "--style-ratio", str(style_ratio), # how much to apply the style
-        "--cfg-scale", str(cfg_scale), # how much to apply the config
-        "--control-strength", str(control_strength), # how much to apply the control
-        "--steps", str(steps), # how many steps to run
-        "--sampling-method", str(sampling_method), # how to sample
-        "--seed", "-1",
-        "--height", str(height),
-        "--width", str(width)
-    ], capture_output=True, text=True)
-    
-    print("Command stdout:")
-    print(result.stdout)
-
-    print("Command stderr:")
-    print(result.stderr)
+@app.post("/img2animation/")
+async def img2animation(file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), negative_prompt: Optional[str] = Form("bad quality, worse quality"), num_frames: Optional[int] = Form(16), guidance_scale: Optional[float] = Form(7.5), num_inference_steps: Optional[int] = Form(25), seed: Optional[int] = Form(None), format: Optional[str] = Form("gif")):
+    return await run_request(run_img2animation, file=file, prompt=prompt, negative_prompt=negative_prompt, num_frames=num_frames, guidance_scale=guidance_scale, num_inference_steps=num_inference_steps, seed=seed, format=format)
 
-    return FileResponse(output_path, media_type="image/png", filename="output.png")
+@app.post("/niggafy/")
+async def niggafy(file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), strength: Optional[float] = Form(None), style_ratio: Optional[int] = Form(None), cfg_scale: Optional[float] = Form(None), control_strength: Optional[float] = Form(None), steps: Optional[int] = Form(None), sampling_method: Optional[str] = Form(None), height: Optional[int] = Form(512), width: Optional[int] = Form(512)):
+    return await run_request(run_style, style="niggafy", file=file, prompt=prompt, strength=strength, style_ratio=style_ratio, cfg_scale=cfg_scale, control_strength=control_strength, steps=steps, sampling_method=sampling_method, height=height, width=width)
 
 @app.post("/img2pixar/")
-async def img2pixar(file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), strength: Optional[float] = Form(0.53), style_ratio: Optional[int] = Form(80), cfg_scale: Optional[int] = Form(15), control_strength: Optional[float] = Form(1.0), steps: Optional[int] = Form(100), sampling_method: Optional[str] = Form("euler_a"), height: Optional[int] = Form(512), width: Optional[int] = Form(512)):
-    # Save the uploaded image
-    save_dir = UPLOAD_DIR
-    os.makedirs(save_dir, exist_ok=True)
-
-    filename = "uploaded_image.png"
-    file_path = os.path.join(save_dir, filename)
-
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    positive_prompt = "PIXAR style, Disney style, vibrant colors, whimsical, 3D-rendered, cartoonish, soft lighting, exaggerated features, cinematic, expressive, character design, highly detailed, polished, photorealistic textures, family-friendly, storytelling vibe"
-
-    negative_prompt = "Dark, gritty, hyper-realistic, black and white, monochrome, low-resolution, horror, grotesque, distorted, dull, aged, pixelated, poorly rendered, blurry, flat lighting"
-
-    file_path = "/home/h039y17/FH/stable-diffusion.cpp/uploads/uploaded_image.png"
-    output_path = "/home/h039y17/FH/stable-diffusion.cpp/build/pixar.png"
-
-    # caption = caption_image(file_path, caption_prompt)
-    # print("Image Caption:")
-    # print(caption)
-
-    print("Running the image generation command...")
-
-    result = subprocess.run([
-        "/home/h039y17/FH/stable-diffusion.cpp/build/bin/sd",
-        "--mode", "img2img",
-        "-m", "/home/h039y17/FH/stable-diffusion.cpp/models/sd-v1-4.ckpt",
-        "--vae", "/home/h039y17/FH/stable-diffusion.cpp/disney_lora/Cartoon%20illustration_flux_lora_v1.safetensors",
-        "-p", positive_prompt + " " +prompt,
-        "--negative-prompt", negative_prompt,
-        "-i", file_path,
-        "-o", output_path,
-        "--strength", str(strength), # how much to apply the prompt
-        "--style-ratio", str(style_ratio), # how much to apply the style
-        "--cfg-scale", str(cfg_scale), # how much to apply the config
-        "--control-strength", str(control_strength), # how much to apply the control
-        "--steps", str(steps), # how many steps to run
-        "--sampling-method", str(sampling_method), # how to sample
-        "--seed", "-1",
-        "--height", str(height),
-        "--width", str(width)
-    ], capture_output=True, text=True)
-    
-    print("Command stdout:")
-    print(result.stdout)
-
-    print("Command stderr:")
-    print(result.stderr)
-
-    return FileResponse(output_path, media_type="image/png", filename="output.png")
+async def img2pixar(file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), strength: Optional[float] = Form(None), style_ratio: Optional[int] = Form(None), cfg_scale: Optional[float] = Form(None), control_strength: Optional[float] = Form(None), steps: Optional[int] = Form(None), sampling_method: Optional[str] = Form(None), height: Optional[int] = Form(512), width: Optional[int] = Form(512)):
+    return await run_request(run_style, style="pixar", file=file, prompt=prompt, strength=strength, style_ratio=style_ratio, cfg_scale=cfg_scale, control_strength=control_strength, steps=steps, sampling_method=sampling_method, height=height, width=width)
 
 @app.post("/anti-ghibli/")
-async def antighibli(file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), strength: Optional[float] = Form(0.53), style_ratio: Optional[int] = Form(80), cfg_scale: Optional[int] = Form(15), control_strength: Optional[float] = Form(1.0), steps: Optional[int] = Form(100), sampling_method: Optional[str] = Form("euler_a"), height: Optional[int] = Form(512), width: Optional[int] = Form(512)):
-    # Save the uploaded image
-    save_dir = UPLOAD_DIR
-    os.makedirs(save_dir, exist_ok=True)
-
-    filename = "uploaded_image.png"
-    file_path = os.path.join(save_dir, filename)
-
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+async def antighibli(file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), strength: Optional[float] = Form(None), style_ratio: Optional[int] = Form(None), cfg_scale: Optional[float] = Form(None), control_strength: Optional[float] = Form(None), steps: Optional[int] = Form(None), sampling_method: Optional[str] = Form(None), height: Optional[int] = Form(512), width: Optional[int] = Form(512)):
+    return await run_request(run_style, style="anti-ghibli", file=file, prompt=prompt, strength=strength, style_ratio=style_ratio, cfg_scale=cfg_scale, control_strength=control_strength, steps=steps, sampling_method=sampling_method, height=height, width=width)
 
-    caption_prompt = "Describe this image in detail for an artistic transformation to Studio Ghibli style. Focus on key visual elements such as facial expressions, character emotions, color palette, lighting, and background details. Emphasize textures, scenery, and atmosphere. Avoid photorealistic or overly technical descriptions."
+IMG2SOUND_CAPTION = "Describe this image as an audio clip. Focus on key visual elements such as facial expressions, character emotions, color palette, lighting, and background details. Emphasize textures, scenery, and atmosphere. Avoid photorealistic or overly technical descriptions. Use artistic language to describe the image in a way that would translate well to sound. Consider the mood, tone, and style of the image."
 
-    positive_prompt = "Studio Ghibli animation style, Hayao Miyazaki artistic interpretation, hand-drawn animation quality, delicate anime features, expressive eyes, soft facial expressions, Ghibli character design, painterly textures, watercolor effect, vibrant and pastel tones, lush landscapes, whimsical backgrounds, magical lighting, fantastical scenery with Ghibli aesthetics, cel-shading."
-
-    negative_prompt = "Photorealism, 3D rendering, hyper-realistic textures, distorted proportions, deformed features, asymmetry, unnatural anatomy, misaligned eyes, facial distortion, noisy output, low quality, pixelation, poor shading, visual artifacts."
-
-    file_path = "/home/h039y17/FH/stable-diffusion.cpp/uploads/uploaded_image.png"
-    output_path = "/home/h039y17/FH/stable-diffusion.cpp/build/antighibli.png"
-
-    caption = caption_image(file_path, caption_prompt)
-    print("Image Caption:")
+async def run_img2sound(workdir, upload, prompt, duration, stream=False):
+    set_progress(stage="captioning")
+    caption = await describe_image(upload, IMG2SOUND_CAPTION)
     print(caption)
 
-    print("Running the image generation command...")
-
-    result = subprocess.run([
-        "/home/h039y17/FH/stable-diffusion.cpp/build/bin/sd",
-        "--mode", "img2img",
-        "-m", "/home/h039y17/FH/stable-diffusion.cpp/models/sd-v1-4.ckpt",
-        "--lora-model-dir", "/home/h039y17/FH/stable-diffusion.cpp/lora",
-        "-p", negative_prompt + " " +caption+ " " +prompt,
-        "--negative-prompt", positive_prompt,
-        "-i", file_path,
-        "-o", output_path,
-        "--strength", str(strength), # how much to apply the prompt
-        "--style-ratio", str(style_ratio), # how much to apply the style
-        "--cfg-scale", str(cfg_scale), # how much to apply the config
-        "--control-strength", str(control_strength), # how much to apply the control
-        "--steps", str(steps), # how many steps to run
-        "--sampling-method", str(sampling_method), # how to sample
-        "--seed", "-1",
-        "--height", str(height),
-        "--width", str(width)
-    ], capture_output=True, text=True)
-    
-    print("Command stdout:")
-    print(result.stdout)
-
-    print("Command stderr:")
-    print(result.stderr)
-
-    return FileResponse(output_path, media_type="image/png", filename="output.png")
+    set_progress(stage="generating")
+    audio, sampling_rate = await generate_track(caption, duration)
+    return encode_wav(audio, sampling_rate, subtype="FLOAT")
 
 @app.post("/img2sound/")
-async def img2sound(file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), duration: Optional[int] = Form(10)):
-    global music_processor, music_model
-    # Save the uploaded image
-    save_dir = UPLOAD_DIR
-    os.makedirs(save_dir, exist_ok=True)
-
-    filename = "uploaded_image.png"
-    file_path = os.path.join(save_dir, filename)
-
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+async def img2sound(file: UploadFile = File(...), prompt: Optional[str] = Form(default=""), duration: Optional[int] = Form(10), stream: Optional[bool] = Form(False)):
+    if stream:
+        ticket = admit_stream("img2sound", duration=duration)
+        # Caption up front so a bad upload still gets a proper error status
+        caption = await describe_image(await receive_upload(file, {}), IMG2SOUND_CAPTION)
+        print(caption)
+        return StreamingResponse(stream_music(caption, duration, ticket), media_type="audio/wav")
+    return await run_request(run_img2sound, file=file, prompt=prompt, duration=duration)
 
-    caption_prompt = "Describe this image as an audio clip. Focus on key visual elements such as facial expressions, character emotions, color palette, lighting, and background details. Emphasize textures, scenery, and atmosphere. Avoid photorealistic or overly technical descriptions. Use artistic language to describe the image in a way that would translate well to sound. Consider the mood, tone, and style of the image."
-
-    caption = caption_image(file_path, caption_prompt)
-    print(caption)
-
-    output_dir = os.path.join(os.getcwd(), "generated_sounds")
-    os.makedirs(output_dir, exist_ok=True)
-
-    output_filename = "output.wav"
-    output_path = os.path.join(output_dir, output_filename)
-
-    inputs = music_processor(
-        text=[caption],
-        padding=True,
-        return_tensors="pt",
-    )
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy", "tier": SERVING_TIER}
+
+def _lane_depths():
+    for name, lane in executor.stats().items():
+        yield {"model": name, "state": "pending"}, lane["pending"]
+        yield {"model": name, "state": "running"}, lane["running"]
+
+def _model_memory():
+    for name, entry in models.entries.items():
+        if entry.value is not None:
+            yield {"model": name, "device": entry.state}, entry.footprint
+
+def _device_memory():
+    if torch.cuda.is_available():
+        for index in range(torch.cuda.device_count()):
+            yield {"device": f"cuda:{index}", "kind": "allocated"}, torch.cuda.memory_allocated(index)
+            yield {"device": f"cuda:{index}", "kind": "reserved"}, torch.cuda.memory_reserved(index)
+    try:
+        with open("/proc/self/statm") as f:
+            yield {"device": "cpu", "kind": "resident"}, int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+
+def _worker_states():
+    for pool in (sd_pool, video_pool):
+        busy = sum(1 for worker in pool.workers if worker.busy)
+        yield {"pool": pool.kind, "state": "busy"}, busy
+        yield {"pool": pool.kind, "state": "idle"}, len(pool.workers) - busy
+
+# Read from the live objects on every scrape, nothing to update on the request path
+registry.gauge("cre8_queue_depth", "Inference calls queued or running per model lane", ["model", "state"], _lane_depths)
+registry.gauge("cre8_model_memory_bytes", "Footprint of each loaded model and where it lives", ["model", "device"], _model_memory)
+registry.gauge("cre8_device_memory_bytes", "Accelerator memory in use and process resident memory", ["device", "kind"], _device_memory)
+registry.gauge("cre8_worker_processes", "Model worker processes by pool", ["pool", "state"], _worker_states)
+registry.gauge("cre8_jobs", "Background jobs by status", ["status"],
+               lambda: [({"status": status}, count) for status, count in jobs.counts().items()])
+registry.gauge("cre8_model_load_seconds", "How long each model took to load, last time it did", ["model"],
+               lambda: [({"model": name}, entry.load_seconds) for name, entry in models.entries.items() if entry.load_seconds is not None])
+
+@app.get("/metrics")
+async def metrics():
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
+@app.get("/status")
+async def replica_status():
+    """What this replica serves, what is warm and how busy it is, polled by gateway.py."""
+    lanes = executor.stats()
+    return {
+        "tier": SERVING_TIER,
+        "queue_depth": sum(lane["pending"] + lane["running"] for lane in lanes.values()),
+        "backlog_seconds": {name: round(queue.backlog(), 2) for name, queue in admission.queues.items()},
+        "endpoints": {name: {"warm": endpoint_warm(name), "ready": endpoint_ready(name)} for name in sorted(SERVED_ENDPOINTS)},
+        "models": {name: entry.state for name, entry in models.entries.items()},
+        "lanes": lanes,
+    }
+
+@app.get("/models")
+async def model_status():
+    return models.status()
+
+@app.get("/workers/sdcpp")
+async def sd_worker_status():
+    return sd_pool.stats()
+
+@app.get("/workers/video")
+async def video_worker_status():
+    return video_pool.stats()
+
+@app.get("/cache/captions")
+async def caption_cache_status():
+    return dict(caption_cache.stats(), batches=caption_batcher.batches_run, batched=caption_batcher.items_run)
+
+@app.get("/cache/embeddings")
+async def embedding_cache_status():
+    return prompt_embeddings.stats()
+
+@app.get("/cache/phonemes")
+async def phoneme_cache_status():
+    return speech_engine.stats()
+
+@app.get("/cache/results")
+async def result_cache_status():
+    return result_cache.stats() if result_cache is not None else {"enabled": False}
+
+# Endpoints that can also be submitted as background jobs: name -> (route, implementation)
+JOB_ENDPOINTS = {
+    "text2speech": (generate_speech, run_text2speech),
+    "text2music": (generate_music, run_text2music),
+    "text2video": (generate_video, run_text2video),
+    "text2animation": (generate_animation, run_text2animation),
+    "text2img": (generate_image, run_text2img),
+    "text2img-batch": (generate_image_batch, run_text2img_batch),
+    "text2animation-batch": (generate_animation_batch, run_text2animation_batch),
+    "img2img": (img2img, run_img2img),
+    "img2ghibli": (img2ghibli, partial(run_style, style="ghibli")),
+    "img2animation": (img2animation, run_img2animation),
+    "niggafy": (niggafy, partial(run_style, style="niggafy")),
+    "img2pixar": (img2pixar, partial(run_style, style="pixar")),
+    "anti-ghibli": (antighibli, partial(run_style, style="anti-ghibli")),
+    "img2sound": (img2sound, run_img2sound),
+}
 
-    device = next(music_model.parameters()).device
-    inputs = {k: v.to(device) if hasattr(v, 'to') else v for k, v in inputs.items()}
+# The CPU tier, or SERVED_ENDPOINTS (e.g. "text2img,text2animation" for one
+# replica behind gateway.py), limits what this process serves. The other
+# routes are dropped, a 404 is clearer than failing on load.
+GENERATION_ROUTES = {name: route for name, (route, _) in JOB_ENDPOINTS.items()}
+GENERATION_ROUTES["stylize"] = stylize
+SERVED_ENDPOINTS = set(GENERATION_ROUTES)
+if SERVING_TIER == "cpu":
+    SERVED_ENDPOINTS &= CPU_ENDPOINTS
+if os.environ.get("SERVED_ENDPOINTS"):
+    SERVED_ENDPOINTS &= {name.strip() for name in os.environ["SERVED_ENDPOINTS"].split(",")}
+dropped_routes = {route for name, route in GENERATION_ROUTES.items() if name not in SERVED_ENDPOINTS}
+app.router.routes = [route for route in app.router.routes if getattr(route, "endpoint", None) not in dropped_routes]
+JOB_ENDPOINTS = {name: value for name, value in JOB_ENDPOINTS.items() if name in SERVED_ENDPOINTS}
+
+# In-process models each endpoint needs, for telling the gateway what is warm
+ENDPOINT_MODELS = {
+    "text2speech": ["speech"],
+    "text2music": ["music"],
+    "text2animation": ["animation"],
+    "text2img": ["image"],
+    "text2img-batch": ["image"],
+    "text2animation-batch": ["animation"],
+    "img2img": ["phi"],
+    "img2animation": ["phi", "img2animate"],
+    "img2sound": ["phi", "music"],
+}
+# Endpoints that render in worker processes
+ENDPOINT_POOLS = {"text2video": video_pool, "img2img": sd_pool}
+STYLE_ENDPOINTS = {"img2ghibli", "niggafy", "img2pixar", "anti-ghibli", "stylize"}
+
+# Models loaded at startup, all the served endpoints need by default. Their
+# routes answer 503 until they are in, other models load on first use.
+if os.environ.get("PRELOAD_MODELS", "served") == "served":
+    PRELOAD_MODELS = [model for model in models.entries if any(model in ENDPOINT_MODELS.get(name, []) for name in SERVED_ENDPOINTS)]
+else:
+    PRELOAD_MODELS = [model.strip() for model in os.environ["PRELOAD_MODELS"].split(",") if model.strip() in models.entries]
+STARTUP_MODELS = models.fitting(PRELOAD_MODELS)
+READY_RETRY_AFTER = 10
+
+def model_loaded(name):
+    # Once loaded a model stays ready, if it is demoted or unloaded later it loads again on use
+    return name not in STARTUP_MODELS or models.entries[name].load_seconds is not None
+
+def model_ready(name):
+    # A model whose startup load failed is retried by the next request that needs it, rather than refused until restart
+    return model_loaded(name) or models.entries[name].error is not None
+
+def endpoint_ready(name):
+    return all(model_ready(model) for model in ENDPOINT_MODELS.get(name, []) if model in models.entries)
+
+def check_ready(endpoint):
+    waiting = [model for model in ENDPOINT_MODELS.get(endpoint, []) if model in models.entries and not model_ready(model)]
+    if waiting:
+        detail = f"{endpoint} is not ready, loading {', '.join(waiting)}"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(READY_RETRY_AFTER)})
+
+def readiness(name):
+    entry = models.entries[name]
+    # A failed load leaves the model unloaded, until a request retries it
+    state = "failed" if entry.error is not None and entry.state == "unloaded" else entry.state
+    return {"ready": model_loaded(name), "state": state, "load_seconds": entry.load_seconds, "error": entry.error}
+
+@app.get("/ready")
+async def ready():
+    """200 once every model loaded at startup is in, 503 until then, for rolling deploys."""
+    startup = {name: readiness(name) for name in STARTUP_MODELS}
+    body = {
+        "ready": all(model["ready"] for model in startup.values()),
+        "models": startup,
+        "failed": [name for name, model in startup.items() if model["state"] == "failed"],
+        "endpoints": {name: endpoint_ready(name) for name in sorted(SERVED_ENDPOINTS)},
+    }
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+@app.get("/ready/{model}")
+async def model_readiness(model: str):
+    if model not in models.entries:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {model}")
+    body = dict(readiness(model), model=model)
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+def endpoint_warm(name):
+    """Whether a request to ``name`` would start without loading a model."""
+    needed = [models.entries[model] for model in ENDPOINT_MODELS.get(name, []) if model in models.entries]
+    if not all(entry.on_device for entry in needed):
+        return False
+    pool = ENDPOINT_POOLS.get(name)
+    if name in STYLE_ENDPOINTS:
+        if STYLE_ENGINE == "sdcpp":
+            pool = sd_pool
+        elif not any(model.startswith("style:") and entry.on_device for model, entry in models.entries.items()):
+            return False
+    return pool is None or any(worker.alive for worker in pool.workers)
+
+# Cost-aware admission (admission.py). Each endpoint's cost is its work units
+# times a rate in seconds per unit, calibrated from measured service times.
+# Requests queue per resource (the model lane or worker pool doing the work)
+# in fair share between users, and are turned away with a 429 when the
+# estimated wait is longer than ADMISSION_MAX_WAIT_SECONDS.
+def _megapixels(params):
+    return (params.get("height") or 512) * (params.get("width") or 512) / 2 ** 20
+
+def _style_units(params, style=None):
+    preset = style_presets.get(style or params.get("style"))
+    steps = params.get("steps") if params.get("steps") is not None else getattr(preset, "steps", 25)
+    strength = params.get("strength") if params.get("strength") is not None else getattr(preset, "strength", 0.8)
+    return steps * strength * _megapixels(params)
+
+def _batch_size(params, per_prompt, default):
+    # Oversized batches are turned away with a 400 once they start, don't let them cost a 429 first
+    return min(len(params.get("prompt") or [""]) * (params.get(per_prompt) or default), BATCH_MAX_ITEMS)
+
+STYLE_RESOURCE = "sdcpp" if STYLE_ENGINE == "sdcpp" else "style"
+
+# name -> (resource, work units, prior seconds per unit on a single large GPU)
+ENDPOINT_COSTS = {
+    "text2speech": ("speech", lambda p: len(p.get("prompt") or ""), 0.002),  # characters
+    "text2music": ("music", lambda p: p.get("duration") or 10, 1.0),  # seconds of audio
+    "img2sound": ("music", lambda p: p.get("duration") or 10, 1.2),
+    "text2video": ("video", lambda p: 1, 240.0),
+    "text2animation": ("animation", lambda p: (p.get("num_inference_steps") or 25) * (p.get("num_frames") or 16), 0.05),  # frame steps
+    "img2animation": ("img2animate", lambda p: (p.get("num_inference_steps") or 25) * (p.get("num_frames") or 16), 0.06),
+    "text2img": ("image", lambda p: (p.get("steps") or 50) * _megapixels(p), 0.5),  # megapixel steps
+    # Outputs batched into one pipeline call share its passes through the model, each costs less than alone
+    "text2animation-batch": ("animation", lambda p: _batch_size(p, "num_videos_per_prompt", 2) * (p.get("num_inference_steps") or 25) * (p.get("num_frames") or 16), 0.04),
+    "text2img-batch": ("image", lambda p: _batch_size(p, "num_images_per_prompt", 4) * (p.get("steps") or 50) * _megapixels(p), 0.35),
+    "img2img": ("sdcpp", lambda p: (p.get("steps") or 50) * 0.4 * _megapixels(p), 0.8),  # denoised megapixel steps
+    "stylize": (STYLE_RESOURCE, _style_units, 0.8),
+    **{name: (STYLE_RESOURCE, partial(_style_units, style=style), 0.8)
+       for name, style in [("img2ghibli", "ghibli"), ("niggafy", "niggafy"), ("img2pixar", "pixar"), ("anti-ghibli", "anti-ghibli")]},
+}
 
-    # 256 tokens is about 5 seconds of music
-    with torch.no_grad():
-        audio_values = music_model.generate(**inputs, max_new_tokens=int((256*duration)/5))
-    
-    sampling_rate = music_model.config.audio_encoder.sampling_rate
-    scipy.io.wavfile.write(output_path, rate=sampling_rate, data=audio_values[0, 0].cpu().numpy())
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", "120"))
+ADMISSION_JOB_MAX_WAIT = float(os.environ.get("ADMISSION_JOB_MAX_WAIT_SECONDS", "1800"))
+admission = AdmissionController(
+    CostModel(ENDPOINT_COSTS),
+    # As many at once as can actually run, music batches concurrent requests
+    {**{name: lane.workers for name, lane in executor.lanes.items()}, "sdcpp": sd_pool.max_workers, "music": MUSIC_BATCH_SIZE},
+    enabled=os.environ.get("ADMISSION_CONTROL", "1") != "0",
+)
 
-    return FileResponse(output_path, media_type="audio/wav", filename="output.wav")
+ADMISSION_REJECTED = registry.counter(
+    "cre8_admission_rejected_total", "Requests turned away because the estimated wait was too long", ["endpoint"])
+registry.gauge("cre8_admission_backlog_seconds", "Estimated seconds of admitted work per slot", ["resource"],
+               lambda: [({"resource": name}, queue.backlog()) for name, queue in admission.queues.items()])
+registry.gauge("cre8_admission_waiting", "Admitted requests waiting for a slot", ["resource"],
+               lambda: [({"resource": name}, queue.stats()["waiting"]) for name, queue in admission.queues.items()])
 
-@app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
+def admit(endpoint, params, max_wait=ADMISSION_MAX_WAIT):
+    check_ready(endpoint)
+    try:
+        return admission.admit(endpoint, params, max_wait)
+    except Overloaded as e:
+        ADMISSION_REJECTED.inc(endpoint=endpoint)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def admit_stream(endpoint, **params):
+    ticket = admit(endpoint, params)
+    # A stream runs at the pace the client reads it, that's not the cost of generating
+    ticket.calibrate = False
+    return ticket
+
+@app.get("/admission")
+async def admission_status():
+    return admission.stats()
+
+def parse_job_params(route, form):
+    # Jobs take the same form fields, defaults and types as the synchronous route
+    params = {}
+    for name, param in inspect.signature(route).parameters.items():
+        field = param.default
+        # Repeated fields (the batch routes' prompts) come as a list
+        value = form.getlist(name) if get_origin(param.annotation) is list else form.get(name)
+        if value is None or value == "" or value == []:
+            if field.is_required():
+                raise HTTPException(status_code=422, detail=f"Missing form field: {name}")
+            params[name] = field.default
+        elif param.annotation is UploadFile:
+            if not hasattr(value, "read"):
+                raise HTTPException(status_code=422, detail=f"Form field {name} must be a file")
+            params[name] = value
+        else:
+            try:
+                params[name] = TypeAdapter(param.annotation).validate_python(value)
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=f"Invalid value for {name}: {e}")
+    return params
+
+@app.post("/jobs/{endpoint}")
+async def submit_job(endpoint: str, request: Request):
+    if endpoint not in JOB_ENDPOINTS:
+        raise HTTPException(status_code=404, detail=f"Unknown endpoint: {endpoint}")
+    route, run = JOB_ENDPOINTS[endpoint]
+
+    form = await request.form()
+    params = parse_job_params(route, form)
+
+    # Stages and timings of the job count towards its endpoint, not /jobs
+    set_endpoint(endpoint)
+    # The upload is only readable during this request, decode it for the job now,
+    # before a bad one could leave an admitted job behind that never starts
+    if "file" in params:
+        params["upload"] = await receive_upload(params.pop("file"), params)
+    # Jobs are polled rather than waited on, so they may queue for longer
+    ticket = admit(endpoint, params, ADMISSION_JOB_MAX_WAIT)
+    job = jobs.create(endpoint)
+    jobs.start(job, produce(run, job.workdir, job.id, ticket, **params))
+    return job.describe()
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.describe()
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, previews: bool = False):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        queue = job.subscribe(previews)
+        try:
+            yield sse("status", job.describe())
+            while job.finished is None:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), 15)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection during long steps
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse(event, data)
+            # Drain what was published before the job finished
+            while not queue.empty():
+                event, data = queue.get_nowait()
+                yield sse(event, data)
+        finally:
+            job.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    # Kept until the job expires, can be fetched (or resumed with Range) any number of times
+    return MediaResponse(job.result)
 
 if __name__ == "__main__":
     import uvicorn
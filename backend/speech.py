@@ -0,0 +1,158 @@
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from audio import as_numpy
+
+# Kokoro's model reads at most 510 phonemes per call
+MAX_PHONEMES = 510
+
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in _SENTENCE_BREAK.split(text) if sentence.strip()]
+
+
+def _wrap(phonemes, limit):
+    """Split a phoneme string at spaces into pieces of at most ``limit``."""
+    pieces, current = [], ""
+    for word in phonemes.split():
+        if current and len(current) + 1 + len(word) > limit:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {word}" if current else word
+    if current:
+        pieces.append(current)
+    return [piece[:limit] for piece in pieces]
+
+
+class SpeechEngine:
+    """Kokoro synthesis of long texts, segments in parallel on a thread pool.
+
+    Text is split into sentences, each phonemized once (sentences are kept in
+    an LRU of ``phoneme_cache_size`` per language) and packed in order into
+    segments of up to ``segment_phonemes``. Segments are synthesized on
+    ``workers`` threads, at most ``lookahead`` ahead of the one being
+    returned, and come back in order. G2P holds the GIL, so it runs on the
+    calling thread while earlier segments synthesize. Voice packs are loaded
+    once and kept on the model's device. Nothing here is tied to one loaded
+    pipeline, the caches outlive the model being unloaded.
+
+    ``submit(fn, *args)`` runs a segment and returns a
+    ``concurrent.futures.Future``, the server passes an inference lane's so
+    segments are queued and counted with the rest of the model work. Without
+    it the engine starts its own pool of ``workers`` threads.
+    """
+
+    def __init__(self, workers=4, segment_phonemes=300, phoneme_cache_size=4096, lookahead=None, submit=None):
+        self.workers = max(1, workers)
+        self.segment_phonemes = min(segment_phonemes, MAX_PHONEMES)
+        self.phoneme_cache_size = phoneme_cache_size
+        self.lookahead = lookahead or 2 * self.workers
+        self.hits = 0
+        self.misses = 0
+        self.segments_run = 0
+        self._phonemes = OrderedDict()
+        self._voices = {}
+        self._lock = threading.Lock()
+        self._submit = submit or ThreadPoolExecutor(self.workers, thread_name_prefix="speech").submit
+
+    def phonemize(self, pipeline, sentence):
+        """Phoneme strings for one sentence, more than one if it is too long for a single call."""
+        key = (pipeline.lang_code, sentence)
+        with self._lock:
+            pieces = self._phonemes.get(key)
+            if pieces is not None:
+                self._phonemes.move_to_end(key)
+                self.hits += 1
+                return pieces
+        phonemes, tokens = pipeline.g2p(sentence)
+        if tokens is not None:
+            # English G2P gives tokens, chunk them at punctuation the way KPipeline does
+            pieces = [ps for _, ps, _ in pipeline.en_tokenize(tokens) if ps]
+        else:
+            pieces = _wrap(phonemes, MAX_PHONEMES)
+        with self._lock:
+            self.misses += 1
+            if self.phoneme_cache_size > 0:
+                self._phonemes[key] = pieces
+                while len(self._phonemes) > self.phoneme_cache_size:
+                    self._phonemes.popitem(last=False)
+        return pieces
+
+    def segments(self, pipeline, text):
+        """(graphemes, phonemes) for each segment of ``text``, in order."""
+        graphemes, phonemes, length = [], [], 0
+        for sentence in split_sentences(text):
+            for i, piece in enumerate(self.phonemize(pipeline, sentence)):
+                if phonemes and length + 1 + len(piece) > self.segment_phonemes:
+                    yield " ".join(graphemes), " ".join(phonemes)
+                    graphemes, phonemes, length = [], [], 0
+                if i == 0:
+                    graphemes.append(sentence)
+                length += len(piece) + (1 if phonemes else 0)
+                phonemes.append(piece)
+        if phonemes:
+            yield " ".join(graphemes), " ".join(phonemes)
+
+    def voice_pack(self, pipeline, voice):
+        device = pipeline.model.device
+        key = (voice, str(device))
+        with self._lock:
+            pack = self._voices.get(key)
+        if pack is None:
+            pack = pipeline.load_voice(voice).to(device)
+            with self._lock:
+                self._voices[key] = pack
+        return pack
+
+    def preload(self, pipeline, voices):
+        for voice in voices:
+            self.voice_pack(pipeline, voice)
+
+    def _synthesize(self, pipeline, phonemes, pack, speed):
+        return as_numpy(pipeline.infer(pipeline.model, phonemes, pack, speed).audio)
+
+    def stream(self, pipeline, text, voice, speed=1):
+        """Yield (graphemes, phonemes, audio) per segment, like calling ``KPipeline``."""
+        pack = self.voice_pack(pipeline, voice)
+        pending = deque()
+        start = time.perf_counter()
+        count = 0
+        try:
+            for graphemes, phonemes in self.segments(pipeline, text):
+                pending.append((graphemes, phonemes, self._submit(self._synthesize, pipeline, phonemes, pack, speed)))
+                # Hand back finished segments straight away, block only when too far ahead
+                while pending and (pending[0][2].done() or len(pending) > self.lookahead):
+                    graphemes, phonemes, future = pending.popleft()
+                    count += 1
+                    yield graphemes, phonemes, future.result()
+            while pending:
+                graphemes, phonemes, future = pending.popleft()
+                count += 1
+                yield graphemes, phonemes, future.result()
+        finally:
+            # The consumer stopped early, don't synthesize what nobody will read, and
+            # return only once segments already running are done with the model
+            for _, _, future in pending:
+                future.cancel()
+            wait([future for _, _, future in pending])
+            with self._lock:
+                self.segments_run += count
+            print(f"Synthesized {count} segments of {len(text)} characters in {time.perf_counter() - start:.2f}s")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "segment_phonemes": self.segment_phonemes,
+                "sentences": len(self._phonemes),
+                "max_sentences": self.phoneme_cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "voices": sorted({voice for voice, _ in self._voices}),
+                "segments": self.segments_run,
+            }
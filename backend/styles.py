@@ -0,0 +1,205 @@
+import json
+import os
+import weakref
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+import torch
+from diffusers import (
+    DDIMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    EulerDiscreteScheduler,
+    LCMScheduler,
+)
+
+SD_CPP_DIR = "/home/h039y17/FH/stable-diffusion.cpp"
+
+GHIBLI_CAPTION = "Describe this image in detail for an artistic transformation to Studio Ghibli style. Focus on key visual elements such as facial expressions, character emotions, color palette, lighting, and background details. Emphasize textures, scenery, and atmosphere. Avoid photorealistic or overly technical descriptions."
+
+GHIBLI_STYLE = "Studio Ghibli animation style, Hayao Miyazaki artistic interpretation, hand-drawn animation quality, delicate anime features, expressive eyes, soft facial expressions, Ghibli character design, painterly textures, watercolor effect, vibrant and pastel tones, lush landscapes, whimsical backgrounds, magical lighting, fantastical scenery with Ghibli aesthetics, cel-shading."
+
+GHIBLI_AVOID = "Photorealism, 3D rendering, hyper-realistic textures, distorted proportions, deformed features, asymmetry, unnatural anatomy, misaligned eyes, facial distortion, noisy output, low quality, pixelation, poor shading, visual artifacts."
+
+PIXAR_STYLE = "PIXAR style, Disney style, vibrant colors, whimsical, 3D-rendered, cartoonish, soft lighting, exaggerated features, cinematic, expressive, character design, highly detailed, polished, photorealistic textures, family-friendly, storytelling vibe"
+
+PIXAR_AVOID = "Dark, gritty, hyper-realistic, black and white, monochrome, low-resolution, horror, grotesque, distorted, dull, aged, pixelated, poorly rendered, blurry, flat lighting"
+
+
+class StylePreset(NamedTuple):
+    """Everything that makes one img2img style.
+
+    ``prompt_template`` and ``negative_template`` are formatted with ``style``,
+    ``avoid``, ``caption`` and ``prompt``. ``loras`` is a list of
+    ``[path, weight]`` pairs applied by the in-process engine;
+    ``lora_model_dir`` and ``vae`` are only passed to sd.cpp.
+    """
+    name: str
+    checkpoint: str
+    style: str = ""
+    avoid: str = ""
+    prompt_template: str = "{style} {caption} {prompt}"
+    negative_template: str = "{avoid}"
+    caption_prompt: Optional[str] = None
+    loras: tuple = ()
+    lora_model_dir: Optional[str] = None
+    vae: Optional[str] = None
+    strength: float = 0.53
+    style_ratio: int = 80
+    cfg_scale: float = 15
+    control_strength: float = 1.0
+    steps: int = 100
+    sampling_method: str = "euler_a"
+
+    def prompts(self, caption, prompt):
+        fields = {"style": self.style, "avoid": self.avoid, "caption": caption, "prompt": prompt}
+        # Collapse the gaps left by empty fields (no caption, no user prompt)
+        return " ".join(self.prompt_template.format(**fields).split()), " ".join(self.negative_template.format(**fields).split())
+
+
+# None of these ship LoRAs (``loras`` is empty), switching between them on the
+# in-process engine changes prompts and settings only. Presets with LoRAs come
+# from STYLE_PRESETS_FILE.
+BUILTIN_PRESETS = {
+    "ghibli": StylePreset(
+        name="ghibli",
+        checkpoint=f"{SD_CPP_DIR}/models/sd-v1-4.ckpt",
+        lora_model_dir=f"{SD_CPP_DIR}/lora",
+        style=GHIBLI_STYLE,
+        avoid=GHIBLI_AVOID,
+        caption_prompt=GHIBLI_CAPTION,
+    ),
+    # Runs the Ghibli prompts in reverse on the Ghibli checkpoint
+    "niggafy": StylePreset(
+        name="niggafy",
+        checkpoint=f"{SD_CPP_DIR}/lora/ghibli-diffusion-v1.ckpt",
+        style=GHIBLI_STYLE,
+        avoid=GHIBLI_AVOID,
+        prompt_template="{avoid}",
+        negative_template="{style} {caption} {prompt}",
+        caption_prompt=GHIBLI_CAPTION,
+        strength=0.2,
+    ),
+    "pixar": StylePreset(
+        name="pixar",
+        checkpoint=f"{SD_CPP_DIR}/models/sd-v1-4.ckpt",
+        vae=f"{SD_CPP_DIR}/disney_lora/Cartoon%20illustration_flux_lora_v1.safetensors",
+        style=PIXAR_STYLE,
+        avoid=PIXAR_AVOID,
+        prompt_template="{style} {prompt}",
+    ),
+    "anti-ghibli": StylePreset(
+        name="anti-ghibli",
+        checkpoint=f"{SD_CPP_DIR}/models/sd-v1-4.ckpt",
+        lora_model_dir=f"{SD_CPP_DIR}/lora",
+        style=GHIBLI_STYLE,
+        avoid=GHIBLI_AVOID,
+        prompt_template="{avoid} {caption} {prompt}",
+        negative_template="{style}",
+        caption_prompt=GHIBLI_CAPTION,
+    ),
+}
+
+
+def load_presets(path=None):
+    """Built-in presets, overridden or extended by a JSON file of ``{name: {field: value}}``."""
+    presets = dict(BUILTIN_PRESETS)
+    if not path:
+        return presets
+    with open(path, encoding="utf-8") as f:
+        for name, fields in json.load(f).items():
+            base = presets.get(name)
+            fields = dict(fields, name=name)
+            if "loras" in fields:
+                fields["loras"] = tuple(tuple(lora) for lora in fields["loras"])
+            presets[name] = base._replace(**fields) if base else StylePreset(**fields)
+    return presets
+
+
+# sampling_method names for each engine
+SCHEDULERS = {
+    "euler_a": EulerAncestralDiscreteScheduler,
+    "euler": EulerDiscreteScheduler,
+    "dpm++2m": DPMSolverMultistepScheduler,
+    "ddim": DDIMScheduler,
+    "lcm": LCMScheduler,
+}
+SD_CPP_SAMPLERS = ("euler_a", "euler", "heun", "dpm2", "dpm++2s_a", "dpm++2m", "dpm++2mv2", "ipndm", "ipndm_v", "lcm")
+
+# sd.cpp options the in-process engine has no equivalent for, it ignores them
+SD_CPP_ONLY_PARAMETERS = ("style_ratio", "control_strength")
+
+
+class StyleEngine:
+    """Renders presets on a resident img2img pipeline.
+
+    Switching between presets that share a checkpoint only swaps LoRA
+    adapters. Up to ``max_adapters`` adapters stay loaded per pipeline, and
+    the active set is fused into the weights so it costs nothing per step.
+    """
+
+    def __init__(self, max_adapters=4):
+        self.max_adapters = max_adapters
+        self.swaps = 0
+        self._loaded = weakref.WeakKeyDictionary()  # pipe -> OrderedDict(adapter name -> path)
+        self._fused = weakref.WeakKeyDictionary()   # pipe -> tuple of (adapter name, weight)
+
+    @staticmethod
+    def adapter_name(path):
+        return os.path.splitext(os.path.basename(path))[0].replace(".", "_").replace(" ", "_")
+
+    def apply_loras(self, pipe, loras):
+        loaded = self._loaded.setdefault(pipe, OrderedDict())
+        wanted = tuple((self.adapter_name(path), float(weight)) for path, weight in loras)
+        if self._fused.get(pipe, ()) == wanted:
+            return
+
+        if self._fused.get(pipe):
+            pipe.unfuse_lora()
+        self.swaps += 1
+
+        for (path, _), (name, _) in zip(loras, wanted):
+            if name in loaded:
+                loaded.move_to_end(name)
+                continue
+            pipe.load_lora_weights(path, adapter_name=name)
+            loaded[name] = path
+
+        active = {name for name, _ in wanted}
+        while len(loaded) > max(self.max_adapters, len(active)):
+            victim = next(name for name in loaded if name not in active)
+            pipe.delete_adapters(victim)
+            del loaded[victim]
+
+        if wanted:
+            names = [name for name, _ in wanted]
+            pipe.enable_lora()
+            pipe.set_adapters(names, adapter_weights=[weight for _, weight in wanted])
+            pipe.fuse_lora(adapter_names=names)
+        elif loaded:
+            pipe.disable_lora()
+        self._fused[pipe] = wanted
+
+    def render(self, pipe, preset, init_image, prompt, negative_prompt, strength, cfg_scale, steps, sampling_method, seed):
+        self.apply_loras(pipe, preset.loras)
+
+        scheduler = SCHEDULERS[sampling_method]
+        if not isinstance(pipe.scheduler, scheduler):
+            pipe.scheduler = scheduler.from_config(pipe.scheduler.config)
+
+        # sd.cpp uses -1 for a random seed
+        generator = None
+        if seed is not None and seed >= 0:
+            generator = torch.Generator(device=pipe.device).manual_seed(seed)
+
+        with torch.no_grad():
+            image = pipe(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                image=init_image,
+                strength=strength,
+                guidance_scale=cfg_scale,
+                num_inference_steps=steps,
+                generator=generator,
+            ).images[0]
+        return image
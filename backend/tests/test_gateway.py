@@ -0,0 +1,108 @@
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+import gateway  # noqa: E402
+
+
+def reply(status, body, headers=None):
+    # Streamed like a real upstream, the gateway relays it with aiter_raw
+    content = json.dumps(body).encode()
+    return httpx.Response(status, headers={"content-type": "application/json", **(headers or {})}, stream=httpx.ByteStream(content))
+
+
+class StubReplica:
+    """A replica answering ``/status`` with its warm endpoints, and generations with its name.
+
+    Statuses queued in ``failures`` are answered instead of the next generations.
+    """
+
+    def __init__(self, url, warm):
+        self.url = url
+        self.warm = warm
+        self.failures = []
+        self.served = 0
+
+    def handle(self, request):
+        if request.url.path == "/status":
+            endpoints = {name: {"warm": name in self.warm, "ready": True} for name in ("text2img", "text2animation")}
+            return reply(200, {"endpoints": endpoints, "queue_depth": 0})
+        if self.failures:
+            status, headers = self.failures.pop(0)
+            return reply(status, {"detail": f"HTTP {status}"}, headers)
+        self.served += 1
+        return reply(200, {"replica": self.url})
+
+
+def run_gateway(monkeypatch, scenario):
+    replicas = [StubReplica("http://gpu-a:8000", {"text2img"}), StubReplica("http://gpu-b:8000", {"text2animation"})]
+    by_host = {httpx.URL(replica.url).host: replica for replica in replicas}
+    routing = gateway.Gateway([replica.url for replica in replicas], retries=1)
+    monkeypatch.setattr(gateway, "gateway", routing)
+
+    async def run():
+        routing.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: by_host[request.url.host].handle(request)))
+        await routing.poll_all()
+        transport = httpx.ASGITransport(app=gateway.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            try:
+                await scenario(client, routing, *replicas)
+            finally:
+                await routing.client.aclose()
+
+    asyncio.run(run())
+
+
+def test_requests_go_to_the_replica_with_the_model_warm(monkeypatch):
+    async def scenario(client, routing, a, b):
+        for _ in range(5):
+            assert (await client.post("/text2img/", data={"prompt": "x"})).headers["x-cre8-replica"] == a.url
+            assert (await client.post("/text2animation/", data={"prompt": "x"})).headers["x-cre8-replica"] == b.url
+        assert (a.served, b.served) == (5, 5)
+
+    run_gateway(monkeypatch, scenario)
+
+
+@pytest.mark.parametrize("status", [502, 503, 504])
+def test_a_replica_down_behind_its_proxy_fails_over_and_is_benched(monkeypatch, status):
+    async def scenario(client, routing, a, b):
+        a.failures.append((status, {}))
+        response = await client.post("/text2img/", data={"prompt": "x"})
+        assert response.status_code == 200
+        assert response.headers["x-cre8-replica"] == b.url
+        replica = routing.replicas[0]
+        assert replica.failures == 1 and not replica.available
+        # Benched, so the next request skips it although its model is warm
+        assert (await client.post("/text2img/", data={"prompt": "x"})).headers["x-cre8-replica"] == b.url
+
+    run_gateway(monkeypatch, scenario)
+
+
+def test_a_busy_or_loading_replica_fails_over_without_being_benched(monkeypatch):
+    async def scenario(client, routing, a, b):
+        a.failures += [(429, {"retry-after": "5"}), (503, {"retry-after": "10"})]
+        for _ in range(2):
+            response = await client.post("/text2img/", data={"prompt": "x"})
+            assert response.headers["x-cre8-replica"] == b.url
+        assert routing.replicas[0].available
+        assert (await client.post("/text2img/", data={"prompt": "x"})).headers["x-cre8-replica"] == a.url
+
+    run_gateway(monkeypatch, scenario)
+
+
+def test_other_server_errors_go_back_to_the_client(monkeypatch):
+    async def scenario(client, routing, a, b):
+        a.failures.append((500, {}))
+        response = await client.post("/text2img/", data={"prompt": "x"})
+        assert response.status_code == 500
+        assert response.headers["x-cre8-replica"] == a.url
+        assert b.served == 0 and routing.replicas[0].available
+
+    run_gateway(monkeypatch, scenario)
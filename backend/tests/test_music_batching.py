@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+
+import numpy as np
+import torch
+from transformers import EncodecConfig, MusicgenConfig, MusicgenDecoderConfig, MusicgenForConditionalGeneration, T5Config
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from batching import MicroBatcher  # noqa: E402
+from executor import InferenceExecutor  # noqa: E402
+from music import generate_music_batch, tokens_for_duration  # noqa: E402
+
+
+class TinyProcessor:
+    """Stands in for the T5 tokenizer of MusicGen's processor, one id per character."""
+
+    def __call__(self, text, padding=True, return_tensors="pt"):
+        ids = [[1 + ord(c) % 31 for c in prompt] for prompt in text]
+        width = max(len(row) for row in ids)
+        input_ids = torch.tensor([row + [0] * (width - len(row)) for row in ids])
+        return {"input_ids": input_ids, "attention_mask": (input_ids > 0).long()}
+
+
+def tiny_musicgen():
+    audio = EncodecConfig(hidden_size=8, num_filters=4, num_residual_layers=1, upsampling_ratios=[2, 2],
+                          codebook_size=16, codebook_dim=8, sampling_rate=100, target_bandwidths=[0.4])
+    config = MusicgenConfig(
+        text_encoder=T5Config(vocab_size=32, d_model=16, d_kv=8, d_ff=32, num_layers=1, num_heads=2),
+        audio_encoder=audio,
+        # The pad/start token sits just past the codebook, as in the released checkpoints
+        decoder=MusicgenDecoderConfig(vocab_size=16, hidden_size=16, num_hidden_layers=1, num_attention_heads=2,
+                                      ffn_dim=32, num_codebooks=audio.num_quantizers, pad_token_id=16, bos_token_id=16),
+    )
+    torch.manual_seed(0)
+    return MusicgenForConditionalGeneration(config).eval()
+
+
+def test_concurrent_requests_share_one_generate_per_duration():
+    model = tiny_musicgen()
+    processor = TinyProcessor()
+    calls = []
+    generate = model.generate
+
+    def recording_generate(**inputs):
+        audio_values = generate(**inputs)
+        # Offset every row so a caller handed another caller's row would notice
+        audio_values = audio_values + torch.arange(len(audio_values), dtype=audio_values.dtype)[:, None, None]
+        calls.append((inputs["max_new_tokens"], len(inputs["input_ids"]), audio_values))
+        return audio_values
+
+    model.generate = recording_generate
+    executor = InferenceExecutor({"music": 1})
+
+    async def run_music_batch(max_new_tokens, prompts):
+        return await executor.run("music", generate_music_batch, processor, model, prompts, max_new_tokens)
+
+    async def scenario():
+        executor.start()
+        try:
+            batcher = MicroBatcher(run_music_batch, max_batch_size=4, max_wait=0.2)
+            requests = [("drums", 0.1), ("a slow piano", 0.2), ("bass", 0.1), ("strings", 0.2), ("a choir", 0.1)]
+            results = await asyncio.gather(*[batcher.submit(tokens_for_duration(d), p) for p, d in requests])
+            return requests, results
+        finally:
+            executor.shutdown()
+
+    requests, results = asyncio.run(scenario())
+
+    assert sorted((tokens, size) for tokens, size, _ in calls) == [(tokens_for_duration(0.1), 3), (tokens_for_duration(0.2), 2)]
+    audio_values = {tokens: values for tokens, _, values in calls}
+    rows = {}
+    for (prompt, duration), audio in zip(requests, results):
+        tokens = tokens_for_duration(duration)
+        row = rows[tokens] = rows.get(tokens, -1) + 1
+        np.testing.assert_array_equal(audio, audio_values[tokens][row, 0].numpy())
+    assert len(results[1]) > len(results[0])
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from video_pool import WORKER_SCRIPT, VideoModelKey, VideoWorkerPool, with_frames  # noqa: E402
+
+KEY = VideoModelKey("fake-ckpt")
+
+
+def fake_pool(render_seconds):
+    command = [sys.executable, WORKER_SCRIPT, "--engine", "fake", "--fake-load-seconds", "0",
+               "--fake-render-seconds", str(render_seconds)]
+    return VideoWorkerPool(command, max_workers=1, request_timeout=10, start_timeout=10)
+
+
+def test_frames_come_back_through_shared_memory_and_are_freed():
+    async def scenario():
+        pool = fake_pool(render_seconds=0)
+        try:
+            response = await pool.generate(KEY, size="16*8", frame_num=5)
+            assert response["ok"]
+            assert response["shape"] == [5, 8, 16, 3]
+            frames = with_frames(response, lambda frames: frames.copy())
+            # The fake engine renders a ramp from black to white across the frames
+            assert frames[0].max() == 0 and frames[-1].min() == 255
+            assert np.all(frames[2] == frames[2, 0, 0, 0])
+            with pytest.raises(FileNotFoundError):
+                shared_memory.SharedMemory(name=response["shm"])
+        finally:
+            await pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_a_crashed_worker_is_restarted_and_the_request_retried():
+    async def scenario():
+        pool = fake_pool(render_seconds=1.0)
+        try:
+            await pool.warm(KEY)
+            crashed = pool.workers[0].process.pid
+            request = asyncio.ensure_future(pool.generate(KEY, size="16*8", frame_num=3))
+            await asyncio.sleep(0.5)
+            pool.workers[0].process.kill()
+
+            response = await asyncio.wait_for(request, 15)
+            assert response["ok"]
+            with_frames(response, lambda frames: None)
+            assert pool.restarts == 1
+            assert [worker.process.pid != crashed for worker in pool.workers] == [True]
+        finally:
+            await pool.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,64 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from sd_pool import WORKER_SCRIPT, SDModelKey, SDWorkerPool, WorkerError  # noqa: E402
+
+KEY = SDModelKey("fake.safetensors")
+
+
+def fake_pool(render_seconds):
+    command = [sys.executable, WORKER_SCRIPT, "--engine", "fake", "--fake-load-seconds", "0",
+               "--fake-render-seconds", str(render_seconds)]
+    return SDWorkerPool(command, max_workers=1, request_timeout=10, start_timeout=10)
+
+
+def test_cancelled_request_does_not_wedge_the_pool():
+    async def scenario():
+        pool = fake_pool(render_seconds=1.0)
+        output = os.path.join(tempfile.mkdtemp(), "out.png")
+        try:
+            first = asyncio.ensure_future(pool.img2img(KEY, output=output, width=8, height=8))
+            await asyncio.sleep(0.5)
+            first.cancel()
+            try:
+                await first
+            except asyncio.CancelledError:
+                pass
+
+            # With one worker, this hung for good when the cancelled request kept it busy
+            response = await asyncio.wait_for(pool.img2img(KEY, output=output, width=8, height=8), 15)
+            assert response["ok"]
+            assert response["id"] == 1
+            assert [worker.busy for worker in pool.workers] == [False]
+        finally:
+            await pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_a_timed_out_request_is_not_run_again():
+    async def scenario():
+        pool = fake_pool(render_seconds=2.0)
+        pool.request_timeout = 0.5
+        output = os.path.join(tempfile.mkdtemp(), "out.png")
+        try:
+            await pool.warm(KEY)
+            start = time.perf_counter()
+            with pytest.raises(WorkerError, match="timed out"):
+                await pool.img2img(KEY, output=output, width=8, height=8)
+            # Retried, it would have taken two timeouts
+            assert time.perf_counter() - start < 1.0
+            assert pool.restarts == 0
+            assert pool.workers == []
+        finally:
+            await pool.shutdown()
+
+    asyncio.run(scenario())
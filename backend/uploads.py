@@ -0,0 +1,146 @@
+import hashlib
+import io
+import json
+import math
+import threading
+
+from fastapi import HTTPException
+from PIL import Image, ImageOps
+
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, max_bytes):
+        super().__init__(status_code=413, detail=f"Upload is larger than {max_bytes // 2 ** 20} MB")
+
+
+class Upload:
+    """An uploaded image, read once and decoded once.
+
+    The image is decoded at the smallest resolution that still covers every
+    size the request will need (``covers``), using the JPEG decoder's
+    reduced-size decoding where it can, so a 12 MP phone photo headed for a
+    512x512 render never exists in memory at full size. Consumers take
+    resized copies of that one decode. ``digest`` is the SHA-256 of the
+    uploaded bytes, for cache keys.
+    """
+
+    def __init__(self, digest, nbytes, original_size, image):
+        self.digest = digest
+        self.nbytes = nbytes
+        self.original_size = original_size
+        self.image = image
+        self._copies = {}
+        self._lock = threading.Lock()
+
+    def resized(self, width, height):
+        """The image stretched to exactly ``width`` x ``height``, like the pipelines resize their inputs."""
+        return self._copy(("resized", width, height), lambda: self.image.resize((width, height), Image.LANCZOS))
+
+    def fitted(self, max_side):
+        """The image scaled down to fit in ``max_side`` on its longer side, keeping its aspect ratio."""
+        width, height = self.image.size
+        scale = max_side / max(width, height)
+        if scale >= 1:
+            return self.image
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return self._copy(("fitted", max_side), lambda: self.image.resize(size, Image.LANCZOS))
+
+    def save_resized(self, path, width, height):
+        """Write the image at ``width`` x ``height`` as a PNG, for renderers that take a file."""
+        self.resized(width, height).save(path, compress_level=1)
+        return path
+
+    def _copy(self, key, make):
+        with self._lock:
+            image = self._copies.get(key)
+        if image is None:
+            image = make()
+            with self._lock:
+                self._copies[key] = image
+        return image
+
+
+def _cover_scale(size, covers):
+    """Smallest scale of ``size`` that still covers every (width, height) in ``covers``, at most 1."""
+    width, height = size
+    scale = 0.0
+    for cover in covers:
+        if isinstance(cover, int):
+            # A longest side, for consumers that keep the aspect ratio
+            scale = max(scale, cover / max(width, height))
+        else:
+            scale = max(scale, cover[0] / width, cover[1] / height)
+    return min(scale, 1.0) if covers else 1.0
+
+
+def decode_image(data, covers):
+    """Decode image bytes as RGB, no larger than it needs to be to cover ``covers``."""
+    with Image.open(io.BytesIO(data)) as source:
+        raw_size = source.size
+        orientation = source.getexif().get(0x0112, 1)
+        # EXIF orientations 5-8 are rotated by 90 degrees
+        upright = raw_size[::-1] if orientation in (5, 6, 7, 8) else raw_size
+        scale = _cover_scale(upright, covers)
+        # JPEG decodes at 1/2, 1/4 or 1/8 scale directly, no-op for other formats
+        source.draft("RGB", (math.ceil(raw_size[0] * scale), math.ceil(raw_size[1] * scale)))
+        image = ImageOps.exif_transpose(source).convert("RGB")
+    target = (max(1, math.ceil(upright[0] * scale)), max(1, math.ceil(upright[1] * scale)))
+    if image.size[0] > target[0] or image.size[1] > target[1]:
+        image = image.resize(target, Image.LANCZOS, reducing_gap=3.0)
+    return upright, image
+
+
+def read_upload(source, covers, chunk_size=1 << 20):
+    """Read a file-like upload in chunks, hashing it on the way, and decode it once."""
+    digest = hashlib.sha256()
+    chunks = []
+    for chunk in iter(lambda: source.read(chunk_size), b""):
+        digest.update(chunk)
+        chunks.append(chunk)
+    data = b"".join(chunks)
+    original_size, image = decode_image(data, covers)
+    return Upload(digest.hexdigest(), len(data), original_size, image)
+
+
+class UploadLimitMiddleware:
+    """Answers 413 to multipart requests over ``max_bytes``.
+
+    Requests that declare a longer ``Content-Length`` are turned away before
+    their body is read, chunked ones as soon as they go over while streaming.
+    """
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers") or [])
+        if scope["type"] != "http" or not headers.get(b"content-type", b"").startswith(b"multipart/"):
+            await self.app(scope, receive, send)
+            return
+        length = headers.get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            # Raised from inside form parsing, which passes HTTP exceptions through as they are
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            if received > self.max_bytes:
+                raise UploadTooLarge(self.max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": UploadTooLarge(self.max_bytes).detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,67 @@
+import os
+import sys
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+import numpy as np
+
+from workers import WorkerPool
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "video_worker.py")
+
+
+class VideoModelKey(NamedTuple):
+    ckpt_dir: str
+    task: str = "t2v-1.3B"
+
+
+class VideoWorkerPool(WorkerPool):
+    """Keeps Wan2.1 worker processes warm with the T2V model loaded."""
+
+    kind = "wan"
+
+    def __init__(self, command=None, **kwargs):
+        super().__init__(command or [sys.executable, WORKER_SCRIPT], **kwargs)
+
+    def _worker_command(self, key):
+        return list(self.command) + ["--ckpt-dir", key.ckpt_dir, "--task", key.task]
+
+    async def generate(self, key, **request):
+        """Render a video, the reply names the shared memory holding its frames."""
+        return await self.request(key, **request)
+
+
+def with_frames(response, fn):
+    """Call ``fn`` with the frames of a worker reply, then free the shared memory.
+
+    ``fn`` gets a ``(frames, height, width, 3)`` uint8 view and must not keep
+    references to it.
+    """
+    block = shared_memory.SharedMemory(name=response["shm"])
+    try:
+        frames = np.ndarray(response["shape"], dtype=response["dtype"], buffer=block.buf)
+        try:
+            return fn(frames)
+        finally:
+            del frames
+    finally:
+        block.unlink()
+        try:
+            block.close()
+        except BufferError:
+            # A view is still referenced (e.g. by a traceback), the mapping goes with it
+            pass
+
+
+def release_frames(response):
+    """Free the shared memory of a reply that will not be read."""
+    try:
+        block = shared_memory.SharedMemory(name=response["shm"])
+    except FileNotFoundError:
+        return
+    try:
+        block.unlink()
+    except FileNotFoundError:
+        # Freed by a reader that got there first
+        pass
+    block.close()
@@ -0,0 +1,142 @@
+"""Long-lived Wan2.1 text-to-video worker.
+
+Loads the T2V model once and then renders requests read as JSON lines from
+stdin. Frames are not written to disk: each result is put in a shared memory
+block as ``uint8`` ``(frames, height, width, 3)`` and the reply carries its
+name, shape and fps. The reader owns the block from then on and must unlink
+it. The first line written is ``{"ready": true, ...}`` once the model is
+loaded. Started and managed by ``video_pool.VideoWorkerPool``.
+
+Engines:
+  wan   the Wan2.1 T2V pipeline from the repository at --wan-dir
+  fake  sleep and return gradient frames, for testing and benchmarking the pool
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+WAN_DIR = "/home/h039y17/FH/Wan2.1"
+
+
+class WanEngine:
+    def __init__(self, args):
+        sys.path.insert(0, args.wan_dir)
+        import torch
+        import wan
+        from wan.configs import SIZE_CONFIGS, WAN_CONFIGS
+
+        self.torch = torch
+        self.sizes = SIZE_CONFIGS
+        self.config = WAN_CONFIGS[args.task]
+        self.fps = self.config.sample_fps
+        self.model = wan.WanT2V(
+            config=self.config,
+            checkpoint_dir=args.ckpt_dir,
+            device_id=args.device_id,
+            rank=0,
+            t5_fsdp=False,
+            dit_fsdp=False,
+            use_usp=False,
+            t5_cpu=False,
+        )
+
+    def render(self, request):
+        video = self.model.generate(
+            request["prompt"],
+            size=self.sizes[request.get("size", "832*480")],
+            frame_num=request.get("frame_num", self.config.frame_num),
+            shift=request.get("sample_shift", 8),
+            sample_solver=request.get("sample_solver", "unipc"),
+            sampling_steps=request.get("sampling_steps", self.config.sample_steps),
+            guide_scale=request.get("sample_guide_scale", 6),
+            seed=request.get("seed", -1),
+            # The model stays resident between requests
+            offload_model=False,
+        )
+        # (channels, frames, height, width) in [-1, 1] -> (frames, height, width, channels) uint8
+        video = ((video.clamp(-1, 1) + 1) * 127.5).round().to(self.torch.uint8)
+        return video.permute(1, 2, 3, 0).contiguous().cpu().numpy()
+
+
+class FakeEngine:
+    fps = 16
+
+    def __init__(self, args):
+        self.render_seconds = args.fake_render_seconds
+        time.sleep(args.fake_load_seconds)
+
+    def render(self, request):
+        width, height = (int(v) for v in request.get("size", "832*480").split("*"))
+        frame_num = request.get("frame_num", 81)
+        time.sleep(self.render_seconds)
+        ramp = np.linspace(0, 255, frame_num, dtype=np.uint8)
+        return np.broadcast_to(ramp[:, None, None, None], (frame_num, height, width, 3)).copy()
+
+
+ENGINES = {"wan": WanEngine, "fake": FakeEngine}
+
+
+def share(frames):
+    """Copy ``frames`` into a new shared memory block and hand it over to the reader."""
+    block = shared_memory.SharedMemory(create=True, size=max(frames.nbytes, 1))
+    np.ndarray(frames.shape, dtype=frames.dtype, buffer=block.buf)[:] = frames
+    # The reader unlinks the block, don't let our resource tracker remove it when we exit
+    resource_tracker.unregister(block._name, "shared_memory")
+    block.close()
+    return block.name
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ckpt-dir", required=True)
+    parser.add_argument("--task", default="t2v-1.3B")
+    parser.add_argument("--wan-dir", default=WAN_DIR)
+    parser.add_argument("--device-id", type=int, default=0)
+    parser.add_argument("--engine", choices=sorted(ENGINES), default=os.environ.get("VIDEO_WORKER_ENGINE", "wan"))
+    parser.add_argument("--fake-load-seconds", type=float, default=2.0)
+    parser.add_argument("--fake-render-seconds", type=float, default=0.5)
+    args = parser.parse_args()
+
+    # stdout carries the protocol, anything the model prints goes to stderr
+    protocol = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+
+    def reply(message):
+        protocol.write(json.dumps(message) + "\n")
+
+    start = time.perf_counter()
+    engine = ENGINES[args.engine](args)
+    reply({"ready": True, "pid": os.getpid(), "load_seconds": round(time.perf_counter() - start, 3)})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if request.get("op") == "ping":
+            reply({"op": "pong"})
+            continue
+        start = time.perf_counter()
+        try:
+            frames = engine.render(request)
+            name = share(frames)
+        except Exception as e:
+            reply({"id": request.get("id"), "ok": False, "error": str(e)})
+        else:
+            reply({
+                "id": request.get("id"),
+                "ok": True,
+                "shm": name,
+                "shape": list(frames.shape),
+                "dtype": str(frames.dtype),
+                "fps": engine.fps,
+                "seconds": round(time.perf_counter() - start, 3),
+            })
+
+
+if __name__ == "__main__":
+    main()
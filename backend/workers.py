@@ -0,0 +1,244 @@
+import asyncio
+import itertools
+import json
+import time
+import traceback
+
+
+class WorkerError(Exception):
+    pass
+
+
+class WorkerProcess:
+    """One worker process speaking JSON lines, with the model for ``key`` loaded.
+
+    ``key`` is a NamedTuple whose first field names the model.
+    """
+
+    def __init__(self, key, command, kind):
+        self.key = key
+        self.command = command
+        self.kind = kind
+        self.process = None
+        self.busy = True
+        self.last_used = time.time()
+        self.served = 0
+        self.load_seconds = None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self, timeout):
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+        ready = await self._read(timeout)
+        if not ready.get("ready"):
+            raise WorkerError(f"Unexpected worker greeting: {ready}")
+        self.load_seconds = ready.get("load_seconds")
+        print(f"{self.kind} worker {self.process.pid} ready for {self.key[0]} in {self.load_seconds}s")
+
+    async def request(self, payload, timeout):
+        self.process.stdin.write((json.dumps(payload) + "\n").encode())
+        await self.process.stdin.drain()
+        return await self._read(timeout)
+
+    async def ping(self, timeout=5):
+        response = await self.request({"op": "ping"}, timeout)
+        return response.get("op") == "pong"
+
+    async def _read(self, timeout):
+        line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
+        if not line:
+            raise WorkerError(f"{self.kind} worker exited with code {await self.process.wait()}")
+        return json.loads(line)
+
+    async def stop(self):
+        if not self.alive:
+            return
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), 5)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+    def describe(self):
+        return {
+            **self.key._asdict(),
+            "pid": self.process.pid if self.process else None,
+            "alive": self.alive,
+            "busy": self.busy,
+            "served": self.served,
+            "load_seconds": self.load_seconds,
+        }
+
+
+class WorkerPool:
+    """Keeps worker processes warm, one model ``key`` each.
+
+    Requests are routed to an idle worker that already has the right model
+    loaded. If there is none, a new worker is started (replacing the least
+    recently used idle worker when the pool is full). Crashed workers are
+    restarted and the request retried once, a request that times out is
+    failed instead. Subclasses build the command line for a key in
+    ``_worker_command``.
+    """
+
+    kind = "worker"
+
+    def __init__(self, command, max_workers=1, request_timeout=600, start_timeout=600, health_interval=30):
+        self.command = command
+        self.max_workers = max(1, max_workers)
+        self.request_timeout = request_timeout
+        self.start_timeout = start_timeout
+        self.health_interval = health_interval
+        self.workers = []
+        self.restarts = 0
+        self._ids = itertools.count()
+        self._cond = None
+        self._health = None
+
+    def _condition(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _worker_command(self, key):
+        raise NotImplementedError
+
+    async def request(self, key, **request):
+        request["id"] = next(self._ids)
+        for attempt in range(2):
+            worker = await self._acquire(key)
+            try:
+                response = await worker.request(request, self.request_timeout)
+            except asyncio.TimeoutError:
+                # A slow render rather than a broken worker, running it again would only double the wait
+                print(f"{self.kind} worker for {key[0]} timed out after {self.request_timeout}s")
+                await self._discard(worker)
+                raise WorkerError(f"{self.kind} request timed out after {self.request_timeout}s")
+            except (WorkerError, BrokenPipeError, ConnectionResetError, json.JSONDecodeError) as e:
+                print(f"{self.kind} worker for {key[0]} failed: {e!r}")
+                await self._discard(worker)
+                self.restarts += 1
+                if attempt == 1:
+                    raise WorkerError(f"{self.kind} worker failed: {e!r}")
+                continue
+            except BaseException:
+                # Cancelled mid-request (client gone, shutdown). The reply still on its
+                # way would be read as the next request's, so the worker can't be reused.
+                self._abandon(worker)
+                raise
+            worker.served += 1
+            await self._release(worker)
+            if not response.get("ok"):
+                raise WorkerError(response.get("error") or f"{self.kind} request failed")
+            return response
+
+    async def warm(self, key):
+        worker = await self._acquire(key)
+        await self._release(worker)
+
+    async def _acquire(self, key):
+        cond = self._condition()
+        victim = None
+        async with cond:
+            while True:
+                self.workers = [w for w in self.workers if w.alive or w.busy]
+                for worker in self.workers:
+                    if worker.key == key and not worker.busy:
+                        worker.busy = True
+                        return worker
+
+                if len(self.workers) >= self.max_workers:
+                    idle = [w for w in self.workers if not w.busy]
+                    if not idle:
+                        await cond.wait()
+                        continue
+                    victim = min(idle, key=lambda w: w.last_used)
+                    self.workers.remove(victim)
+                    print(f"Stopping {self.kind} worker for {victim.key[0]} to load {key[0]}")
+
+                # Reserve the slot before starting so concurrent callers don't overshoot
+                worker = WorkerProcess(key, self._worker_command(key), self.kind)
+                self.workers.append(worker)
+                break
+
+        try:
+            # Stopped outside the lock, so callers with a warm worker aren't held up while it exits
+            if victim is not None:
+                await victim.stop()
+            await worker.start(self.start_timeout)
+        except BaseException:
+            await self._discard(worker)
+            raise
+        return worker
+
+    async def _release(self, worker):
+        cond = self._condition()
+        async with cond:
+            worker.busy = False
+            worker.last_used = time.time()
+            cond.notify_all()
+
+    def _abandon(self, worker):
+        # Killed right away, without awaiting, so nothing can read from it in the meantime
+        if worker.alive:
+            worker.process.kill()
+        asyncio.ensure_future(self._discard(worker))
+
+    async def _discard(self, worker):
+        if worker.process is not None and worker.alive:
+            worker.process.kill()
+            await worker.process.wait()
+        cond = self._condition()
+        async with cond:
+            if worker in self.workers:
+                self.workers.remove(worker)
+            cond.notify_all()
+
+    def start_health_checks(self):
+        if self._health is None:
+            self._health = asyncio.ensure_future(self._check_forever())
+
+    async def _check_forever(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_health()
+            except Exception:
+                traceback.print_exc()
+
+    async def check_health(self):
+        for worker in list(self.workers):
+            if worker.busy:
+                continue
+            worker.busy = True
+            try:
+                healthy = worker.alive and await worker.ping()
+            except Exception:
+                healthy = False
+            if healthy:
+                await self._release(worker)
+            else:
+                print(f"{self.kind} worker for {worker.key[0]} is unhealthy, dropping it")
+                await self._discard(worker)
+
+    async def shutdown(self):
+        if self._health is not None:
+            self._health.cancel()
+            self._health = None
+        for worker in list(self.workers):
+            await worker.stop()
+        self.workers = []
+
+    def stats(self):
+        return {
+            "max_workers": self.max_workers,
+            "restarts": self.restarts,
+            "workers": [w.describe() for w in self.workers],
+        }